@@ -1,95 +1,495 @@
+import argparse
 import asyncio
 import json
+import logging
 import multiprocessing
 import os
+from dataclasses import asdict
+from datetime import datetime
+from functools import partial
+from multiprocessing.pool import Pool
 
 import polars as pl
 from test_env import setup, teardown
 
 import env
-from main import AgentsWorkflow
-from models.score import Score
+from main import AgentsWorkflow, default_model
+from models.score import Score, shutdown_metrics_executor
+from models.score import model as judge_model
 from models.workflow import Workflow
 from tools import set_base_path
-from utils.functional_test import run_functional_test
-from utils.logger import init_state_logger, log_progress, log_score
-from utils.scores import print_scores
+from utils import checkpoint
+from utils.app_types import WorkflowYAML
+from utils.cache import flush_cache_stats
+from utils.checkpoint import Checkpoints, configure_checkpoints
+from utils.functional_test import (
+    FunctionalTestExecutor,
+    FunctionalTestResult,
+    ResourceBudget,
+    act_cache,
+    format_act_cache_report,
+)
+from utils.http_pool import format_connection_report
+from utils.lint import CheckerError, format_lint_cache_report, lint_cache
+from utils.llm_cache import llm_cache_modes, set_llm_cache_mode
+from utils.logger import flush_logs, init_state_logger, log_progress, log_score
+from utils.results_store import ResultsStore, ScoreAggregator
+from utils.scratch import sweep_stale_scratch
+from utils.trace_store import configure_trace_store
+from utils.tracing import (
+    configure_spans,
+    print_span_report,
+    set_workflow_id,
+    write_spans,
+)
+from utils.workspace import WorkspaceProvider
 
 
-def run_agents(workflow: Workflow):
+def run_agents(
+    workflow: Workflow, drafts: int = 1, correction_mode: str = "full"
+) -> tuple[int, WorkflowYAML | None]:
     set_base_path(f"{env.repositories_path}/{workflow.repository_name}")
     init_state_logger(workflow.id, log_to_term=True)
+    set_workflow_id(workflow.id)
     agents_workflow = AgentsWorkflow(
-        f"{env.repositories_path}/{workflow.repository_name}"
+        f"{env.repositories_path}/{workflow.repository_name}",
+        correction_mode=correction_mode,  # type: ignore[arg-type]
     )
     prompt = workflow.get_prompt(1)
-    generated_workflow = agents_workflow.run(prompt)
+    generated_workflow = agents_workflow.run(prompt, drafts)
 
     log_progress(
         f"Generated workflow for {workflow.repository_name}:\n{generated_workflow}"
     )
+    log_progress(format_connection_report())
+    if checkpoint.checkpoints is not None:
+        checkpoint.checkpoints.save("generated", workflow.id, generated_workflow)
+    write_spans()
+    flush_logs()
+    flush_cache_stats()
 
-    return generated_workflow
+    # imap_unordered returns results in completion order, hence the id.
+    return workflow.id, generated_workflow
 
 
-def print_scores_by_tier(scores: list[Score], save_dir: str):
-    with open(os.path.join(save_dir, "scores.jsonl"), "w") as f:
-        for score in scores:
-            f.write(json.dumps(score.to_dict()) + "\n")
-    data = pl.DataFrame(
-        [s.to_dict() for s in scores], infer_schema_length=len(scores), strict=False
-    )
+async def arun_agents(
+    workflow: Workflow,
+    semaphore: asyncio.Semaphore,
+    drafts: int = 1,
+    correction_mode: str = "full",
+):
+    async with semaphore:
+        set_base_path(f"{env.repositories_path}/{workflow.repository_name}")
+        init_state_logger(workflow.id, log_to_term=True)
+        set_workflow_id(workflow.id)
+        agents_workflow = AgentsWorkflow(
+            f"{env.repositories_path}/{workflow.repository_name}",
+            correction_mode=correction_mode,  # type: ignore[arg-type]
+        )
+        prompt = workflow.get_prompt(1)
+        generated_workflow = await agents_workflow.arun(prompt, drafts)
+
+        log_progress(
+            f"Generated workflow for {workflow.repository_name}:\n{generated_workflow}"
+        )
+        if checkpoint.checkpoints is not None:
+            checkpoint.checkpoints.save("generated", workflow.id, generated_workflow)
+
+        return generated_workflow
 
-    print("\n" + "=" * 60)
-    print("OVERALL RESULTS")
-    print("=" * 60)
-    print_scores(data, save_dir, suffix="_overall")
 
-    for tier in ["easy", "medium", "hard"]:
-        tier_scores = [s for s in scores if s.difficulty_tier == tier]
-        if tier_scores:
-            tier_data = pl.DataFrame(
-                [s.to_dict() for s in tier_scores],
-                infer_schema_length=len(tier_scores),
-                strict=False,
+async def generate_stage(
+    pending: list[Workflow],
+    generated: asyncio.Queue,
+    pool: Pool | None,
+    max_in_flight: int,
+    drafts: int,
+    correction_mode: str,
+):
+    """Feeds each workflow to the functional test stage as soon as it is
+    generated, from the process pool or, without one, from this event loop."""
+    if pool is None:
+        semaphore = asyncio.Semaphore(max_in_flight)
+
+        # Each coroutine runs in its own task, so the logger and tool context
+        # variables set in arun_agents stay local to one workflow.
+        async def generate(workflow: Workflow):
+            generated_workflow = await arun_agents(
+                workflow, semaphore, drafts, correction_mode
             )
-            print("\n" + "=" * 60)
-            print(f"{tier.upper()} TIER ({len(tier_scores)} workflows)")
-            print("=" * 60)
-            print_scores(tier_data, save_dir, suffix=f"_{tier}")
+            await generated.put((workflow, generated_workflow))
 
+        await asyncio.gather(*(generate(workflow) for workflow in pending))
+        return
 
-if __name__ == "__main__":
-    workflows = Workflow.load("hard")
-    # workflows = workflows[2:10]
-    scores = []
-    prompt_level = 1
-    for workflow in workflows:
-        setup(workflow)
+    loop = asyncio.get_running_loop()
+    workflows = {workflow.id: workflow for workflow in pending}
+
+    def drain():
+        results = pool.imap_unordered(
+            partial(run_agents, drafts=drafts, correction_mode=correction_mode),
+            pending,
+        )
+        for workflow_id, generated_workflow in results:
+            loop.call_soon_threadsafe(
+                generated.put_nowait, (workflows[workflow_id], generated_workflow)
+            )
+
+    await asyncio.to_thread(drain)
 
-    with multiprocessing.Pool(processes=24) as pool:
-        generated_workflows = pool.map(run_agents, workflows)
 
-    for workflow, generated_workflow in zip(workflows, generated_workflows):
+async def functional_test(
+    workflow: Workflow,
+    generated_workflow: WorkflowYAML | None,
+    tested: asyncio.Queue,
+    checkpoints: Checkpoints,
+    executor: FunctionalTestExecutor,
+):
+    set_workflow_id(workflow.id)
+    if checkpoints.done("functional_test", workflow.id):
+        functional_result = FunctionalTestResult(
+            **checkpoints.load("functional_test", workflow.id)
+        )
+    else:
         log_progress("Running functional test...")
-        functional_result = run_functional_test(
-            generated_workflow,
+        functional_result = await executor.run(
+            generated_workflow,  # type: ignore[arg-type]
             workflow.triggers[0] if workflow.triggers else "push",
             f"{env.repositories_path}/{workflow.repository_name}",
         )
         log_progress("Functional tests completed")
-        score: Score = asyncio.run(
-            Score.new(
-                workflow, generated_workflow, prompt_level, "main", functional_result
+        checkpoints.save("functional_test", workflow.id, asdict(functional_result))
+    await tested.put((workflow, generated_workflow, functional_result))
+
+
+async def functional_test_stage(
+    generated: asyncio.Queue,
+    tested: asyncio.Queue,
+    checkpoints: Checkpoints,
+    executor: FunctionalTestExecutor,
+):
+    """Hands every generated workflow to the executor straight away; the
+    executor bounds how many tests run at once."""
+    tests = []
+    while (item := await generated.get()) is not None:
+        workflow, generated_workflow = item
+        tests.append(
+            asyncio.create_task(
+                functional_test(
+                    workflow, generated_workflow, tested, checkpoints, executor
+                )
             )
         )
-        log_score(score)
-        score.save(f"{env.results_path}/id/{workflow.id}")
-        scores.append(score)
+    await asyncio.gather(*tests)
+
+
+async def scoring_worker(
+    tested: asyncio.Queue,
+    aggregator: ScoreAggregator,
+    prompt_level: int,
+    graph_name: str,
+    total: int,
+    batch_size: int,
+):
+    """Scores the tested workflows in micro-batches: whatever is queued, up to
+    batch_size, is taken at once so that actionlint and zizmor run once per
+    batch. Nothing waits for a batch to fill up."""
+    while True:
+        batch = []
+        item = await tested.get()
+        while item is not None:
+            batch.append(item)
+            if len(batch) == batch_size or tested.empty():
+                break
+            item = tested.get_nowait()
+
+        if batch:
+            try:
+                scores = await Score.new_many(batch, prompt_level, graph_name)
+            except (CheckerError, OSError) as e:
+                # The batch could not be linted at all.
+                scores = [e] * len(batch)
+            for (workflow, _, _), score in zip(batch, scores):
+                set_workflow_id(workflow.id)
+                if isinstance(score, Exception):
+                    # Not checkpointed as scored, so a resumed run retries it.
+                    log_progress(
+                        f"Scoring workflow {workflow.id} failed: {score!r}",
+                        logging.ERROR,
+                    )
+                    continue
+                log_score(score)
+                aggregator.add(score)
+            log_progress(
+                f"Scored {aggregator.overall.count}/{total}: "
+                f"{aggregator.overall.summary()}"
+            )
+        # The sentinel ends this worker only; the others get their own.
+        if item is None:
+            return
+
 
-        teardown(workflow)
+async def run_pipeline(
+    workflows: list[Workflow],
+    checkpoints: Checkpoints,
+    aggregator: ScoreAggregator,
+    pool: Pool | None,
+    workspaces: WorkspaceProvider,
+    args: argparse.Namespace,
+    prompt_level: int,
+    graph_name: str,
+):
+    """Runs generation, functional testing and scoring as overlapping stages
+    connected by queues, each stage with its own concurrency limit."""
+    generated: asyncio.Queue = asyncio.Queue()
+    tested: asyncio.Queue = asyncio.Queue()
+
+    # Scores are only checkpointed once their part is written, so the rows of
+    # scored workflows are in the store; any that are not are scored again.
+    scored = [
+        workflow.id for workflow in workflows if checkpoints.done("scored", workflow.id)
+    ]
+    rows = aggregator.store.scores(scored) if scored else []
+    for row in rows:
+        aggregator.add_row(row)
+    scored_ids = {row["workflow_id"] for row in rows}
+
+    pending = []
+    for workflow in workflows:
+        if workflow.id in scored_ids:
+            continue
+        if checkpoints.done("generated", workflow.id):
+            generated.put_nowait((workflow, checkpoints.load("generated", workflow.id)))
+        else:
+            pending.append(workflow)
+    log_progress(f"Generating {len(pending)}/{len(workflows)} workflows")
+
+    executor = FunctionalTestExecutor(
+        max_concurrent=args.functional_test_concurrency,
+        budget=ResourceBudget(
+            memory_mb=args.functional_test_memory,
+            cpus=args.functional_test_cpus,
+            cpu_seconds=args.functional_test_cpu_seconds,
+        ),
+        workspaces=workspaces,
+    )
+    tester = asyncio.create_task(
+        functional_test_stage(generated, tested, checkpoints, executor)
+    )
+    scorers = [
+        asyncio.create_task(
+            scoring_worker(
+                tested,
+                aggregator,
+                prompt_level,
+                graph_name,
+                len(workflows),
+                args.scoring_batch_size,
+            )
+        )
+        for _ in range(-(-args.scoring_concurrency // args.scoring_batch_size))
+    ]
 
-    print_scores_by_tier(scores, env.results_path)
+    try:
+        await generate_stage(
+            pending,
+            generated,
+            pool,
+            args.max_in_flight,
+            args.drafts,
+            args.correction_mode,
+        )
+        await generated.put(None)
+        await tester
+    finally:
+        executor.shutdown()
+    for _ in scorers:
+        await tested.put(None)
+    await asyncio.gather(*scorers)
+
+
+def print_results(results: ResultsStore, save_dir: str):
+    overall = results.summarize()
+    tiers = results.summarize(["difficulty_tier"])
+
+    with pl.Config(tbl_rows=-1, tbl_cols=-1, tbl_width_chars=200):
+        print("\n" + "=" * 60)
+        print("OVERALL RESULTS")
+        print("=" * 60)
+        print(overall)
+        print("\n" + "=" * 60)
+        print("RESULTS PER TIER")
+        print("=" * 60)
+        print(tiers)
+
+    with open(os.path.join(save_dir, "overview.json"), "w") as f:
+        json.dump({"overall": overall.to_dicts(), "tiers": tiers.to_dicts()}, f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--asyncio",
+        action="store_true",
+        help="generate workflows from a single event loop instead of a process pool",
+    )
+    parser.add_argument("--max-in-flight", type=int, default=200)
+    parser.add_argument(
+        "--functional-test-concurrency",
+        type=int,
+        default=4,
+        help="act invocations running at the same time",
+    )
+    parser.add_argument(
+        "--functional-test-memory",
+        type=int,
+        default=None,
+        help="memory limit in MiB of each act process and of its job containers",
+    )
+    parser.add_argument(
+        "--functional-test-cpus",
+        type=float,
+        default=None,
+        help="CPUs available to the job containers of each functional test",
+    )
+    parser.add_argument(
+        "--functional-test-cpu-seconds",
+        type=int,
+        default=None,
+        help="CPU time limit of each act process",
+    )
+    parser.add_argument(
+        "--scoring-concurrency",
+        type=int,
+        default=32,
+        help="workflows being scored at the same time",
+    )
+    parser.add_argument(
+        "--scoring-batch-size",
+        type=int,
+        default=8,
+        help="tested workflows linted together by one actionlint and zizmor run",
+    )
+    parser.add_argument(
+        "--drafts",
+        type=int,
+        default=1,
+        help="generate this many drafts concurrently and keep the cleanest one",
+    )
+    parser.add_argument(
+        "--correction-mode",
+        choices=["full", "patch"],
+        default="full",
+        help="have the correctors return whole workflows or line-based patches",
+    )
+    parser.add_argument(
+        "--llm-cache",
+        choices=llm_cache_modes,
+        default="off",
+        help="record LLM responses, replay them, or read through the cache",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip the stages that a previous run with the same configuration finished",
+    )
+    args = parser.parse_args()
+    # Set before the pool forks so that the workers inherit them.
+    set_llm_cache_mode(args.llm_cache)
+    run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+    spans_path = f"{env.log_path}/spans/{run_id}"
+    configure_spans(spans_path)
+    configure_trace_store(f"{env.log_path}/traces", run_id)
+
+    dataset = "hard"
+    prompt_level = 1
+    graph_name = "main"
+    checkpoints = configure_checkpoints(
+        f"{env.root}/cache/checkpoints",
+        {
+            "dataset": dataset,
+            "prompt_level": prompt_level,
+            "graph_name": graph_name,
+            "drafts": args.drafts,
+            "correction_mode": args.correction_mode,
+            "generator_model": default_model,
+            "judge_model": judge_model,
+        },
+        resume=args.resume,
+    )
+
+    workflows = Workflow.load(dataset)
+    # workflows = workflows[2:10]
+    lint_cache_baseline = lint_cache.stats()
+    act_cache_baseline = act_cache.stats().get("act")
+    # Scores are checkpointed once their part is written.
+    results = ResultsStore(
+        env.results_path,
+        on_write=lambda workflow_ids, part: [
+            checkpoints.save("scored", workflow_id, None)
+            for workflow_id in workflow_ids
+        ],
+    )
+    # Results of another configuration cannot be resumed from.
+    if not args.resume or results.config() != checkpoints.config_hash:
+        results.reset(checkpoints.config_hash)
+    aggregator = ScoreAggregator(results)
+    # Next to the repositories, so that hard links to them are possible.
+    workspaces = WorkspaceProvider(root=f"{env.repositories_path}/.workspaces")
+    for workflow in workflows:
+        setup(workflow)
+
+    try:
+        if args.asyncio:
+            asyncio.run(
+                run_pipeline(
+                    workflows,
+                    checkpoints,
+                    aggregator,
+                    None,
+                    workspaces,
+                    args,
+                    prompt_level,
+                    graph_name,
+                )
+            )
+        else:
+            # Created before the event loop starts so that the workers are not
+            # forked from a process with a running loop.
+            with multiprocessing.Pool(processes=24) as pool:
+                asyncio.run(
+                    run_pipeline(
+                        workflows,
+                        checkpoints,
+                        aggregator,
+                        pool,
+                        workspaces,
+                        args,
+                        prompt_level,
+                        graph_name,
+                    )
+                )
+    finally:
+        # Only once nothing is being generated any more, as the original
+        # workflows of repositories shared by several workflows would otherwise
+        # reappear.
+        for workflow in workflows:
+            teardown(workflow)
+        shutdown_metrics_executor()
+        # Writes the buffered scores, and checkpoints them, even when a stage
+        # failed, so that a resumed run does not score them again.
+        aggregator.close()
+
+    results.compact()
+    print_results(results, env.results_path)
+    write_spans()
+    flush_logs()
+    print_span_report(
+        spans_path, {workflow.id: workflow.difficulty_tier for workflow in workflows}
+    )
+    print(format_lint_cache_report(since=lint_cache_baseline))
+    print(format_act_cache_report(since=act_cache_baseline))
+    print(format_connection_report())
+    print(workspaces.format_report())
 
-    for filename in os.listdir(env.tmp_path):
-        os.remove(os.path.join(env.tmp_path, filename))
+    sweep_stale_scratch()
@@ -1,17 +1,24 @@
 # from langgraph.graph import MessagesState
 # import json
+import asyncio
 import logging
 
 from utils.app_types import GraphState
+from utils.autofix import autofix_syntax, autofix_vulnerabilities
 from utils.formatting import extract_yaml
 from utils.lint import (
     check_vulnerabilities,
+    check_vulnerabilities_async,
     validate_workflow,
+    validate_workflow_async,
 )
 from utils.logger import log_progress, log_state
+from utils.patch import PatchError, apply_patch, parse_patch
 from utils.scores import extract_judge_score
+from utils.tracing import traced
 
 
+@traced("extract_judge_score")
 def extract_judge_score_function(state: GraphState) -> GraphState:
     log_progress("Extracting judge score")
     state.judge_score = extract_judge_score(str(state.llm_response))  # pyright: ignore
@@ -20,6 +27,7 @@ def extract_judge_score_function(state: GraphState) -> GraphState:
     return state
 
 
+@traced("extract_workflow")
 def extract_workflow_function(state: GraphState) -> GraphState:
     log_progress("Extracting workflow")
     workflow = extract_yaml(str(state.llm_response))  # pyright: ignore
@@ -29,6 +37,25 @@ def extract_workflow_function(state: GraphState) -> GraphState:
     return state
 
 
+@traced("apply_patch")
+def apply_patch_function(state: GraphState) -> GraphState:
+    log_progress("Applying patch")
+    try:
+        hunks = parse_patch(str(state.llm_response))
+        state.workflow = apply_patch(state.workflow, hunks)
+        log_state("apply_patch", state, f"Applied {len(hunks)} hunks")
+        log_progress(f"Applied {len(hunks)} hunks")
+    except PatchError as e:
+        # Models sometimes answer with the whole workflow anyway.
+        workflow = extract_yaml(str(state.llm_response))
+        if workflow is not None:
+            state.workflow = workflow
+        log_state("apply_patch", state, f"Patch rejected: {e}")
+        log_progress(f"Patch rejected: {e}")
+    return state
+
+
+@traced("static_checker")
 def static_checker_function(state: GraphState) -> GraphState:
     log_progress("Running static checker")
     state.static_check = validate_workflow(state.workflow)
@@ -38,6 +65,7 @@ def static_checker_function(state: GraphState) -> GraphState:
     return state
 
 
+@traced("vulnerability_scanner")
 def vulnerability_scanner_function(state: GraphState) -> GraphState:
     log_progress("Running vulnerability scanner")
     log_progress(f"workflow: {state.workflow}", logging.DEBUG)
@@ -48,6 +76,62 @@ def vulnerability_scanner_function(state: GraphState) -> GraphState:
     return state
 
 
+@traced("autofix_syntax")
+def autofix_syntax_function(state: GraphState) -> bool:
+    if state.workflow is None or state.static_check is None:
+        return False
+    state.workflow, applied = autofix_syntax(
+        state.workflow, state.static_check["output"]
+    )
+    if applied:
+        log_state("autofix_syntax", state, ", ".join(applied))
+        log_progress(f"Applied syntax fixes: {', '.join(applied)}")
+    return len(applied) > 0
+
+
+@traced("autofix_vulnerabilities")
+def autofix_vulnerabilities_function(state: GraphState) -> bool:
+    if state.workflow is None or not state.vulnerabilities:
+        return False
+    state.workflow, applied = autofix_vulnerabilities(
+        state.workflow, state.vulnerabilities
+    )
+    if applied:
+        log_state("autofix_vulnerabilities", state, ", ".join(applied))
+        log_progress(f"Applied vulnerability fixes: {', '.join(applied)}")
+    return len(applied) > 0
+
+
+@traced("static_checker")
+async def static_checker_function_async(state: GraphState) -> GraphState:
+    log_progress("Running static checker")
+    state.static_check = await validate_workflow_async(state.workflow)
+    log_state("static_checker", state, state.static_check)
+    log_progress(f"Found {len(state.static_check['output'])} static check issues")
+    log_progress("Static checker completed")
+    return state
+
+
+@traced("vulnerability_scanner")
+async def vulnerability_scanner_function_async(state: GraphState) -> GraphState:
+    log_progress("Running vulnerability scanner")
+    log_progress(f"workflow: {state.workflow}", logging.DEBUG)
+    state.vulnerabilities = await check_vulnerabilities_async(state.workflow)  # type: ignore[assignment]
+    log_state("vulnerability_scanner", state, state.vulnerabilities)  # type: ignore[arg-type]
+    log_progress(f"Found {len(state.vulnerabilities)} vulnerabilities")  # type: ignore[arg-type]
+    log_progress("Vulnerability scanner completed")
+    return state
+
+
+@traced("static_analysis")
+async def static_analysis_function_async(state: GraphState) -> GraphState:
+    await asyncio.gather(
+        static_checker_function_async(state),
+        vulnerability_scanner_function_async(state),
+    )
+    return state
+
+
 # def retry_increment(state: GraphState) -> GraphState:
 #     state.retries_left -= 1
 #     log_state("retry_increment", state, str(state.retries_left))
@@ -1,23 +1,48 @@
+import json
 import logging
+import threading
+from typing import Any
 
 from langchain.agents import create_agent
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import messages_from_dict, messages_to_dict
 from langchain_openai import ChatOpenAI
 
 import env
 from tools import get_tools
 from utils.app_types import Agent, AgentYAML, GraphState
+from utils.http_pool import get_async_http_client, get_http_client
+from utils.llm_cache import acached_call, cached_call, llm_cache_key
 from utils.logger import log_message, log_progress, log_state
+from utils.tracing import FirstResponseHandler, Span, record_llm_usage, span
 
 
-def init_agent(model_yaml: AgentYAML, directory: str) -> Agent:
+_agents: dict[str, Agent] = {}
+
+
+def init_agent(model_yaml: AgentYAML) -> Agent:
+    """Returns the compiled agent for this definition, building it once per process.
+
+    The repository an agent works on is bound at run time through
+    tools.set_base_path.
+    """
+    key = json.dumps(model_yaml, sort_keys=True)
+    if key not in _agents:
+        _agents[key] = _build_agent(model_yaml)
+    return _agents[key]
+
+
+def _build_agent(model_yaml: AgentYAML) -> Agent:
     model_name = model_yaml["model"] if "model" in model_yaml else "openai/gpt-oss-20b"
     model = ChatOpenAI(
         api_key=lambda: env.endpoints["openrouter"]["api_key"],  # type: ignore
         base_url=env.endpoints["openrouter"]["base_url"],  # type: ignore
         model=model_name,  # type: ignore
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
     )
     tools = []
-    tools_by_name = get_tools(directory)
+    tools_by_name = get_tools()
     for tool in model_yaml["tools"]:
         tools.append(tools_by_name[tool])
     # if len(tools) > 0:
@@ -35,16 +60,59 @@ def init_agent(model_yaml: AgentYAML, directory: str) -> Agent:
         "prompt_template": model_yaml["prompt_template"]
         if "prompt_template" in model_yaml
         else "{prompt}",
+        "llm_params": {
+            "system_prompt": model_yaml["system_prompt"],
+            "tools": model_yaml["tools"],
+            "temperature": model.temperature,
+            "top_p": model.top_p,
+            "max_tokens": model.max_tokens,
+            "seed": model.seed,
+        },
     }
 
 
-def call_llm(model: Agent, state: GraphState):
-    log_progress(f"Calling LLM {model['identifier']} ({model['model_name']})")
+class LLMCallCancelled(Exception):
+    pass
+
+
+class CancellationHandler(BaseCallbackHandler):
+    """Stops an agent before its next model or tool call once the event is
+    set. A request already sent to the model still completes."""
+
+    raise_error = True
+
+    def __init__(self, cancelled: threading.Event):
+        self.cancelled = cancelled
+
+    def _check(self) -> None:
+        if self.cancelled.is_set():
+            raise LLMCallCancelled()
+
+    def on_chat_model_start(self, *args: Any, **kwargs: Any) -> None:
+        self._check()
+
+    def on_llm_start(self, *args: Any, **kwargs: Any) -> None:
+        self._check()
+
+    def on_tool_start(self, *args: Any, **kwargs: Any) -> None:
+        self._check()
 
-    prompt = model["prompt_template"].format(**state.__dict__)
-    response = model["model"].invoke(
-        {"messages": [{"role": "user", "content": prompt}]}  # type: ignore[invalid-argument-type]
+
+def _cache_key(model: Agent, prompt: str, variant: int = 0) -> str:
+    # Variants keep otherwise identical calls, such as best-of-N drafts, apart.
+    params = model["llm_params"]
+    if variant:
+        params = {**params, "variant": variant}
+    return llm_cache_key(
+        model["model_name"],
+        [{"role": "user", "content": prompt}],
+        params,
     )
+
+
+def _record_response(
+    model: Agent, state: GraphState, prompt: str, response, record: Span
+):
     state.llm_response = response["messages"][-1].content  # type: ignore[union-attr]
 
     log_message(
@@ -56,7 +124,9 @@ def call_llm(model: Agent, state: GraphState):
                     response["messages"],  # type: ignore[not-subscriptable]
                 )
             ),
-        }
+        },
+        prompt_tokens=record.prompt_tokens,
+        completion_tokens=record.completion_tokens,
     )
     log_state(model["identifier"], state, str(response["messages"][-1].content))  # type: ignore[union-attr]
     log_progress(f"Received response from LLM {model['identifier']}")
@@ -64,6 +134,53 @@ def call_llm(model: Agent, state: GraphState):
     return state
 
 
+def call_llm(
+    model: Agent,
+    state: GraphState,
+    variant: int = 0,
+    cancelled: threading.Event | None = None,
+    **prompt_args,
+):
+    log_progress(f"Calling LLM {model['identifier']} ({model['model_name']})")
+
+    prompt = model["prompt_template"].format(**state.__dict__, **prompt_args)
+    with span(model["identifier"]) as record:
+        callbacks: list[BaseCallbackHandler] = [FirstResponseHandler(record)]
+        if cancelled is not None:
+            callbacks.append(CancellationHandler(cancelled))
+        messages = cached_call(
+            _cache_key(model, prompt, variant),
+            lambda: messages_to_dict(
+                model["model"].invoke(
+                    {"messages": [{"role": "user", "content": prompt}]},  # type: ignore[invalid-argument-type]
+                    config={"callbacks": callbacks},
+                )["messages"]  # type: ignore[index]
+            ),
+        )
+        response = {"messages": messages_from_dict(messages)}
+        record_llm_usage(record, response["messages"])
+    return _record_response(model, state, prompt, response, record)
+
+
+async def acall_llm(model: Agent, state: GraphState, variant: int = 0, **prompt_args):
+    log_progress(f"Calling LLM {model['identifier']} ({model['model_name']})")
+
+    prompt = model["prompt_template"].format(**state.__dict__, **prompt_args)
+    with span(model["identifier"]) as record:
+
+        async def invoke():
+            response = await model["model"].ainvoke(
+                {"messages": [{"role": "user", "content": prompt}]},  # type: ignore[invalid-argument-type]
+                config={"callbacks": [FirstResponseHandler(record)]},
+            )
+            return messages_to_dict(response["messages"])  # type: ignore[index]
+
+        messages = await acached_call(_cache_key(model, prompt, variant), invoke)
+        response = {"messages": messages_from_dict(messages)}
+        record_llm_usage(record, response["messages"])
+    return _record_response(model, state, prompt, response, record)
+
+
 # def build_graph(
 #     name: str, save_graph_image: bool = False
 # ) -> CompiledStateGraph[GraphState, None, GraphState, GraphState]:
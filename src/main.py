@@ -1,23 +1,88 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+from typing import Literal
+
+from openai import APIError
+
 from functions import (
+    apply_patch_function,
+    autofix_syntax_function,
+    autofix_vulnerabilities_function,
     extract_judge_score_function,
     extract_workflow_function,
+    static_analysis_function_async,
     static_checker_function,
+    static_checker_function_async,
     vulnerability_scanner_function,
+    vulnerability_scanner_function_async,
+)
+from graph import LLMCallCancelled, acall_llm, call_llm, init_agent
+from tools import set_base_path
+from utils.app_types import Agent, GraphState, WorkflowYAML
+from utils.llm_cache import LLMCacheMiss, llm_cache_scope
+from utils.logger import log_progress
+from utils.patch import (
+    format_syntax_diagnostics,
+    format_vulnerability_diagnostics,
+    number_lines,
 )
-from graph import call_llm, init_agent
-from utils.app_types import GraphState
+from utils.prevalidate import prevalidate_workflow
+from utils.tracing import traced
 
 # default_model = "qwen/qwen3-coder-next:exacto"
 default_model = "z-ai/glm-4.7-flash"
 # default_model = "openai/gpt-oss-120b:exacto"
 default_retries = 5
 
+patch_system_prompt = """You are an expert devops engineer. Please correct the GitHub Actions workflow by changing only the lines that need to change. No additional explanation is needed. The output format should be a patch against the numbered workflow:
+```patch
+@@ 12-14 @@
+<lines replacing lines 12 to 14>
+@@ 20 @@
+<lines replacing line 20>
+@@ after 31 @@
+<lines inserted after line 31>
+```
+Write replacement lines without line numbers but with their full indentation. A hunk with no lines deletes its range."""
+
+
+# What a single draft can fail with; the other drafts carry on.
+draft_errors = (LLMCallCancelled, LLMCacheMiss, APIError)
+
+
+def draft_cost(state: GraphState) -> tuple[int, int, int]:
+    """Lower is better. A draft the prevalidator rejects ranks below any valid
+    one, however many errors actionlint found in that, and above no draft."""
+    if state.workflow is None:
+        rejection = 2
+    else:
+        rejection = int(bool(prevalidate_workflow(state.workflow)))
+    return (
+        rejection,
+        len(state.static_check["output"]) if state.static_check else 0,
+        len(state.vulnerabilities) if state.vulnerabilities else 0,
+    )
+
 
 class AgentsWorkflow:
-    def __init__(self, directory: str):
-        self.init_agents(directory)
+    def __init__(
+        self,
+        directory: str,
+        render_graph: bool = False,
+        correction_mode: Literal["full", "patch"] = "full",
+    ):
+        self.directory = directory
+        self.correction_mode = correction_mode
+        self.init_agents()
+        if render_graph:
+            # Renders through the mermaid.ink web service, so it stays opt-in.
+            self.generator_agent["model"].get_graph().draw_mermaid_png(
+                output_file_path="generator_agent_graph.png"
+            )
 
-    def init_agents(self, directory: str):
+    def init_agents(self):
         self.generator_agent = init_agent(
             {
                 "identifier": "generator_agent",
@@ -40,10 +105,6 @@ Use the following tools to gather information about the repository and its struc
                     "file_search",
                 ],
             },
-            directory,
-        )
-        self.generator_agent["model"].get_graph().draw_mermaid_png(
-            output_file_path="generator_agent_graph.png"
         )
 
         self.judge_agent = init_agent(
@@ -80,7 +141,6 @@ Here's the workflow:
                     "file_search",
                 ],
             },
-            directory,
         )
 
         self.syntax_corrector_agent = init_agent(
@@ -95,7 +155,6 @@ Here is the workflow:
 {workflow}""",
                 "tools": [],
             },
-            directory,
         )
 
         self.judge_corrector_agent = init_agent(
@@ -113,7 +172,6 @@ and here is the feedback from the evaluator:
 {judgement}""",
                 "tools": [],
             },
-            directory,
         )
 
         self.vulnerability_corrector_agent = init_agent(
@@ -128,9 +186,98 @@ Here is the workflow:
 {workflow}""",
                 "tools": [],
             },
-            directory,
         )
 
+        self.syntax_patch_agent = init_agent(
+            {
+                "identifier": "syntax_patch_agent",
+                "model": default_model,
+                "system_prompt": patch_system_prompt,
+                "prompt_template": """Fix these errors:
+{diagnostics}
+
+Here is the workflow:
+{numbered_workflow}""",
+                "tools": [],
+            },
+        )
+
+        self.judge_patch_agent = init_agent(
+            {
+                "identifier": "judge_patch_agent",
+                "model": default_model,
+                "system_prompt": patch_system_prompt,
+                "prompt_template": """Here is the description of the workflow:
+{prompt}
+
+Here is the workflow:
+{numbered_workflow}
+
+and here is the feedback from the evaluator:
+{diagnostics}""",
+                "tools": [],
+            },
+        )
+
+        self.vulnerability_patch_agent = init_agent(
+            {
+                "identifier": "vulnerability_patch_agent",
+                "model": default_model,
+                "system_prompt": patch_system_prompt,
+                "prompt_template": """Fix these vulnerabilities:
+{diagnostics}
+
+Here is the workflow:
+{numbered_workflow}""",
+                "tools": [],
+            },
+        )
+
+    def correction_step(self, kind: str) -> tuple[Agent, dict[str, str]]:
+        if self.correction_mode == "full":
+            agents = {
+                "syntax": self.syntax_corrector_agent,
+                "judge": self.judge_corrector_agent,
+                "vulnerability": self.vulnerability_corrector_agent,
+            }
+            return agents[kind], {}
+
+        if kind == "syntax":
+            agent = self.syntax_patch_agent
+            diagnostics = format_syntax_diagnostics(
+                self.state.static_check["output"] if self.state.static_check else []
+            )
+        elif kind == "judge":
+            agent = self.judge_patch_agent
+            # The judge's answer is still the latest response at this point.
+            diagnostics = str(self.state.llm_response)
+        else:
+            agent = self.vulnerability_patch_agent
+            diagnostics = format_vulnerability_diagnostics(
+                self.state.vulnerabilities or []
+            )
+        return agent, {
+            "diagnostics": diagnostics,
+            "numbered_workflow": number_lines(self.state.workflow or WorkflowYAML("")),
+        }
+
+    def correct(self, kind: str):
+        agent, prompt_args = self.correction_step(kind)
+        call_llm(agent, self.state, **prompt_args)
+        if self.correction_mode == "patch":
+            apply_patch_function(self.state)
+        else:
+            extract_workflow_function(self.state)
+
+    async def acorrect(self, kind: str):
+        agent, prompt_args = self.correction_step(kind)
+        await acall_llm(agent, self.state, **prompt_args)
+        if self.correction_mode == "patch":
+            apply_patch_function(self.state)
+        else:
+            extract_workflow_function(self.state)
+
+    @traced("fix_syntax")
     def fix_syntax(self):
         static_checker_function(self.state)
 
@@ -139,11 +286,15 @@ Here is the workflow:
             and not self.state.static_check["valid"]
             and self.state.syntax_retries_left > 0
         ):
-            call_llm(self.syntax_corrector_agent, self.state)
-            extract_workflow_function(self.state)
+            # The rules are idempotent, so this falls through to the model
+            # once they stop changing the workflow. A round of rules counts
+            # against the retries like a model correction.
+            if not autofix_syntax_function(self.state):
+                self.correct("syntax")
             static_checker_function(self.state)
             self.state.syntax_retries_left -= 1
 
+    @traced("fix_instruction_following")
     def fix_instruction_following(self):
         call_llm(self.judge_agent, self.state)
         extract_judge_score_function(self.state)
@@ -153,12 +304,12 @@ Here is the workflow:
             and self.state.judge_score < 5
             and self.state.if_retries_left > 0
         ):
-            call_llm(self.judge_corrector_agent, self.state)
-            extract_workflow_function(self.state)
+            self.correct("judge")
             call_llm(self.judge_agent, self.state)
             extract_judge_score_function(self.state)
             self.state.if_retries_left -= 1
 
+    @traced("fix_vulnerabilities")
     def fix_vulnerabilities(self):
         vulnerability_scanner_function(self.state)
 
@@ -167,13 +318,60 @@ Here is the workflow:
             and len(self.state.vulnerabilities) > 0
             and self.state.vuln_retries_left > 0
         ):
-            call_llm(self.vulnerability_corrector_agent, self.state)
-            extract_workflow_function(self.state)
+            if not autofix_vulnerabilities_function(self.state):
+                self.correct("vulnerability")
             vulnerability_scanner_function(self.state)
             self.state.vuln_retries_left -= 1
 
-    def run(self, prompt):
-        self.state = GraphState(
+    @traced("fix_syntax")
+    async def afix_syntax(self):
+        await static_checker_function_async(self.state)
+
+        while (
+            self.state.static_check
+            and not self.state.static_check["valid"]
+            and self.state.syntax_retries_left > 0
+        ):
+            if not autofix_syntax_function(self.state):
+                await self.acorrect("syntax")
+            await static_checker_function_async(self.state)
+            self.state.syntax_retries_left -= 1
+
+    @traced("fix_instruction_following")
+    async def afix_instruction_following(self):
+        await acall_llm(self.judge_agent, self.state)
+        extract_judge_score_function(self.state)
+
+        while (
+            self.state.judge_score
+            and self.state.judge_score < 5
+            and self.state.if_retries_left > 0
+        ):
+            await self.acorrect("judge")
+            await acall_llm(self.judge_agent, self.state)
+            extract_judge_score_function(self.state)
+            self.state.if_retries_left -= 1
+
+    @traced("fix_vulnerabilities")
+    async def afix_vulnerabilities(self):
+        await vulnerability_scanner_function_async(self.state)
+
+        while (
+            self.state.vulnerabilities
+            and len(self.state.vulnerabilities) > 0
+            and self.state.vuln_retries_left > 0
+        ):
+            # Pinning actions resolves refs over the network, so keep it off
+            # the event loop.
+            if not await asyncio.to_thread(
+                autofix_vulnerabilities_function, self.state
+            ):
+                await self.acorrect("vulnerability")
+            await vulnerability_scanner_function_async(self.state)
+            self.state.vuln_retries_left -= 1
+
+    def new_state(self, prompt: str) -> GraphState:
+        return GraphState(
             workflow=None,
             llm_response=None,
             static_check=None,
@@ -186,8 +384,105 @@ Here is the workflow:
             vuln_retries_left=default_retries,
         )
 
-        call_llm(self.generator_agent, self.state)
-        extract_workflow_function(self.state)
+    def generate_draft(
+        self, prompt: str, variant: int, cancelled: threading.Event | None = None
+    ) -> GraphState:
+        state = self.new_state(prompt)
+        call_llm(self.generator_agent, state, variant, cancelled)
+        if cancelled is not None and cancelled.is_set():
+            raise LLMCallCancelled()
+        extract_workflow_function(state)
+        static_checker_function(state)
+        vulnerability_scanner_function(state)
+        return state
+
+    @traced("generate_drafts")
+    def generate_best_draft(self, prompt: str, drafts: int) -> GraphState:
+        best: GraphState | None = None
+        cancelled = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=drafts)
+        try:
+            # Each thread runs in a copy of the caller's context so that the
+            # repository path and log files carry over.
+            futures = [
+                executor.submit(
+                    copy_context().run,
+                    self.generate_draft,
+                    prompt,
+                    variant,
+                    cancelled,
+                )
+                for variant in range(drafts)
+            ]
+            for future in as_completed(futures):
+                try:
+                    state = future.result()
+                except draft_errors as e:
+                    log_progress(f"Draft generation failed: {e}")
+                    continue
+                if best is None or draft_cost(state) < draft_cost(best):
+                    best = state
+                if draft_cost(best) == (0, 0, 0):
+                    break
+        finally:
+            # Drafts still running stop before their next model or tool call
+            # and skip the static checks. Their threads are not waited for, as
+            # a request already sent cannot be interrupted.
+            cancelled.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        if best is None:
+            raise RuntimeError(f"All {drafts} drafts failed")
+        log_progress(f"Selected draft with cost {draft_cost(best)}")
+        return best
+
+    async def agenerate_draft(self, prompt: str, variant: int) -> GraphState:
+        state = self.new_state(prompt)
+        await acall_llm(self.generator_agent, state, variant)
+        extract_workflow_function(state)
+        await static_analysis_function_async(state)
+        return state
+
+    @traced("generate_drafts")
+    async def agenerate_best_draft(self, prompt: str, drafts: int) -> GraphState:
+        best: GraphState | None = None
+        tasks = [
+            asyncio.create_task(self.agenerate_draft(prompt, variant))
+            for variant in range(drafts)
+        ]
+        try:
+            for next_draft in asyncio.as_completed(tasks):
+                try:
+                    state = await next_draft
+                except draft_errors as e:
+                    log_progress(f"Draft generation failed: {e}")
+                    continue
+                if best is None or draft_cost(state) < draft_cost(best):
+                    best = state
+                if draft_cost(best) == (0, 0, 0):
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if best is None:
+            raise RuntimeError(f"All {drafts} drafts failed")
+        log_progress(f"Selected draft with cost {draft_cost(best)}")
+        return best
+
+    def run(self, prompt, drafts: int = 1):
+        set_base_path(self.directory)
+        with llm_cache_scope():
+            return self._run(prompt, drafts)
+
+    def _run(self, prompt, drafts: int):
+        if drafts > 1:
+            self.state = self.generate_best_draft(prompt, drafts)
+        else:
+            self.state = self.new_state(prompt)
+            call_llm(self.generator_agent, self.state)
+            extract_workflow_function(self.state)
         self.fix_syntax()
         self.fix_instruction_following()
         self.fix_vulnerabilities()
@@ -195,3 +490,23 @@ Here is the workflow:
         self.fix_syntax()
 
         return self.state.workflow
+
+    async def arun(self, prompt, drafts: int = 1):
+        set_base_path(self.directory)
+        with llm_cache_scope():
+            return await self._arun(prompt, drafts)
+
+    async def _arun(self, prompt, drafts: int):
+        if drafts > 1:
+            self.state = await self.agenerate_best_draft(prompt, drafts)
+        else:
+            self.state = self.new_state(prompt)
+            await acall_llm(self.generator_agent, self.state)
+            extract_workflow_function(self.state)
+        await self.afix_syntax()
+        await self.afix_instruction_following()
+        await self.afix_vulnerabilities()
+        self.state.syntax_retries_left = default_retries
+        await self.afix_syntax()
+
+        return self.state.workflow
@@ -1,26 +1,62 @@
-import json
-import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
-from typing import Any, cast
+from typing import Any, Sequence, cast
 
 import env
 from models.workflow import Workflow
-from utils.app_types import SyntaxValidationOutput, Vulnerability, WorkflowYAML
-from utils.client import Client
+from utils.app_types import (
+    SyntaxValidation,
+    SyntaxValidationOutput,
+    Vulnerability,
+    WorkflowYAML,
+)
+from utils.client import Client, load_rate_limits
 from utils.functional_test import FunctionalTestResult
-from utils.lint import check_vulnerabilities, validate_workflow
+from utils.lint import (
+    check_vulnerabilities_async,
+    check_vulnerabilities_batch,
+    validate_workflow_async,
+    validate_workflows,
+)
+from utils.llm_cache import llm_cache_scope
 from utils.scores import (
-    calculate_bleu_score,
-    calculate_meteor_score,
+    calculate_similarity_scores,
     extract_judge_score,
     make_judge_prompt,
 )
+from utils.tracing import set_workflow_id, traced
 
 client = Client(
-    env.endpoints["openrouter"]["api_key"], env.endpoints["openrouter"]["base_url"]
+    env.endpoints["openrouter"]["api_key"],
+    env.endpoints["openrouter"]["base_url"],
+    rate_limits=load_rate_limits(),
 )
 model = "openai/gpt-oss-20b"
 
+_metrics_executor: ProcessPoolExecutor | None = None
+
+
+def metrics_executor() -> ProcessPoolExecutor:
+    """Process pool for the CPU-bound text metrics. Its workers are started by
+    a fork server, as the pool is created while threads are running."""
+    global _metrics_executor
+    if _metrics_executor is None:
+        _metrics_executor = ProcessPoolExecutor(
+            mp_context=multiprocessing.get_context("forkserver")
+        )
+    return _metrics_executor
+
+
+def shutdown_metrics_executor() -> None:
+    """Stops the metrics pool's workers; a later metrics_executor() call
+    starts a new pool."""
+    global _metrics_executor
+    if _metrics_executor is not None:
+        _metrics_executor.shutdown()
+        _metrics_executor = None
+
 
 default_prompt_template = """
 You are an expert DevOps engineer. Carefully evaluate whether the provided GitHub Actions workflow accurately and completely implements the requirements described in the accompanying prompt.
@@ -63,25 +99,28 @@ async def run_judgement(
         workflow_yaml=generated_workflow,
     )
 
-    judgement_text = await client.chat(
-        model=model,
-        messages=[
-            {"role": "user", "content": judge_prompt},
-        ],
-    )
-
-    score = extract_judge_score(judgement_text)
-
-    if not score:
+    # The retry sends the same request again; the scope gives it its own
+    # cache entry.
+    with llm_cache_scope():
         judgement_text = await client.chat(
             model=model,
             messages=[
                 {"role": "user", "content": judge_prompt},
             ],
         )
+
         score = extract_judge_score(judgement_text)
+
         if not score:
-            raise ValueError("Failed to extract score from judgement")
+            judgement_text = await client.chat(
+                model=model,
+                messages=[
+                    {"role": "user", "content": judge_prompt},
+                ],
+            )
+            score = extract_judge_score(judgement_text)
+            if not score:
+                raise ValueError("Failed to extract score from judgement")
 
     if not judgement_text:
         raise ValueError("Failed to generate judgement")
@@ -138,52 +177,8 @@ class Score:
             "prompt": self.prompt,
         }
 
-    def save(self, dir: str):
-        os.makedirs(dir, exist_ok=True)
-        with open(f"{dir}/scores.json", "w") as f:
-            json.dump(
-                {
-                    "judge_score": self.judge_score,
-                    "bleu_score": self.bleu_score,
-                    "meteor_score": self.meteor_score,
-                    "lint_valid": self.lint_valid,
-                    "functional_test_fully_ran": self.functional_test.fully_ran,
-                    "functional_test_return_code": self.functional_test.return_code,
-                    "difficulty_tier": self.difficulty_tier,
-                    "difficulty_score": self.difficulty_score,
-                    "graph_name": self.graph_name,
-                    "workflow_id": self.workflow_id,
-                    "prompt_level": self.prompt_level,
-                },
-                f,
-                indent=4,
-            )
-        with open(f"{dir}/prompt.md", "w") as f:
-            f.write(self.prompt)
-        with open(f"{dir}/original_workflow.yaml", "w") as f:
-            f.write(self.original_workflow)
-        with open(f"{dir}/generated_workflow.yaml", "w") as f:
-            f.write(self.generated_workflow)
-        with open(f"{dir}/judgement.md", "w") as f:
-            f.write(self.judgement)
-        with open(f"{dir}/lint_output.json", "w") as f:
-            json.dump(self.lint_output, f, indent=4)
-        with open(f"{dir}/vulnerabilities.json", "w") as f:
-            json.dump(self.vulnerabilities, f, indent=4)
-        with open(f"{dir}/dryrun_output.jsonl", "w") as f:
-            for line in self.functional_test.dryrun_output:
-                f.write(json.dumps(line) + "\n")
-        with open(f"{dir}/dryrun_errors.jsonl", "w") as f:
-            for line in self.functional_test.dryrun_errors:
-                f.write(json.dumps(line) + "\n")
-        with open(f"{dir}/functional_test_output.jsonl", "w") as f:
-            for line in self.functional_test.output:
-                f.write(json.dumps(line) + "\n")
-        with open(f"{dir}/functional_test_errors.jsonl", "w") as f:
-            for line in self.functional_test.errors:
-                f.write(json.dumps(line) + "\n")
-
     @classmethod
+    @traced("score")
     async def new(
         cls,
         workflow: Workflow,
@@ -191,17 +186,40 @@ class Score:
         prompt_level: int,
         graph_name: str,
         functional_result: FunctionalTestResult | None = None,
+        lint_results: SyntaxValidation | None = None,
+        vulnerabilities: list[Vulnerability] | None = None,
     ):
         workflow_yaml = generated_workflow or cast(WorkflowYAML, "")
 
-        lint_results = validate_workflow(workflow_yaml)
-        vulnerabilities = check_vulnerabilities(workflow_yaml)
-        bleu_score = calculate_bleu_score(workflow_yaml, workflow.workflow)
-        meteor_score = calculate_meteor_score(workflow_yaml, workflow.workflow)
-        judgement, judge_score = await run_judgement(
-            default_prompt_template,
-            workflow.get_prompt(prompt_level),
-            workflow_yaml,
+        async def checks():
+            if lint_results is None and vulnerabilities is None:
+                return await asyncio.gather(
+                    validate_workflow_async(workflow_yaml),
+                    check_vulnerabilities_async(workflow_yaml),
+                )
+            if lint_results is None:
+                return await validate_workflow_async(workflow_yaml), vulnerabilities
+            if vulnerabilities is None:
+                return lint_results, await check_vulnerabilities_async(workflow_yaml)
+            return lint_results, vulnerabilities
+
+        (
+            (lint_results, vulnerabilities),
+            (bleu_score, meteor_score),
+            (judgement, judge_score),
+        ) = await asyncio.gather(
+            checks(),
+            asyncio.get_running_loop().run_in_executor(
+                metrics_executor(),
+                calculate_similarity_scores,
+                workflow_yaml,
+                workflow.workflow,
+            ),
+            run_judgement(
+                default_prompt_template,
+                workflow.get_prompt(prompt_level),
+                workflow_yaml,
+            ),
         )
 
         return cls(
@@ -213,7 +231,7 @@ class Score:
             meteor_score=meteor_score,
             lint_valid=lint_results["valid"],
             lint_output=lint_results["output"],
-            vulnerabilities=vulnerabilities,
+            vulnerabilities=vulnerabilities,  # type: ignore[arg-type]
             functional_test=functional_result
             or FunctionalTestResult(
                 fully_ran=False,
@@ -230,3 +248,58 @@ class Score:
             prompt_level=prompt_level,
             prompt=workflow.get_prompt(prompt_level),
         )
+
+    @classmethod
+    async def new_many(
+        cls,
+        workflows: Sequence[
+            tuple[Workflow, WorkflowYAML | None, FunctionalTestResult | None]
+        ],
+        prompt_level: int,
+        graph_name: str,
+        max_concurrent: int = 64,
+    ) -> list["Score | Exception"]:
+        """Scores (workflow, generated workflow, functional test result) triples
+        concurrently in the running event loop, in their order. actionlint and
+        zizmor each run once over the whole batch.
+
+        A workflow that fails to score does not fail the others: its exception
+        is returned in its place."""
+        generated = [
+            generated_workflow or cast(WorkflowYAML, "")
+            for _, generated_workflow, _ in workflows
+        ]
+        lint_results, vulnerabilities = await asyncio.gather(
+            asyncio.to_thread(validate_workflows, generated),
+            asyncio.to_thread(check_vulnerabilities_batch, generated),
+        )
+        semaphore = asyncio.Semaphore(max_concurrent)
+
+        async def score(
+            item: tuple[Workflow, WorkflowYAML | None, FunctionalTestResult | None],
+            lint: SyntaxValidation,
+            found: list[Vulnerability],
+        ) -> "Score":
+            workflow, generated_workflow, functional_result = item
+            # Each coroutine runs in its own task, so this stays local to it.
+            set_workflow_id(workflow.id)
+            async with semaphore:
+                return await cls.new(
+                    workflow,
+                    generated_workflow,
+                    prompt_level,
+                    graph_name,
+                    functional_result,
+                    lint,
+                    found,
+                )
+
+        results = await asyncio.gather(
+            *(score(*args) for args in zip(workflows, lint_results, vulnerabilities)),
+            return_exceptions=True,
+        )
+        for result in results:
+            # Cancellation and the like still stop the whole batch.
+            if isinstance(result, BaseException) and not isinstance(result, Exception):
+                raise result
+        return results  # type: ignore[return-value]
@@ -1,6 +1,12 @@
+from contextvars import ContextVar
+
 import requests
 from langchain.tools import tool
-from langchain_community.agent_toolkits import FileManagementToolkit
+from langchain_community.tools.file_management import (
+    FileSearchTool,
+    ListDirectoryTool,
+    ReadFileTool,
+)
 
 from utils.app_types import WorkflowYAML
 
@@ -11,14 +17,48 @@ from utils.lint import (
     validate_workflow_formatted,
 )
 
-base_path: str = ""
+base_path: ContextVar[str] = ContextVar("base_path", default="")
 
 
 def set_base_path(path: str):
-    global base_path
     if not path.endswith("/"):
         path += "/"
-    base_path = path
+    base_path.set(path)
+
+
+# The file tools resolve the repository at call time rather than when the agent
+# is built, so that compiled agents can be shared between repositories.
+@tool
+def read_file(file_path: str) -> str:
+    """Read file from disk
+
+    Args:
+        file_path: name of file
+    """
+    return ReadFileTool(root_dir=base_path.get()).run({"file_path": file_path})
+
+
+@tool
+def file_search(pattern: str, dir_path: str = ".") -> str:
+    """Recursively search for files in a subdirectory that match the regex pattern
+
+    Args:
+        pattern: Unix shell regex, where * matches everything.
+        dir_path: Subdirectory to search in.
+    """
+    return FileSearchTool(root_dir=base_path.get()).run(
+        {"pattern": pattern, "dir_path": dir_path}
+    )
+
+
+@tool
+def list_directory(dir_path: str = ".") -> str:
+    """List files and directories in a specified folder
+
+    Args:
+        dir_path: Subdirectory to list.
+    """
+    return ListDirectoryTool(root_dir=base_path.get()).run({"dir_path": dir_path})
 
 
 @tool
@@ -55,11 +95,11 @@ def vulnerability_scanner(workflow: WorkflowYAML) -> str | None:
 def read_readme() -> str:
     """Reads the README file."""
     try:
-        with open(base_path + "README.md", "r") as f:
+        with open(base_path.get() + "README.md", "r") as f:
             return f.read()
     except FileNotFoundError:
         try:
-            with open(base_path + "README", "r") as f:
+            with open(base_path.get() + "README", "r") as f:
                 return f.read()
         except FileNotFoundError:
             return "README not found"
@@ -69,11 +109,11 @@ def read_readme() -> str:
 def read_contributing() -> str:
     """Reads the CONTRIBUTING file."""
     try:
-        with open(base_path + "CONTRIBUTING.md", "r") as f:
+        with open(base_path.get() + "CONTRIBUTING.md", "r") as f:
             return f.read()
     except FileNotFoundError:
         try:
-            with open(base_path + "CONTRIBUTING", "r") as f:
+            with open(base_path.get() + "CONTRIBUTING", "r") as f:
                 return f.read()
         except FileNotFoundError:
             return "CONTRIBUTING.md not found"
@@ -103,16 +143,11 @@ def get_action_details(action_name: str) -> str:
     return f"Could not find details for {action_name}"
 
 
-def get_tools(directory: str):
-    files_tools = FileManagementToolkit(
-        root_dir=str(directory),
-        selected_tools=["read_file", "file_search", "list_directory"],
-    ).get_tools()
-    read_file, file_search, list_dir = files_tools
+def get_tools():
     tools = [
         read_file,
         file_search,
-        list_dir,
+        list_directory,
         read_readme,
         read_contributing,
         extract_workflow,
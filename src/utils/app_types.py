@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Literal, NewType, NotRequired, TypedDict
+from typing import Any, Literal, NewType, NotRequired, TypedDict
 
 from langchain_core.language_models import LanguageModelInput
 from langchain_core.messages import AIMessage
@@ -23,6 +23,8 @@ class Agent(TypedDict):
     model_name: str
     # system_prompt: str
     prompt_template: str
+    # System prompt, tool names and sampling parameters, used to key the LLM cache.
+    llm_params: dict[str, Any]
 
 
 class SyntaxValidationOutput(TypedDict):
@@ -0,0 +1,617 @@
+import json
+import os
+import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Literal
+
+import env
+import yaml
+
+from utils.app_types import SyntaxValidationOutput, Vulnerability, WorkflowYAML
+from utils.cache import DiskCache
+
+# Latest major version of common actions, used to upgrade actions whose runtime
+# actionlint reports as too old.
+latest_action_versions = {
+    "actions/cache": "v4",
+    "actions/checkout": "v4",
+    "actions/download-artifact": "v4",
+    "actions/setup-dotnet": "v4",
+    "actions/setup-go": "v5",
+    "actions/setup-java": "v4",
+    "actions/setup-node": "v4",
+    "actions/setup-python": "v5",
+    "actions/upload-artifact": "v4",
+    "docker/build-push-action": "v6",
+    "docker/login-action": "v3",
+    "docker/setup-buildx-action": "v3",
+    "docker/setup-qemu-action": "v3",
+}
+
+deprecated_commands = {
+    "set-output": "GITHUB_OUTPUT",
+    "save-state": "GITHUB_STATE",
+    "set-env": "GITHUB_ENV",
+}
+
+# The commits that action refs resolved to, shared by every process and kept
+# across runs, so that each ref costs one git ls-remote. Refs found missing
+# are cached too; lookups that failed or timed out are retried next time.
+ref_cache = DiskCache(f"{env.root}/cache/refs.sqlite", max_bytes=64 * 1024 * 1024)
+max_concurrent_lookups = 8
+
+
+Value = str | dict[str, str]
+
+
+class Document:
+    """A workflow's text and its node tree.
+
+    Fixers record edits at the positions of the nodes they change, so the rest
+    of the file, comments, quoting and formatting included, stays as written
+    and no scalar goes through a YAML 1.1 load and dump ("3.10" stays 3.10).
+    """
+
+    def __init__(self, text: str, root: yaml.MappingNode):
+        self.text = text
+        self.root = root
+        self.edits: list[tuple[int, int, str]] = []
+
+    def replace(self, node: yaml.Node, replacement: str) -> None:
+        start, end = node.start_mark.index, node.end_mark.index
+        if start == end:
+            # An empty value sits right after its key's colon.
+            replacement = f" {replacement}"
+        self.edits.append((start, end, replacement))
+
+    def set_scalar(self, node: yaml.ScalarNode, value: str) -> None:
+        start, end = node.start_mark.index, node.end_mark.index
+        if node.style == '"' or (node.style == "'" and "\n" in value):
+            self.replace(node, json.dumps(value, ensure_ascii=False))
+            return
+        if node.style == "'":
+            self.replace(node, "'" + value.replace("'", "''") + "'")
+            return
+        if node.style is None:
+            self.replace(node, _format_scalar(value))
+            return
+        # A block scalar's span runs to the next token, over blank lines and
+        # comments, which are kept.
+        content = self.text[start:end].rstrip()
+        indent = _block_indent(content)
+        if indent is None or value.startswith((" ", "\n")):
+            self.edits.append((start, start + len(content), _format_scalar(value)))
+        elif value.endswith("\n\n"):
+            # Kept trailing blank lines are part of the value.
+            self.edits.append((start, end, _block_scalar(value, indent) + "\n"))
+        else:
+            self.edits.append(
+                (start, start + len(content), _block_scalar(value, indent))
+            )
+
+    def insert(self, mapping: yaml.MappingNode, entries: dict[str, Value]) -> None:
+        """Adds entries at the end of a mapping. Values are YAML text; a dict
+        becomes a nested mapping."""
+        if mapping.flow_style:
+            text = ", ".join(f"{key}: {_flow(value)}" for key, value in entries.items())
+            position = self.text.rindex("}", 0, mapping.end_mark.index)
+            self.edits.append(
+                (position, position, f", {text}" if mapping.value else text)
+            )
+            return
+        indent = mapping.value[0][0].start_mark.column
+        lines = []
+        for key, value in entries.items():
+            if isinstance(value, dict):
+                lines.append(f"{' ' * indent}{key}:\n")
+                lines.extend(
+                    f"{' ' * (indent + 2)}{name}: {item}\n"
+                    for name, item in value.items()
+                )
+            else:
+                lines.append(f"{' ' * indent}{key}: {value}\n")
+        position = self._line_end(mapping)
+        text = "".join(lines)
+        if position == len(self.text) and not self.text.endswith("\n"):
+            text = "\n" + text
+        self.edits.append((position, position, text))
+
+    def insert_before(self, key: yaml.Node, text: str) -> None:
+        """Inserts whole lines before the line holding a key."""
+        position = key.start_mark.index - key.start_mark.column
+        self.edits.append((position, position, text))
+
+    def _line_end(self, node: yaml.Node) -> int:
+        """The start of the line after the last value within a node."""
+        while isinstance(node, (yaml.MappingNode, yaml.SequenceNode)) and (
+            node.value and not node.flow_style
+        ):
+            node = (
+                node.value[-1][1]
+                if isinstance(node, yaml.MappingNode)
+                else node.value[-1]
+            )
+        end = node.end_mark.index
+        if isinstance(node, yaml.ScalarNode) and node.style in ("|", ">"):
+            end = node.start_mark.index + len(
+                self.text[node.start_mark.index : end].rstrip()
+            )
+        newline = self.text.find("\n", end)
+        return len(self.text) if newline == -1 else newline + 1
+
+    def result(self) -> WorkflowYAML:
+        text = self.text
+        # Later edits at the same position go after earlier ones.
+        ordered = sorted(
+            enumerate(self.edits), key=lambda e: (e[1][0], e[0]), reverse=True
+        )
+        for _, (start, end, replacement) in ordered:
+            text = text[:start] + replacement + text[end:]
+        return WorkflowYAML(text)
+
+
+def _format_scalar(value: str) -> str:
+    """A plain scalar when it reads back as the same string, otherwise a
+    double-quoted one, which JSON's string syntax is valid for."""
+    if value and "\n" not in value and value == value.strip():
+        try:
+            if yaml.safe_load(f"key: {value}") == {"key": value}:
+                return value
+        except yaml.YAMLError:
+            pass
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _flow(value: Value) -> str:
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{key}: {item}" for key, item in value.items()) + "}"
+    return value
+
+
+def _block_indent(block: str) -> int | None:
+    for line in block.split("\n")[1:]:
+        if line.strip():
+            return len(line) - len(line.lstrip(" "))
+    return None
+
+
+def _block_scalar(value: str, indent: int) -> str:
+    if value.endswith("\n\n"):
+        chomping = "+"
+    elif value.endswith("\n"):
+        chomping = ""
+    else:
+        chomping = "-"
+    lines = value.removesuffix("\n").split("\n")
+    return "\n".join(
+        [f"|{chomping}", *(f"{' ' * indent}{line}" if line else "" for line in lines)]
+    )
+
+
+def _parse(workflow: str) -> Document | None:
+    try:
+        root = yaml.compose(workflow, Loader=yaml.SafeLoader)
+    except yaml.YAMLError:
+        return None
+    return Document(workflow, root) if isinstance(root, yaml.MappingNode) else None
+
+
+def _get(node: yaml.Node | None, key: str) -> yaml.Node | None:
+    if not isinstance(node, yaml.MappingNode):
+        return None
+    for key_node, value_node in node.value:
+        if isinstance(key_node, yaml.ScalarNode) and key_node.value == key:
+            return value_node
+    return None
+
+
+def _string(node: yaml.Node | None) -> str | None:
+    """The value of a string scalar; None for other nodes, nulls included."""
+    if isinstance(node, yaml.ScalarNode) and node.tag == "tag:yaml.org,2002:str":
+        return node.value
+    return None
+
+
+def _is_null(node: yaml.Node) -> bool:
+    return isinstance(node, yaml.ScalarNode) and node.tag == "tag:yaml.org,2002:null"
+
+
+def _jobs(document: Document) -> dict[str, yaml.MappingNode]:
+    jobs = _get(document.root, "jobs")
+    if not isinstance(jobs, yaml.MappingNode):
+        return {}
+    return {
+        str(key.value): job
+        for key, job in jobs.value
+        if isinstance(job, yaml.MappingNode)
+    }
+
+
+def _steps(job: yaml.Node | None) -> list[yaml.MappingNode]:
+    steps = _get(job, "steps")
+    if not isinstance(steps, yaml.SequenceNode):
+        return []
+    return [step for step in steps.value if isinstance(step, yaml.MappingNode)]
+
+
+def _all_steps(document: Document) -> list[tuple[str, yaml.MappingNode]]:
+    return [
+        (job_id, step)
+        for job_id, job in _jobs(document).items()
+        for step in _steps(job)
+    ]
+
+
+def _flagged_steps(
+    document: Document, vulnerabilities: list[Vulnerability]
+) -> list[tuple[str, yaml.MappingNode]]:
+    """Resolves the steps zizmor points at through the symbolic location routes,
+    each step once however many findings point at it."""
+    flagged: dict[int, tuple[str, yaml.MappingNode]] = {}
+    for vulnerability in vulnerabilities:
+        for location in vulnerability["locations"]:
+            components = location["symbolic"]["route"]["components"]
+            path = [next(iter(component.values())) for component in components]
+            if len(path) < 4 or path[0] != "jobs" or path[2] != "steps":
+                continue
+            steps = _get(_jobs(document).get(str(path[1])), "steps")
+            index = path[3]
+            if (
+                isinstance(steps, yaml.SequenceNode)
+                and isinstance(index, int)
+                and index < len(steps.value)
+                and isinstance(steps.value[index], yaml.MappingNode)
+            ):
+                flagged[id(steps.value[index])] = (str(path[1]), steps.value[index])
+    return list(flagged.values())
+
+
+def fix_excessive_permissions(
+    document: Document, vulnerabilities: list[Vulnerability]
+) -> bool:
+    changed = False
+    permissions = _get(document.root, "permissions")
+    if permissions is None:
+        # Insert right after the triggers so the block reads naturally.
+        keys = [key for key, _ in document.root.value]
+        triggers = next(
+            (i for i, key in enumerate(keys) if getattr(key, "value", None) == "on"),
+            None,
+        )
+        if triggers is not None and triggers + 1 < len(keys):
+            document.insert_before(keys[triggers + 1], "permissions: {}\n")
+        else:
+            document.insert(document.root, {"permissions": "{}"})
+        changed = True
+    elif _is_null(permissions) or _string(permissions) == "write-all":
+        document.replace(permissions, "{}")
+        changed = True
+    for job in _jobs(document).values():
+        permissions = _get(job, "permissions")
+        if permissions is not None and _string(permissions) == "write-all":
+            document.replace(permissions, "{contents: read}")
+            changed = True
+    return changed
+
+
+def fix_artipacked(document: Document, vulnerabilities: list[Vulnerability]) -> bool:
+    changed = False
+    for _, step in _all_steps(document):
+        uses = _string(_get(step, "uses"))
+        if uses is None or not uses.startswith("actions/checkout"):
+            continue
+        inputs = _get(step, "with")
+        if inputs is None:
+            document.insert(step, {"with": {"persist-credentials": "false"}})
+        elif _is_null(inputs):
+            document.replace(inputs, "{persist-credentials: false}")
+        elif (
+            isinstance(inputs, yaml.MappingNode)
+            and _get(inputs, "persist-credentials") is None
+        ):
+            document.insert(inputs, {"persist-credentials": "false"})
+        else:
+            continue
+        changed = True
+    return changed
+
+
+expression_pattern = re.compile(r"\$\{\{\s*(.*?)\s*\}\}")
+
+
+def _env_name(expression: str) -> str:
+    return re.sub(r"[^A-Z0-9]+", "_", expression.upper()).strip("_") or "VALUE"
+
+
+def _shell(document: Document, job: yaml.Node | None, step: yaml.MappingNode) -> str:
+    shell = _string(_get(step, "shell"))
+    if shell is not None:
+        return shell
+    for scope in (job, document.root):
+        shell = _string(_get(_get(_get(scope, "defaults"), "run"), "shell"))
+        if shell is not None:
+            return shell
+    runs_on = _get(job, "runs-on")
+    if runs_on is None:
+        return "bash"
+    labels = document.text[runs_on.start_mark.index : runs_on.end_mark.index]
+    return "pwsh" if "windows" in labels.lower() else "bash"
+
+
+ShellKind = Literal["posix", "pwsh", "cmd"]
+
+
+def _shell_kind(shell: str) -> ShellKind | None:
+    """The quoting rules of a step's shell; None for shells such as python,
+    whose scripts are not rewritten."""
+    program = os.path.basename(shell.split()[0]) if shell.strip() else ""
+    if program in ("bash", "sh"):
+        return "posix"
+    if program in ("pwsh", "powershell"):
+        return "pwsh"
+    if program == "cmd":
+        return "cmd"
+    return None
+
+
+def _env_reference(kind: ShellKind, name: str) -> str:
+    if kind == "pwsh":
+        return f"$env:{name}"
+    if kind == "cmd":
+        return f"%{name}%"
+    return f"${{{name}}}"
+
+
+def _open_quote(text: str, escape: str) -> str | None:
+    """Returns the quote left open at the end of a stretch of shell script.
+    Single-quoted text has no escapes, and comments are skipped."""
+    quote = None
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if quote is None and char == "#" and (i == 0 or text[i - 1] in " \t\n;"):
+            newline = text.find("\n", i)
+            i = len(text) if newline == -1 else newline
+        elif char == escape and quote != "'":
+            i += 1
+        elif quote is None and char in "'\"":
+            quote = char
+        elif char == quote:
+            quote = None
+        i += 1
+    return quote
+
+
+def fix_template_injection(
+    document: Document, vulnerabilities: list[Vulnerability]
+) -> bool:
+    changed = False
+    jobs = _jobs(document)
+    # Only the flagged steps: an expression elsewhere may be trusted input, and
+    # moving it into env changes the step for nothing.
+    for job_id, step in _flagged_steps(document, vulnerabilities):
+        run = _get(step, "run")
+        script = _string(run)
+        if script is None or not expression_pattern.search(script):
+            continue
+        env = _get(step, "env")
+        if env is not None and not isinstance(env, yaml.MappingNode):
+            continue
+        kind = _shell_kind(_shell(document, jobs.get(job_id), step))
+        if kind is None:
+            continue
+        existing = {
+            str(key.value): _string(value) for key, value in (env.value if env else [])
+        }
+        added: dict[str, str] = {}
+
+        def replace(match: re.Match[str], quote: str | None) -> str:
+            if quote == "'" and kind == "pwsh":
+                # PowerShell has no way to splice a variable into a
+                # single-quoted argument.
+                return match.group(0)
+            name = _env_name(match.group(1))
+            value = f"${{{{ {match.group(1)} }}}}"
+            if existing.get(name, added.get(name, value)) != value:
+                return match.group(0)
+            if name not in existing:
+                added[name] = value
+            reference = _env_reference(kind, name)
+            # Single quotes would keep the shell from expanding the variable,
+            # so they are closed around it. cmd expands %NAME% within quotes.
+            if quote == "'" and kind == "posix":
+                return f"'\"{reference}\"'"
+            return reference
+
+        # Expressions are substituted before the shell runs, so the quotes
+        # within them do not count.
+        masked = expression_pattern.sub(lambda m: "_" * len(m.group(0)), script)
+        escape = "`" if kind == "pwsh" else "\\"
+        fixed = expression_pattern.sub(
+            lambda m: replace(m, _open_quote(masked[: m.start()], escape)), script
+        )
+        if fixed == script:
+            continue
+        assert isinstance(run, yaml.ScalarNode)
+        document.set_scalar(run, fixed)
+        entries = {name: _format_scalar(value) for name, value in added.items()}
+        if env is None:
+            document.insert(step, {"env": entries})
+        elif entries:
+            document.insert(env, entries)
+        changed = True
+    return changed
+
+
+def _resolve_commit(repository: str, ref: str) -> str | None:
+    key = f"{repository}@{ref}"
+    cached = ref_cache.get("ref", key)
+    if cached is not None:
+        return cached["commit"]
+    try:
+        result = subprocess.run(
+            ["git", "ls-remote", f"https://github.com/{repository}", ref],
+            text=True,
+            capture_output=True,
+            timeout=15,
+            # A missing repository asks for credentials rather than failing.
+            env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+        )
+    except subprocess.TimeoutExpired:
+        return None
+    if result.returncode != 0:
+        return None
+    commits = {}
+    for line in result.stdout.splitlines():
+        sha, _, name = line.partition("\t")
+        commits[name] = sha
+    # Annotated tags list the tagged commit under the peeled "^{}" name.
+    candidates = (f"refs/tags/{ref}^{{}}", f"refs/tags/{ref}", f"refs/heads/{ref}", ref)
+    commit = next((commits[name] for name in candidates if name in commits), None)
+    ref_cache.set("ref", key, {"commit": commit})
+    return commit
+
+
+def _uses_holders(document: Document) -> list[yaml.MappingNode]:
+    """Steps, and jobs calling reusable workflows."""
+    return [step for _, step in _all_steps(document)] + list(_jobs(document).values())
+
+
+def fix_unpinned_uses(document: Document, vulnerabilities: list[Vulnerability]) -> bool:
+    unpinned: list[tuple[yaml.ScalarNode, str, tuple[str, str]]] = []
+    for holder in _uses_holders(document):
+        node = _get(holder, "uses")
+        uses = _string(node)
+        if uses is None or uses.startswith(("./", "docker://")):
+            continue
+        action, _, ref = uses.partition("@")
+        if re.fullmatch(r"[0-9a-f]{40}", ref):
+            continue
+        assert isinstance(node, yaml.ScalarNode)
+        repository = "/".join(action.split("/")[:2])
+        unpinned.append((node, action, (repository, ref or "HEAD")))
+    if not unpinned:
+        return False
+
+    # Each distinct ref is looked up once, all of them at the same time.
+    refs = list(dict.fromkeys(ref for _, _, ref in unpinned))
+    with ThreadPoolExecutor(max_workers=max_concurrent_lookups) as executor:
+        commits = dict(zip(refs, executor.map(lambda r: _resolve_commit(*r), refs)))
+
+    changed = False
+    for node, action, ref in unpinned:
+        if commits[ref]:
+            document.set_scalar(node, f"{action}@{commits[ref]}")
+            changed = True
+    return changed
+
+
+def fix_outdated_actions(
+    document: Document, errors: list[SyntaxValidationOutput]
+) -> bool:
+    changed = False
+    for _, step in _all_steps(document):
+        node = _get(step, "uses")
+        uses = _string(node)
+        if uses is None or "@" not in uses:
+            continue
+        action, ref = uses.split("@", 1)
+        latest = latest_action_versions.get(action)
+        if latest is None or ref == latest:
+            continue
+        if any(f'"{uses}"' in error["message"] for error in errors):
+            assert isinstance(node, yaml.ScalarNode)
+            document.set_scalar(node, f"{action}@{latest}")
+            changed = True
+    return changed
+
+
+def fix_deprecated_commands(
+    document: Document, errors: list[SyntaxValidationOutput]
+) -> bool:
+    changed = False
+    pattern = re.compile(
+        r"""echo\s+(["']?)::(set-output|save-state|set-env)\s+name=([^:]+)::(.*?)\1[ \t]*$""",
+        re.MULTILINE,
+    )
+    add_path = re.compile(r"""echo\s+(["']?)::add-path::(.*?)\1[ \t]*$""", re.MULTILINE)
+    for _, step in _all_steps(document):
+        run = _get(step, "run")
+        script = _string(run)
+        if script is None:
+            continue
+        fixed = pattern.sub(
+            lambda m: (
+                f'echo {m.group(1)}{m.group(3)}={m.group(4)}{m.group(1)} >> "${deprecated_commands[m.group(2)]}"'
+            ),
+            script,
+        )
+        fixed = add_path.sub(
+            lambda m: f'echo {m.group(1)}{m.group(2)}{m.group(1)} >> "$GITHUB_PATH"',
+            fixed,
+        )
+        if fixed != script:
+            assert isinstance(run, yaml.ScalarNode)
+            document.set_scalar(run, fixed)
+            changed = True
+    return changed
+
+
+vulnerability_fixers: dict[str, Callable[[Document, list[Vulnerability]], bool]] = {
+    "excessive-permissions": fix_excessive_permissions,
+    "artipacked": fix_artipacked,
+    "template-injection": fix_template_injection,
+    "unpinned-uses": fix_unpinned_uses,
+}
+
+syntax_fixers: dict[str, Callable[[Document, list[SyntaxValidationOutput]], bool]] = {
+    "action": fix_outdated_actions,
+    "deprecated-commands": fix_deprecated_commands,
+}
+
+
+def autofix_vulnerabilities(
+    workflow: WorkflowYAML, vulnerabilities: list[Vulnerability]
+) -> tuple[WorkflowYAML, list[str]]:
+    """Applies rule-based fixes for zizmor findings.
+
+    Returns the rewritten workflow and the rules that changed it; the workflow
+    is returned untouched when no rule applies.
+    """
+    applied = []
+    for ident in dict.fromkeys(v["ident"] for v in vulnerabilities):
+        if ident not in vulnerability_fixers:
+            continue
+        # Reparsed after every rule, as the node positions have moved.
+        document = _parse(workflow)
+        if document is None:
+            break
+        findings = [v for v in vulnerabilities if v["ident"] == ident]
+        if vulnerability_fixers[ident](document, findings):
+            workflow = document.result()
+            applied.append(ident)
+    return workflow, applied
+
+
+def autofix_syntax(
+    workflow: WorkflowYAML, errors: list[SyntaxValidationOutput]
+) -> tuple[WorkflowYAML, list[str]]:
+    """Applies rule-based fixes for actionlint and pre-validation diagnostics."""
+    applied = []
+    if any(e["message"].startswith('unexpected key "true"') for e in errors):
+        fixed = re.sub(r"^true:", "on:", workflow, flags=re.MULTILINE)
+        if fixed != workflow:
+            workflow = WorkflowYAML(fixed)
+            applied.append("true-key")
+
+    for kind in dict.fromkeys(e["kind"] for e in errors):
+        if kind not in syntax_fixers:
+            continue
+        document = _parse(workflow)
+        if document is None:
+            break
+        if syntax_fixers[kind](document, [e for e in errors if e["kind"] == kind]):
+            workflow = document.result()
+            applied.append(kind)
+    return workflow, applied
@@ -0,0 +1,209 @@
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from dataclasses import dataclass
+from typing import Any
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+
+    @property
+    def lookups(self) -> int:
+        return self.hits + self.misses
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def __sub__(self, other: "CacheStats") -> "CacheStats":
+        return CacheStats(self.hits - other.hits, self.misses - other.misses)
+
+
+def content_hash(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """JSON value cache in a SQLite database shared by every process of a run.
+
+    Connections are opened lazily and per process and thread, so an instance
+    created at import time can be used from fork-based pool workers and from
+    thread pools.
+
+    Lookups only read: hit and miss counts are kept in memory and written
+    every stats_interval seconds, on stats() and on flush_stats(), and an
+    entry's access time is only refreshed once it is touch_interval seconds
+    old, which is all the precision LRU eviction needs.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int | None = None,
+        eviction_interval: int = 100,
+        stats_interval: float = 5.0,
+        touch_interval: float = 60.0,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.eviction_interval = eviction_interval
+        self.stats_interval = stats_interval
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        self._writes = 0
+        self._pending: dict[str, CacheStats] = {}
+        self._pending_pid = os.getpid()
+        self._pending_lock = threading.Lock()
+        self._stats_flushed = time.monotonic()
+        _instances.add(self)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            """CREATE TABLE IF NOT EXISTS entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )"""
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)"
+        )
+        connection.execute(
+            """CREATE TABLE IF NOT EXISTS stats (
+                namespace TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL DEFAULT 0,
+                misses INTEGER NOT NULL DEFAULT 0
+            )"""
+        )
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        return connection
+
+    def get(self, namespace: str, key: str) -> Any | None:
+        connection = self._connect()
+        row = connection.execute(
+            "SELECT value, accessed FROM entries WHERE namespace = ? AND key = ?",
+            (namespace, key),
+        ).fetchone()
+        self._count(namespace, hit=row is not None)
+        if row is None:
+            return None
+        value, accessed = row
+        now = time.time()
+        if now - accessed >= self.touch_interval:
+            connection.execute(
+                "UPDATE entries SET accessed = ? WHERE namespace = ? AND key = ?",
+                (now, namespace, key),
+            )
+        return json.loads(value)
+
+    def _count(self, namespace: str, hit: bool) -> None:
+        with self._pending_lock:
+            if self._pending_pid != os.getpid():
+                # Counts inherited through fork belong to the parent.
+                self._pending, self._pending_pid = {}, os.getpid()
+            stats = self._pending.setdefault(namespace, CacheStats())
+            if hit:
+                stats.hits += 1
+            else:
+                stats.misses += 1
+            due = time.monotonic() - self._stats_flushed >= self.stats_interval
+        if due:
+            self.flush_stats()
+
+    def flush_stats(self) -> None:
+        """Adds the counts of this process's lookups to the shared stats."""
+        with self._pending_lock:
+            if self._pending_pid != os.getpid():
+                self._pending, self._pending_pid = {}, os.getpid()
+            pending, self._pending = self._pending, {}
+            self._stats_flushed = time.monotonic()
+        if not pending:
+            return
+        self._connect().executemany(
+            "INSERT INTO stats (namespace, hits, misses) VALUES (?, ?, ?) "
+            "ON CONFLICT (namespace) DO UPDATE SET "
+            "hits = hits + excluded.hits, misses = misses + excluded.misses",
+            [(namespace, s.hits, s.misses) for namespace, s in pending.items()],
+        )
+
+    def set(self, namespace: str, key: str, value: Any) -> None:
+        connection = self._connect()
+        serialized = json.dumps(value)
+        connection.execute(
+            "INSERT OR REPLACE INTO entries (namespace, key, value, size, accessed) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (namespace, key, serialized, len(serialized), time.time()),
+        )
+        self._writes += 1
+        if self._writes % self.eviction_interval == 0:
+            self.evict()
+
+    def clear(self) -> None:
+        self._connect().execute("DELETE FROM entries")
+
+    def evict(self) -> None:
+        if self.max_bytes is None:
+            return
+        connection = self._connect()
+        (total,) = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+
+        # Trim to 90% of the budget so eviction does not run on every write.
+        target = int(self.max_bytes * 0.9)
+        rows = connection.execute(
+            "SELECT namespace, key, size FROM entries ORDER BY accessed"
+        )
+        stale = []
+        for namespace, key, size in rows:
+            if total <= target:
+                break
+            stale.append((namespace, key))
+            total -= size
+        connection.executemany(
+            "DELETE FROM entries WHERE namespace = ? AND key = ?", stale
+        )
+
+    def stats(self) -> dict[str, CacheStats]:
+        self.flush_stats()
+        rows = self._connect().execute("SELECT namespace, hits, misses FROM stats")
+        return {namespace: CacheStats(hits, misses) for namespace, hits, misses in rows}
+
+
+_instances: "weakref.WeakSet[DiskCache]" = weakref.WeakSet()
+
+
+def flush_cache_stats() -> None:
+    """Writes out the lookup counts of every cache; pool workers skip atexit,
+    so call this at the end of a task."""
+    for instance in list(_instances):
+        instance.flush_stats()
+
+
+atexit.register(flush_cache_stats)
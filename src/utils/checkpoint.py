@@ -0,0 +1,52 @@
+import json
+import os
+from typing import Any, Literal
+
+from utils.cache import DiskCache, content_hash
+
+Stage = Literal["generated", "functional_test", "scored"]
+
+
+class Checkpoints:
+    """Per-workflow results of each benchmark stage, in a SQLite database named
+    after the hash of the run configuration.
+
+    A fresh run clears the checkpoints of earlier runs with the same
+    configuration, so it redoes every stage and a later resume only finds its
+    own.
+    """
+
+    def __init__(self, root: str, config: dict[str, Any], resume: bool = False):
+        serialized = json.dumps(config, sort_keys=True, default=str)
+        self.config_hash = content_hash(serialized)[:16]
+        self.cache = DiskCache(os.path.join(root, f"{self.config_hash}.sqlite"))
+        if not resume:
+            self.cache.clear()
+        os.makedirs(root, exist_ok=True)
+        with open(os.path.join(root, f"{self.config_hash}.json"), "w") as f:
+            f.write(serialized)
+
+    def done(self, stage: Stage, workflow_id: int) -> bool:
+        return self.cache.get(stage, str(workflow_id)) is not None
+
+    def load(self, stage: Stage, workflow_id: int) -> Any:
+        checkpoint = self.cache.get(stage, str(workflow_id))
+        if checkpoint is None:
+            raise KeyError(f"No {stage} checkpoint for workflow {workflow_id}")
+        return checkpoint["value"]
+
+    def save(self, stage: Stage, workflow_id: int, value: Any) -> None:
+        # Wrapped so that a stage that produced None still counts as done.
+        self.cache.set(stage, str(workflow_id), {"value": value})
+
+
+checkpoints: Checkpoints | None = None
+
+
+def configure_checkpoints(
+    root: str, config: dict[str, Any], resume: bool = False
+) -> Checkpoints:
+    """Sets the checkpoints of the run; call before forking pool workers."""
+    global checkpoints
+    checkpoints = Checkpoints(root, config, resume)
+    return checkpoints
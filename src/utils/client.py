@@ -1,40 +1,151 @@
 import asyncio
-from time import sleep
+import weakref
 
-from openai import AsyncOpenAI
+from openai import APIConnectionError, APIStatusError, AsyncOpenAI
 from openai.types.chat import ChatCompletionMessageParam
 
 import env
+from utils.http_pool import get_async_http_client
+from utils.llm_cache import acached_call, llm_cache_key
+from utils.logger import log_progress
+from utils.rate_limit import (
+    ModelRateLimiter,
+    RateLimit,
+    backoff_delay,
+    estimate_tokens,
+    retry_after,
+)
+
+# 429 and 503 mean the provider is at capacity: the whole model backs off.
+# Other transient failures, like the SDK's own retry policy, only delay the
+# request that hit them.
+capacity_status_codes = {429, 503}
+retryable_status_codes = {408, 409, 429}
+
 
-i = 0
+def is_retryable(error: APIConnectionError | APIStatusError) -> bool:
+    """Connection errors and timeouts, and the statuses the OpenAI SDK itself
+    retries."""
+    if isinstance(error, APIConnectionError):
+        return True
+    return error.status_code in retryable_status_codes or error.status_code >= 500
 
 
 class Client:
-    def __init__(self, api_key: str, base_url: str, max_requests: int = 190):
-        self.client: AsyncOpenAI = AsyncOpenAI(
-            api_key=api_key,
-            base_url=base_url,
-        )
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str,
+        max_requests: int = 190,
+        rate_limits: dict[str, RateLimit] | None = None,
+        default_rate_limit: RateLimit | None = None,
+        max_retries: int = 8,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_requests = max_requests
+        # The OpenAI client and the semaphore are created per event loop, as
+        # both end up bound to the loop that first uses them.
+        self.loop_clients: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, tuple[AsyncOpenAI, asyncio.Semaphore]
+        ] = weakref.WeakKeyDictionary()
         self.requests_count: int = 0
-        self.semaphore: asyncio.Semaphore = asyncio.Semaphore(max_requests)
+        self.rate_limits = rate_limits or {}
+        self.default_rate_limit = default_rate_limit or RateLimit()
+        self.max_retries = max_retries
+        self.limiters: dict[str, ModelRateLimiter] = {}
+
+    def loop_client(self) -> tuple[AsyncOpenAI, asyncio.Semaphore]:
+        loop = asyncio.get_running_loop()
+        if loop not in self.loop_clients:
+            self.loop_clients[loop] = (
+                AsyncOpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    http_client=get_async_http_client(),
+                    # Retries are handled in _complete so that they go through
+                    # the rate limiter.
+                    max_retries=0,
+                ),
+                asyncio.Semaphore(self.max_requests),
+            )
+        return self.loop_clients[loop]
+
+    def limiter(self, model: str) -> ModelRateLimiter:
+        if model not in self.limiters:
+            self.limiters[model] = ModelRateLimiter(
+                self.rate_limits.get(model, self.default_rate_limit)
+            )
+        return self.limiters[model]
 
     async def chat(
         self, model: str, messages: list[ChatCompletionMessageParam]
     ) -> str | None:
-        """Send an async chat completion request with semaphore limiting."""
-        sleep(0.1)
-        global i
-
-        async with self.semaphore:
-            i += 1
-            res = await self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-            )
-            return res.choices[0].message.content
+        """Send an async chat completion request within the model's rate limits."""
+        response = await acached_call(
+            llm_cache_key(model, messages, {}),  # type: ignore[arg-type]
+            lambda: self._complete(model, messages),
+        )
+        return response["content"]
+
+    async def _complete(
+        self, model: str, messages: list[ChatCompletionMessageParam]
+    ) -> dict:
+        client, semaphore = self.loop_client()
+        limiter = self.limiter(model)
+        estimated_tokens = estimate_tokens(messages)
+
+        attempt = 0
+        while True:
+            await limiter.acquire(estimated_tokens)
+            async with semaphore:
+                self.requests_count += 1
+                try:
+                    res = await client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                    )
+                    error = None
+                except (APIConnectionError, APIStatusError) as e:
+                    if not is_retryable(e) or attempt >= self.max_retries:
+                        raise
+                    error = e
+
+            if error is not None:
+                if isinstance(error, APIStatusError):
+                    delay = backoff_delay(attempt, retry_after(error.response))
+                    reason = f"returned {error.status_code}"
+                else:
+                    delay = backoff_delay(attempt, None)
+                    reason = f"failed with {type(error).__name__}"
+                log_progress(f"{model} {reason}, retrying in {delay:.1f}s")
+                if (
+                    isinstance(error, APIStatusError)
+                    and error.status_code in capacity_status_codes
+                ):
+                    limiter.pause(delay)
+                else:
+                    await asyncio.sleep(delay)
+                attempt += 1
+                continue
+
+            if res.usage:
+                limiter.settle(estimated_tokens, res.usage.total_tokens)
+            return {
+                "content": res.choices[0].message.content,
+                "usage": res.usage.model_dump() if res.usage else None,
+            }
+
+
+def load_rate_limits() -> dict[str, RateLimit]:
+    return {
+        model: RateLimit(**limit)
+        for model, limit in env.endpoints["openrouter"].get("rate_limits", {}).items()
+    }
 
 
 client = Client(
     api_key=env.endpoints["openrouter"]["api_key"],
     base_url=env.endpoints["openrouter"]["base_url"],
+    rate_limits=load_rate_limits(),
 )
@@ -1,15 +1,27 @@
 from __future__ import annotations
 
+import asyncio
 import json
+import re
 import shutil
 import subprocess
 import tempfile
+import threading
 import traceback
-from dataclasses import dataclass, field
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import copy_context
+from dataclasses import asdict, dataclass, field
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Iterator
 
+import env
+
+from utils.cache import CacheStats, DiskCache, content_hash
+from utils.lint import tool_version
 from utils.logger import log_progress
+from utils.tracing import traced
+from utils.workspace import Workspace, WorkspaceProvider
 
 
 @dataclass
@@ -59,6 +71,93 @@ class MockEvent:
         return base_payload
 
 
+@dataclass
+class ResourceBudget:
+    """Per-test limits. The memory and CPU time limits apply to the act process
+    through prlimit; memory and cpus also limit the job containers act starts."""
+
+    memory_mb: int | None = None
+    cpus: float | None = None
+    cpu_seconds: int | None = None
+
+    def limit_command(self, cmd: list[str]) -> list[str]:
+        limits = []
+        if self.memory_mb is not None:
+            limits.append(f"--data={self.memory_mb * 1024 * 1024}")
+        if self.cpu_seconds is not None:
+            limits.append(f"--cpu={self.cpu_seconds}")
+        if not limits:
+            return cmd
+        if shutil.which("prlimit") is None:
+            log_progress("prlimit not found, running act without resource limits")
+            return cmd
+        return ["prlimit", *limits, "--", *cmd]
+
+    def container_options(self) -> str | None:
+        options = []
+        if self.memory_mb is not None:
+            options.append(f"--memory={self.memory_mb}m")
+        if self.cpus is not None:
+            options.append(f"--cpus={self.cpus}")
+        return " ".join(options) or None
+
+
+DEFAULT_PLATFORMS = {
+    "ubuntu-latest": "catthehacker/ubuntu:full-latest",
+    "ubuntu-22.04": "catthehacker/ubuntu:full-22.04",
+    "ubuntu-20.04": "catthehacker/ubuntu:full-20.04",
+    "ubuntu-18.04": "catthehacker/ubuntu:full-18.04",
+}
+
+# Dry-run results only depend on the inputs in _dryrun_key, so they are shared
+# across runs.
+act_cache = DiskCache(f"{env.root}/cache/act.sqlite", max_bytes=512 * 1024 * 1024)
+
+# act's messages for a workflow it rejects, which running it again would only
+# repeat, as opposed to failures of act itself, docker or the resource limits.
+workflow_error_pattern = re.compile(
+    r"workflow is not valid|unable to read workflow|Could not find any stages to run"
+)
+
+
+def is_deterministic(result: FunctionalTestResult) -> bool:
+    """Whether a dry run would end the same way again: it succeeded, or act
+    rejected the workflow."""
+    if result.return_code is None:
+        return True
+    # A negative code is a signal, such as the one prlimit's CPU limit sends.
+    if result.return_code < 0:
+        return False
+    messages = json.dumps(result.dryrun_output + result.dryrun_errors)
+    return workflow_error_pattern.search(messages) is not None
+
+
+def repository_state(repository_path: str) -> str | None:
+    """HEAD and a hash of the working tree status, or None outside of git."""
+    head = subprocess.run(
+        ["git", "rev-parse", "HEAD"],
+        text=True,
+        capture_output=True,
+        cwd=repository_path,
+    )
+    status = subprocess.run(
+        ["git", "status", "--porcelain", "--untracked-files=all"],
+        text=True,
+        capture_output=True,
+        cwd=repository_path,
+    )
+    if head.returncode != 0 or status.returncode != 0:
+        return None
+    return f"{head.stdout.strip()}:{content_hash(status.stdout)}"
+
+
+def format_act_cache_report(since: CacheStats | None = None) -> str:
+    stats = act_cache.stats().get("act", CacheStats())
+    if since is not None:
+        stats = stats - since
+    return f"act cache: {stats.hits}/{stats.lookups} hits ({stats.hit_rate:.2%})"
+
+
 DEFAULT_MOCK_SECRETS = {
     # "GITHUB_TOKEN": "mock_token_12345",
     "DEPLOY_KEY": "mock_deploy_key",
@@ -89,22 +188,120 @@ def output_to_json(output: str) -> list[dict]:
         ]
 
 
+CommandExecutor = Callable[[list[str], Path, int], subprocess.CompletedProcess[str]]
+
+
+def run_command(
+    cmd: list[str], cwd: Path, timeout: int
+) -> subprocess.CompletedProcess[str]:
+    return subprocess.run(cmd, capture_output=True, text=True, timeout=timeout, cwd=cwd)
+
+
+@dataclass
+class RunnerSlot:
+    repository_path: str | None
+    workspace: Workspace
+    artifacts: Path
+
+
+class RunnerPool:
+    """Keeps up to max_idle slots, each a prepared workspace of a repository
+    and an artifact server directory, warm between functional tests.
+
+    A released slot is reset, its written files undone and its artifacts
+    removed, and handed to the next test of the same repository. Slots beyond
+    max_idle, and every slot on shutdown, are cleaned up.
+    """
+
+    def __init__(self, workspaces: WorkspaceProvider | None = None, max_idle: int = 0):
+        self.workspaces = workspaces or WorkspaceProvider()
+        self.max_idle = max_idle
+        self.idle: list[RunnerSlot] = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, repository_path: str | None) -> Iterator[RunnerSlot]:
+        slot = self.acquire(repository_path)
+        try:
+            yield slot
+        except BaseException:
+            # A failed test may have left anything behind.
+            self._close(slot)
+            raise
+        self.release(slot)
+
+    def acquire(self, repository_path: str | None) -> RunnerSlot:
+        with self.lock:
+            for index in range(len(self.idle) - 1, -1, -1):
+                if self.idle[index].repository_path == repository_path:
+                    return self.idle.pop(index)
+        workspace = self.workspaces.open(repository_path)
+        artifacts = Path(
+            tempfile.mkdtemp(prefix="act_artifacts_", dir=self.workspaces.root)
+        )
+        return RunnerSlot(repository_path, workspace, artifacts)
+
+    def release(self, slot: RunnerSlot) -> None:
+        if self.max_idle <= 0:
+            self._close(slot)
+            return
+        try:
+            self.workspaces.reset(slot.workspace)
+            for artifact in slot.artifacts.iterdir():
+                if artifact.is_dir():
+                    shutil.rmtree(artifact)
+                else:
+                    artifact.unlink()
+        except (OSError, subprocess.CalledProcessError):
+            self._close(slot)
+            return
+        with self.lock:
+            self.idle.append(slot)
+            evicted = self.idle[: -self.max_idle]
+            self.idle = self.idle[-self.max_idle :]
+        for stale in evicted:
+            self._close(stale)
+
+    def _close(self, slot: RunnerSlot) -> None:
+        self.workspaces.close(slot.workspace)
+        shutil.rmtree(slot.artifacts, ignore_errors=True)
+
+    def shutdown(self) -> None:
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for slot in idle:
+            self._close(slot)
+
+
 class WorkflowTestRunner:
     def __init__(
         self,
         mock_secrets: dict[str, str] | None = None,
         timeout: int = 900,
         act_path: str = "act",
+        budget: ResourceBudget | None = None,
+        workspaces: WorkspaceProvider | None = None,
+        platforms: dict[str, str] | None = None,
+        use_cache: bool = True,
+        runner_pool: RunnerPool | None = None,
+        command_executor: CommandExecutor = run_command,
     ):
         self.mock_secrets = {**DEFAULT_MOCK_SECRETS, **(mock_secrets or {})}
         self.timeout = timeout
         self.act_path = act_path
+        self.platforms = platforms or DEFAULT_PLATFORMS
+        self.use_cache = use_cache
+        self.budget = budget or ResourceBudget()
+        # Without a pool, every test gets a fresh slot that is removed after it.
+        self.runner_pool = runner_pool or RunnerPool(workspaces)
+        self.command_executor = command_executor
         self._act_available: bool | None = None
 
     def _build_act_command(
         self,
         workflow_path: Path,
         event_path: Path,
+        artifact_path: Path,
         dryrun: bool = True,
         workflow_name: str | None = None,
     ) -> list[str]:
@@ -122,18 +319,16 @@ class WorkflowTestRunner:
                 "--container-architecture",
                 "linux/amd64",
                 "--artifact-server-path",
-                str(tempfile.mkdtemp("act_artifacts_")),
-                "--platform",
-                "ubuntu-latest=catthehacker/ubuntu:full-latest",
-                "--platform",
-                "ubuntu-22.04=catthehacker/ubuntu:full-22.04",
-                "--platform",
-                "ubuntu-20.04=catthehacker/ubuntu:full-20.04",
-                "--platform",
-                "ubuntu-18.04=catthehacker/ubuntu:full-18.04",
-                "--json",
+                str(artifact_path),
             ]
         )
+        for label, image in self.platforms.items():
+            cmd.extend(["--platform", f"{label}={image}"])
+        cmd.append("--json")
+
+        container_options = self.budget.container_options()
+        if container_options:
+            cmd.extend(["--container-options", container_options])
 
         if workflow_name:
             cmd.extend(["-j", workflow_name])
@@ -141,49 +336,74 @@ class WorkflowTestRunner:
         for secret_name, secret_value in self.mock_secrets.items():
             cmd.extend(["-s", f"{secret_name}={secret_value}"])
 
-        return cmd
+        return self.budget.limit_command(cmd)
+
+    def _dryrun_key(
+        self, workflow_yaml: str, event_payload: str, repository_path: str | None
+    ) -> str | None:
+        state = repository_state(repository_path) if repository_path else ""
+        if state is None:
+            return None
+        return content_hash(
+            tool_version(self.act_path),
+            workflow_yaml,
+            event_payload,
+            state,
+            json.dumps(self.platforms, sort_keys=True),
+            json.dumps(self.mock_secrets, sort_keys=True),
+            # Limits can make act fail where it would otherwise succeed.
+            json.dumps(asdict(self.budget), sort_keys=True),
+        )
 
     def run_test(
         self,
         workflow_yaml: str,
         event_type: str = "push",
         repository_path: str | None = None,
+    ) -> FunctionalTestResult:
+        event_payload = json.dumps(MockEvent(event_type=event_type).to_payload())
+        key = None
+        if self.use_cache:
+            key = self._dryrun_key(workflow_yaml, event_payload, repository_path)
+        if key is not None:
+            cached = act_cache.get("act", key)
+            if cached is not None:
+                log_progress("Using cached act dry-run result")
+                return FunctionalTestResult(**cached)
+
+        result = self._run_test(workflow_yaml, event_payload, repository_path)
+        if key is not None and is_deterministic(result):
+            act_cache.set("act", key, asdict(result))
+        return result
+
+    def _run_test(
+        self,
+        workflow_yaml: str,
+        event_payload: str,
+        repository_path: str | None = None,
     ) -> FunctionalTestResult:
         log_progress("Generating test environment...")
 
-        with tempfile.TemporaryDirectory() as tmpdir:
-            tmpdir_path = Path(tmpdir)
-
-            if repository_path:
-                repo_path = Path(repository_path)
-                for item in repo_path.iterdir():
-                    # if item.name != ".git":
-                    dest = tmpdir_path / item.name
-                    if item.is_dir():
-                        shutil.copytree(item, dest)
-                    else:
-                        shutil.copy2(item, dest)
-
-            workflow_dir = tmpdir_path / ".github" / "workflows"
-            workflow_dir.mkdir(parents=True, exist_ok=True)
+        with self.runner_pool.slot(repository_path) as slot:
+            workspace = slot.workspace
+            tmpdir_path = workspace.path
+            log_progress(
+                f"Workspace ready ({workspace.method}, "
+                f"{workspace.bytes_copied} bytes copied)"
+            )
 
-            workflow_file = workflow_dir / "test_workflow.yml"
-            workflow_file.write_text(workflow_yaml)
+            workflow_file = workspace.write_file(
+                Path(".github") / "workflows" / "test_workflow.yml", workflow_yaml
+            )
 
-            mock_event = MockEvent(event_type=event_type)
-            event_file = tmpdir_path / "event.json"
-            event_file.write_text(json.dumps(mock_event.to_payload()))
+            event_file = workspace.write_file("event.json", event_payload)
 
             log_progress("Running act dry-run to validate workflow...")
 
-            dryrun_cmd = self._build_act_command(workflow_file, event_file, dryrun=True)
-            dryrun_result = subprocess.run(
-                dryrun_cmd,
-                capture_output=True,
-                text=True,
-                timeout=self.timeout,
-                cwd=tmpdir_path,
+            dryrun_cmd = self._build_act_command(
+                workflow_file, event_file, slot.artifacts, dryrun=True
             )
+            dryrun_result = self.command_executor(dryrun_cmd, tmpdir_path, self.timeout)
 
             dryrun_output = output_to_json(dryrun_result.stdout)
 
@@ -201,7 +421,9 @@ class WorkflowTestRunner:
                     return_code=dryrun_result.returncode,
                 )
 
-            # exec_cmd = self._build_act_command(workflow_file, event_file, dryrun=False)
+            # exec_cmd = self._build_act_command(
+            #     workflow_file, event_file, slot.artifacts, dryrun=False
+            # )
 
             # try:
             #     exec_result = subprocess.run(
@@ -246,13 +468,15 @@ class WorkflowTestRunner:
             )
 
 
+@traced("functional_test")
 def run_functional_test(
     workflow_yaml: str,
     event_type: str = "push",
     repository_path: str | None = None,
     mock_secrets: dict[str, str] | None = None,
+    runner: WorkflowTestRunner | None = None,
 ) -> FunctionalTestResult:
-    runner = WorkflowTestRunner(mock_secrets=mock_secrets)
+    runner = runner or WorkflowTestRunner(mock_secrets=mock_secrets)
     try:
         return runner.run_test(workflow_yaml, event_type, repository_path)
     except Exception as e:
@@ -264,3 +488,67 @@ def run_functional_test(
             errors=[{"error": str(e), "traceback": traceback.format_exc()}],
             return_code=None,
         )
+
+
+class FunctionalTestExecutor:
+    """Runs functional tests on a thread pool, with at most max_concurrent act
+    invocations at a time.
+
+    Tests can be submitted as soon as a workflow is generated; the ones beyond
+    the limit wait in the executor's queue.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 4,
+        budget: ResourceBudget | None = None,
+        mock_secrets: dict[str, str] | None = None,
+        timeout: int = 900,
+        workspaces: WorkspaceProvider | None = None,
+        act_path: str = "act",
+        command_executor: CommandExecutor = run_command,
+    ):
+        # One warm slot per concurrent test, so a repository that is tested
+        # again finds its workspace ready.
+        self.runner_pool = RunnerPool(workspaces, max_idle=max_concurrent)
+        self.runner = WorkflowTestRunner(
+            mock_secrets=mock_secrets,
+            timeout=timeout,
+            act_path=act_path,
+            budget=budget,
+            runner_pool=self.runner_pool,
+            command_executor=command_executor,
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_concurrent, thread_name_prefix="functional-test"
+        )
+
+    def submit(
+        self,
+        workflow_yaml: str,
+        event_type: str = "push",
+        repository_path: str | None = None,
+    ) -> Future[FunctionalTestResult]:
+        # Through the caller's context, so the test's span keeps its workflow id.
+        return self.executor.submit(
+            copy_context().run,
+            run_functional_test,
+            workflow_yaml,
+            event_type,
+            repository_path,
+            runner=self.runner,
+        )
+
+    async def run(
+        self,
+        workflow_yaml: str,
+        event_type: str = "push",
+        repository_path: str | None = None,
+    ) -> FunctionalTestResult:
+        return await asyncio.wrap_future(
+            self.submit(workflow_yaml, event_type, repository_path)
+        )
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.runner_pool.shutdown()
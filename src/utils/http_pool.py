@@ -0,0 +1,155 @@
+import asyncio
+import importlib.util
+import os
+import weakref
+from dataclasses import dataclass
+
+import httpx
+
+from utils.logger import log_progress
+
+
+@dataclass
+class HTTPConfig:
+    max_connections: int = 200
+    max_keepalive_connections: int = 100
+    keepalive_expiry: float = 60
+    http2: bool = True
+    timeout: float = 600
+
+
+@dataclass
+class ConnectionStats:
+    requests: int = 0
+    connections_opened: int = 0
+
+    @property
+    def reused(self) -> int:
+        return max(0, self.requests - self.connections_opened)
+
+    @property
+    def reuse_rate(self) -> float:
+        return self.reused / self.requests if self.requests else 0.0
+
+
+http_config = HTTPConfig()
+connection_stats = ConnectionStats()
+
+_pid: int | None = None
+_http2_fallback_logged = False
+_http_client: httpx.Client | None = None
+_default_async_client: httpx.AsyncClient | None = None
+_async_clients: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, httpx.AsyncClient
+] = weakref.WeakKeyDictionary()
+
+
+def configure_http(**kwargs) -> None:
+    """Updates the pool settings; only affects clients created afterwards."""
+    for key, value in kwargs.items():
+        if not hasattr(http_config, key):
+            raise ValueError(f"Unknown HTTP setting: {key}")
+        setattr(http_config, key, value)
+
+
+def _http2_enabled() -> bool:
+    # HTTP/2 needs the optional h2 package (httpx[http2]).
+    global _http2_fallback_logged
+    if not http_config.http2:
+        return False
+    if importlib.util.find_spec("h2") is not None:
+        return True
+    if not _http2_fallback_logged:
+        _http2_fallback_logged = True
+        log_progress("h2 is not installed, falling back to HTTP/1.1")
+    return False
+
+
+def _count(event_name: str) -> None:
+    if event_name == "connection.connect_tcp.complete":
+        connection_stats.connections_opened += 1
+    elif event_name.endswith(".send_request_headers.started"):
+        connection_stats.requests += 1
+
+
+def _trace(event_name: str, info: dict) -> None:
+    _count(event_name)
+
+
+async def _atrace(event_name: str, info: dict) -> None:
+    _count(event_name)
+
+
+def _add_trace(request: httpx.Request) -> None:
+    request.extensions["trace"] = _trace
+
+
+async def _aadd_trace(request: httpx.Request) -> None:
+    request.extensions["trace"] = _atrace
+
+
+def _client_options() -> dict:
+    return {
+        "limits": httpx.Limits(
+            max_connections=http_config.max_connections,
+            max_keepalive_connections=http_config.max_keepalive_connections,
+            keepalive_expiry=http_config.keepalive_expiry,
+        ),
+        "http2": _http2_enabled(),
+        "timeout": http_config.timeout,
+    }
+
+
+def _reset_after_fork() -> None:
+    # Connections inherited from the parent process must not be shared.
+    global _pid, _http_client, _default_async_client
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _http_client = None
+        _default_async_client = None
+        _async_clients.clear()
+        connection_stats.requests = 0
+        connection_stats.connections_opened = 0
+
+
+def get_http_client() -> httpx.Client:
+    global _http_client
+    _reset_after_fork()
+    if _http_client is None:
+        _http_client = httpx.Client(
+            **_client_options(), event_hooks={"request": [_add_trace]}
+        )
+    return _http_client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Returns the pooled async client of the running event loop.
+
+    Pooled connections belong to the loop that opened them, so each loop gets
+    its own client. Outside of a loop, a process-wide client is returned for
+    objects that are built once and then driven by a single long-lived loop.
+    """
+    global _default_async_client
+    _reset_after_fork()
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        if _default_async_client is None:
+            _default_async_client = httpx.AsyncClient(
+                **_client_options(), event_hooks={"request": [_aadd_trace]}
+            )
+        return _default_async_client
+
+    if loop not in _async_clients:
+        _async_clients[loop] = httpx.AsyncClient(
+            **_client_options(), event_hooks={"request": [_aadd_trace]}
+        )
+    return _async_clients[loop]
+
+
+def format_connection_report() -> str:
+    return (
+        f"HTTP connections: {connection_stats.requests} requests over "
+        f"{connection_stats.connections_opened} connections "
+        f"({connection_stats.reuse_rate:.2%} reused)"
+    )
@@ -1,7 +1,10 @@
+import asyncio
 import json
+import os
 import re
 import subprocess
-import uuid
+import weakref
+from functools import cache
 
 import env
 from utils.app_types import (
@@ -10,6 +13,111 @@ from utils.app_types import (
     Vulnerability,
     WorkflowYAML,
 )
+from utils.cache import CacheStats, DiskCache, content_hash
+from utils.logger import log_progress
+from utils.prevalidate import prevalidate_workflow
+from utils.scratch import scratch_dir
+
+lint_cache = DiskCache(f"{env.root}/cache/lint.sqlite", max_bytes=512 * 1024 * 1024)
+
+max_concurrent_checks = os.cpu_count() or 4
+_check_semaphores: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, asyncio.Semaphore
+] = weakref.WeakKeyDictionary()
+
+
+@cache
+def tool_version(tool: str) -> str:
+    flag = "-version" if tool == "actionlint" else "--version"
+    return subprocess.run([tool, flag], text=True, capture_output=True).stdout.strip()
+
+
+def _actionlint_key(workflow: str) -> str:
+    return content_hash(tool_version("actionlint"), workflow)
+
+
+def _zizmor_key(workflow: str, format: str) -> str:
+    return content_hash(tool_version("zizmor"), format, workflow)
+
+
+def format_lint_cache_report(since: dict[str, CacheStats] | None = None) -> str:
+    lines = []
+    for tool, stats in sorted(lint_cache.stats().items()):
+        if since and tool in since:
+            stats = stats - since[tool]
+        lines.append(
+            f"{tool} cache: {stats.hits}/{stats.lookups} hits ({stats.hit_rate:.2%})"
+        )
+    return "\n".join(lines)
+
+
+class CheckerError(RuntimeError):
+    """actionlint failed to run, as opposed to reporting problems."""
+
+
+def _failure(tool: str, process: subprocess.CompletedProcess[str]) -> str:
+    stderr = process.stderr.strip() or "no error output"
+    return f"{tool} exited with {process.returncode}: {stderr}"
+
+
+def _actionlint_errors(
+    process: subprocess.CompletedProcess[str],
+) -> list[SyntaxValidationOutput]:
+    """The problems reported by an actionlint run. actionlint exits with 1 when
+    it reports any and with 0 otherwise; any other run failed, and its output
+    says nothing about the workflow."""
+    if process.returncode == 0 and not process.stdout.strip():
+        return []
+    if process.returncode not in (0, 1):
+        raise CheckerError(_failure("actionlint", process))
+    try:
+        errors = json.loads(process.stdout)
+    except json.JSONDecodeError:
+        raise CheckerError(_failure("actionlint", process)) from None
+    if not isinstance(errors, list) or bool(errors) != (process.returncode == 1):
+        raise CheckerError(_failure("actionlint", process))
+    return errors
+
+
+def _auditable(workflow: str) -> bool:
+    """Whether zizmor can load the workflow at all. It fails on anything the
+    prevalidator rejects, and fails a whole batch over one such file."""
+    return workflow != "" and not prevalidate_workflow(workflow)
+
+
+def _zizmor_output(process: subprocess.CompletedProcess[str]) -> str | None:
+    """The output of a zizmor run, or None if it failed. zizmor exits with 0,
+    or with 10 and up when it reports findings."""
+    if process.returncode == 0 or process.returncode >= 10:
+        return process.stdout
+    log_progress(_failure("zizmor", process))
+    return None
+
+
+def _zizmor_findings(output: str | None) -> list[Vulnerability] | None:
+    if output is None:
+        return None
+    try:
+        return json.loads(output) if output.strip() != "" else []
+    except json.JSONDecodeError:
+        log_progress(f"zizmor output is not JSON: {output[:200]!r}")
+        return None
+
+
+def _normalize_paths(findings: list[Vulnerability]) -> list[Vulnerability]:
+    """Records findings as a single-file run does, so that cached findings do
+    not depend on the scratch path that produced them."""
+    for vulnerability in findings:
+        for location in vulnerability["locations"]:
+            local = location["symbolic"]["key"].get("Local")
+            if local is not None:
+                local["given_path"] = "test.yml"
+    return findings
+
+
+def _write_file(path: str, content: str) -> None:
+    with open(path, "w") as file:
+        file.write(content)
 
 
 def detect_invalid_format(response: WorkflowYAML):
@@ -47,26 +155,36 @@ def validate_workflow(workflow: str | None) -> SyntaxValidation:
             "valid": False,
             "output": [{"message": "Workflow is empty", "kind": "empty"}],
         }
-    unique_id = str(uuid.uuid4())
-    with open(f"{env.tmp_path}/{unique_id}.yml", "w+") as file:
-        file.write(workflow.replace("\ntrue", "\non"))
+    workflow = workflow.replace("\ntrue", "\non")
+    structural_errors = prevalidate_workflow(workflow)
+    if structural_errors:
+        return {"valid": False, "output": structural_errors}
+
+    key = _actionlint_key(workflow)
+    cached = lint_cache.get("actionlint", key)
+    if cached is not None:
+        return cached
 
-    output = subprocess.run(
+    process = subprocess.run(
         [
             "actionlint",
             # "-ignore",
             # "action is too old",
             "-format",
             "{{json .}}",
-            f"{env.tmp_path}/{unique_id}.yml",
+            "-stdin-filename",
+            "test.yml",
+            "-",
         ],
+        input=workflow,
         text=True,
         capture_output=True,
-    ).stdout
+    )
+    errors = _actionlint_errors(process)
 
-    json_output = json.loads(output)
-
-    return {"valid": len(json_output) == 0, "output": json_output}
+    result: SyntaxValidation = {"valid": len(errors) == 0, "output": errors}
+    lint_cache.set("actionlint", key, result)
+    return result
 
 
 def check_vulnerabilities_with_format(
@@ -74,25 +192,175 @@ def check_vulnerabilities_with_format(
 ) -> list[Vulnerability] | str:
     if workflow is None:
         return [] if format == "json" else "Workflow is empty"
-    unique_id = str(uuid.uuid4())
-    with open(f"{env.root}/tmp/{unique_id}.yml", "w+") as file:
-        file.write(workflow)
+    if not _auditable(workflow):
+        return [] if format == "json" else ""
+    key = _zizmor_key(workflow, format)
+    cached = lint_cache.get("zizmor", key)
+    if cached is not None:
+        return cached
 
-    output = subprocess.run(
-        ["zizmor", f"--format={format}", f"{env.root}/tmp/{unique_id}.yml"],
-        text=True,
-        capture_output=True,
-    ).stdout
+    with scratch_dir() as directory:
+        path = os.path.join(directory, "test.yml")
+        _write_file(path, workflow)
+        output = _zizmor_output(
+            subprocess.run(
+                ["zizmor", f"--format={format}", path],
+                text=True,
+                capture_output=True,
+            )
+        )
 
     if format == "github":
+        if output is None:
+            return ""
+        lint_cache.set("zizmor", key, output)
         return output
 
-    if output.strip() == "":
-        return json.loads("[]")
+    findings = _zizmor_findings(output)
+    if findings is None:
+        return []
+    lint_cache.set("zizmor", key, _normalize_paths(findings))
+    return findings
+
+
+def _write_batch(directory: str, workflows: list[str]) -> list[str]:
+    paths = []
+    for index, workflow in enumerate(workflows):
+        path = os.path.join(directory, f"{index}.yml")
+        _write_file(path, workflow)
+        paths.append(path)
+    return paths
+
+
+def validate_workflows(workflows: list[WorkflowYAML | None]) -> list[SyntaxValidation]:
+    results: list[SyntaxValidation] = [
+        {
+            "valid": False,
+            "output": [{"message": "Workflow is empty", "kind": "empty"}],
+        }
+        for _ in workflows
+    ]
+    pending: dict[int, str] = {}
+    for i, workflow in enumerate(workflows):
+        if workflow is None:
+            continue
+        workflow = workflow.replace("\ntrue", "\non")
+        structural_errors = prevalidate_workflow(workflow)
+        if structural_errors:
+            results[i] = {"valid": False, "output": structural_errors}
+            continue
+        cached = lint_cache.get("actionlint", _actionlint_key(workflow))
+        if cached is not None:
+            results[i] = cached
+        else:
+            pending[i] = workflow
+    if not pending:
+        return results
+
+    try:
+        batch = _actionlint_batch(list(pending.values()))
+    except CheckerError as e:
+        if len(pending) == 1:
+            raise
+        log_progress(f"{e}; linting the batch one workflow at a time")
+        for index in pending:
+            results[index] = validate_workflow(workflows[index])
+        return results
+
+    for (index, workflow), errors in zip(pending.items(), batch):
+        results[index] = {"valid": len(errors) == 0, "output": errors}
+        lint_cache.set("actionlint", _actionlint_key(workflow), results[index])
+    return results
+
+
+def _actionlint_batch(workflows: list[str]) -> list[list[SyntaxValidationOutput]]:
+    with scratch_dir() as directory:
+        paths = _write_batch(directory, workflows)
+        errors = _actionlint_errors(
+            subprocess.run(
+                ["actionlint", "-format", "{{json .}}", *paths],
+                text=True,
+                capture_output=True,
+            )
+        )
+
+    by_name: dict[str, list[SyntaxValidationOutput]] = {
+        os.path.basename(path): [] for path in paths
+    }
+    for error in errors:
+        name = os.path.basename(error.get("filepath", ""))
+        if name not in by_name:
+            raise CheckerError(f"actionlint reported an unknown file: {name!r}")
+        # Recorded as in a single-file run, which shares the cache.
+        error["filepath"] = "test.yml"
+        by_name[name].append(error)
+    return [by_name[os.path.basename(path)] for path in paths]
+
+
+def _vulnerability_path(vulnerability: Vulnerability) -> str | None:
+    for location in vulnerability["locations"]:
+        if location["symbolic"]["kind"] == "Primary":
+            return location["symbolic"]["key"]["Local"]["given_path"]
+    return None
+
+
+def check_vulnerabilities_batch(
+    workflows: list[WorkflowYAML | None],
+) -> list[list[Vulnerability]]:
+    results: list[list[Vulnerability]] = [[] for _ in workflows]
+    pending: dict[int, str] = {}
+    for i, workflow in enumerate(workflows):
+        if workflow is None or not _auditable(workflow):
+            # Not sent to zizmor, as it would fail the whole batch.
+            continue
+        cached = lint_cache.get("zizmor", _zizmor_key(workflow, "json"))
+        if cached is not None:
+            results[i] = cached
+        else:
+            pending[i] = workflow
+    if not pending:
+        return results
 
-    json_output = json.loads(output)
+    batch = _zizmor_batch(list(pending.values()))
+    if batch is None:
+        if len(pending) == 1:
+            return results
+        log_progress("Auditing the batch one workflow at a time")
+        for index, workflow in pending.items():
+            results[index] = check_vulnerabilities(workflow)
+        return results
 
-    return json_output
+    for (index, workflow), findings in zip(pending.items(), batch):
+        results[index] = findings
+        lint_cache.set("zizmor", _zizmor_key(workflow, "json"), findings)
+    return results
+
+
+def _zizmor_batch(workflows: list[str]) -> list[list[Vulnerability]] | None:
+    with scratch_dir() as directory:
+        paths = _write_batch(directory, workflows)
+        vulnerabilities = _zizmor_findings(
+            _zizmor_output(
+                subprocess.run(
+                    ["zizmor", "--format=json", *paths],
+                    text=True,
+                    capture_output=True,
+                )
+            )
+        )
+    if vulnerabilities is None:
+        return None
+
+    index_by_name = {os.path.basename(path): i for i, path in enumerate(paths)}
+    findings: list[list[Vulnerability]] = [[] for _ in workflows]
+    for vulnerability in vulnerabilities:
+        path = _vulnerability_path(vulnerability)
+        name = os.path.basename(path) if path else None
+        if name not in index_by_name:
+            log_progress(f"zizmor reported an unknown file: {name!r}")
+            return None
+        findings[index_by_name[name]].append(vulnerability)
+    return [_normalize_paths(found) for found in findings]
 
 
 def check_vulnerabilities(workflow: str | None) -> list[Vulnerability]:
@@ -101,3 +369,90 @@ def check_vulnerabilities(workflow: str | None) -> list[Vulnerability]:
 
 def check_vulnerabilities_formatted(workflow: str | None) -> str:
     return check_vulnerabilities_with_format(workflow, "github")  # type: ignore[invalid-return-type]
+
+
+def _check_semaphore() -> asyncio.Semaphore:
+    # Semaphores are bound to the loop they first wait on, and callers such as
+    # mp_benchmark create a fresh loop per asyncio.run.
+    loop = asyncio.get_running_loop()
+    if loop not in _check_semaphores:
+        _check_semaphores[loop] = asyncio.Semaphore(max_concurrent_checks)
+    return _check_semaphores[loop]
+
+
+async def _run_checker(
+    args: list[str], input: str | None = None
+) -> subprocess.CompletedProcess[str]:
+    async with _check_semaphore():
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.PIPE if input is not None else None,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await process.communicate(
+            input.encode() if input is not None else None
+        )
+    assert process.returncode is not None
+    return subprocess.CompletedProcess(
+        args, process.returncode, stdout.decode(), stderr.decode()
+    )
+
+
+async def validate_workflow_async(workflow: str | None) -> SyntaxValidation:
+    if workflow is None:
+        return {
+            "valid": False,
+            "output": [{"message": "Workflow is empty", "kind": "empty"}],
+        }
+    workflow = workflow.replace("\ntrue", "\non")
+    structural_errors = prevalidate_workflow(workflow)
+    if structural_errors:
+        return {"valid": False, "output": structural_errors}
+
+    key = _actionlint_key(workflow)
+    cached = lint_cache.get("actionlint", key)
+    if cached is not None:
+        return cached
+
+    process = await _run_checker(
+        ["actionlint", "-format", "{{json .}}", "-stdin-filename", "test.yml", "-"],
+        input=workflow,
+    )
+    errors = _actionlint_errors(process)
+
+    result: SyntaxValidation = {"valid": len(errors) == 0, "output": errors}
+    lint_cache.set("actionlint", key, result)
+    return result
+
+
+async def check_vulnerabilities_async(
+    workflow: str | None, format: str = "json"
+) -> list[Vulnerability] | str:
+    if workflow is None:
+        return [] if format == "json" else "Workflow is empty"
+    if not _auditable(workflow):
+        return [] if format == "json" else ""
+    key = _zizmor_key(workflow, format)
+    cached = lint_cache.get("zizmor", key)
+    if cached is not None:
+        return cached
+
+    with scratch_dir() as directory:
+        path = os.path.join(directory, "test.yml")
+        await asyncio.to_thread(_write_file, path, workflow)
+        output = _zizmor_output(
+            await _run_checker(["zizmor", f"--format={format}", path])
+        )
+
+    if format == "github":
+        if output is None:
+            return ""
+        lint_cache.set("zizmor", key, output)
+        return output
+
+    findings = _zizmor_findings(output)
+    if findings is None:
+        return []
+    lint_cache.set("zizmor", key, _normalize_paths(findings))
+    return findings
@@ -0,0 +1,104 @@
+import json
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Iterator, Literal
+
+import env
+
+from utils.cache import DiskCache, content_hash
+
+LLMCacheMode = Literal["off", "record", "replay", "read-through"]
+llm_cache_modes: tuple[LLMCacheMode, ...] = ("off", "record", "replay", "read-through")
+
+# Recorded responses are the ground truth for replayed runs, so they are never
+# evicted.
+llm_cache = DiskCache(f"{env.root}/cache/llm.sqlite")
+mode: LLMCacheMode = "off"
+
+# How often each key was requested in the current scope. A repeated request,
+# such as a fix loop sending the same prompt again or the judge retrying an
+# unparseable answer, is recorded under its own key so that it is resampled
+# rather than served the first response again. Scopes are shared by the
+# threads and tasks started within them, hence the lock.
+_occurrences: ContextVar[dict[str, int] | None] = ContextVar(
+    "llm_cache_occurrences", default=None
+)
+_occurrences_lock = threading.Lock()
+
+
+class LLMCacheMiss(KeyError):
+    pass
+
+
+def set_llm_cache_mode(new_mode: LLMCacheMode) -> None:
+    if new_mode not in llm_cache_modes:
+        raise ValueError(f"Invalid LLM cache mode: {new_mode}")
+    global mode
+    mode = new_mode
+
+
+def llm_cache_key(
+    model: str, messages: list[dict[str, Any]], params: dict[str, Any]
+) -> str:
+    return content_hash(
+        json.dumps(
+            {"model": model, "messages": messages, "params": params},
+            sort_keys=True,
+            default=str,
+        )
+    )
+
+
+@contextmanager
+def llm_cache_scope() -> Iterator[None]:
+    """Numbers repeated requests from zero again, for one workflow run or
+    judgement, so that replayed runs map every request to the same entry."""
+    token = _occurrences.set({})
+    try:
+        yield
+    finally:
+        _occurrences.reset(token)
+
+
+def _occurrence_key(key: str) -> str:
+    occurrences = _occurrences.get()
+    if occurrences is None:
+        return key
+    with _occurrences_lock:
+        occurrence = occurrences.get(key, 0)
+        occurrences[key] = occurrence + 1
+    # The first occurrence keeps the plain key, as recorded before scopes.
+    return key if occurrence == 0 else content_hash(key, str(occurrence))
+
+
+def _lookup(key: str) -> Any | None:
+    if mode not in ("replay", "read-through"):
+        return None
+    value = llm_cache.get("llm", key)
+    if value is None and mode == "replay":
+        raise LLMCacheMiss(f"No recorded LLM response for key {key}")
+    return value
+
+
+def _store(key: str, value: Any) -> None:
+    if mode in ("record", "read-through"):
+        llm_cache.set("llm", key, value)
+
+
+def cached_call(key: str, call: Callable[[], Any]) -> Any:
+    key = _occurrence_key(key)
+    value = _lookup(key)
+    if value is None:
+        value = call()
+        _store(key, value)
+    return value
+
+
+async def acached_call(key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+    key = _occurrence_key(key)
+    value = _lookup(key)
+    if value is None:
+        value = await call()
+        _store(key, value)
+    return value
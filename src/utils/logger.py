@@ -1,32 +1,43 @@
+import atexit
 import json
 import logging
+import os
+import queue
+import threading
+from contextvars import ContextVar
 from datetime import datetime
-from typing import Any
+from typing import Any, Iterator
 
 import env
 
 
 # from models.score import Score
+from utils import trace_store
 from utils.app_types import GraphState, SyntaxValidation, Vulnerability
+from utils.cache import content_hash
 
 logging.basicConfig()
 logger = logging.getLogger("flow")
 logger.setLevel(logging.INFO)
 
-state_file_name = f"{env.log_path}/{datetime.now().strftime('%Y%m%d_%H%M%S')}_state.log"
-messages_file_name = (
-    f"{env.log_path}/{datetime.now().strftime('%Y%m%d_%H%M%S')}_state.log"
+# Context variables rather than globals so that workflows driven concurrently
+# from one event loop each log to their own files.
+state_file_name: ContextVar[str] = ContextVar(
+    "state_file_name",
+    default=f"{env.log_path}/{datetime.now().strftime('%Y%m%d_%H%M%S')}_state.log",
+)
+messages_file_name: ContextVar[str] = ContextVar(
+    "messages_file_name",
+    default=f"{env.log_path}/{datetime.now().strftime('%Y%m%d_%H%M%S')}_state.log",
 )
 
 
 def init_state_logger(id: int, log_to_term: bool = True) -> None:
     logging.getLogger("flow").disabled = not log_to_term
-    global state_file_name
-    state_file_name = (
+    state_file_name.set(
         f"{env.log_path}/{datetime.now().strftime('%Y%m%d_%H%M%S')}_{id}_state.log"
     )
-    global messages_file_name
-    messages_file_name = (
+    messages_file_name.set(
         f"{env.log_path}/{datetime.now().strftime('%Y%m%d_%H%M%S')}_{id}_messages.log"
     )
 
@@ -35,18 +46,152 @@ def log_progress(message: str, level: int = logging.INFO) -> None:
     logger.log(level, message)
 
 
-def log_message(message: str | dict[str, Any], level: int = logging.INFO) -> None:
-    with open(messages_file_name, "a") as f:
-        json.dump(
-            {
-                "log_type": "message",
-                "timestamp": datetime.now().isoformat(),
-                "level": logging.getLevelName(level),
-                "message": message,
-            },
-            f,
+class LogWriter:
+    """Appends log lines from a background thread, in batches.
+
+    Lines are encoded by the caller and only the file I/O happens in the
+    thread, which opens each file once per batch. The thread is started lazily
+    per process, as threads do not survive the fork into pool workers.
+
+    A batch that fails to be written is dropped and its error raised by the
+    next flush; the thread carries on with the following batches.
+    """
+
+    def __init__(self, flush_interval: float = 0.5, max_batch: int = 1000):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.pid: int | None = None
+        self.queue: queue.Queue[tuple[str, str] | threading.Event]
+        self.thread: threading.Thread | None = None
+        self.error: OSError | None = None
+        self.lock = threading.Lock()
+
+    def put(self, path: str, line: str) -> None:
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.queue = queue.Queue()
+                self.thread = None
+                self.error = None
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        self.queue.put((path, line))
+
+    def flush(self, poll_interval: float = 1.0) -> None:
+        """Blocks until every line queued so far is written, and raises the
+        error of any batch that could not be."""
+        if self.pid != os.getpid() or self.thread is None:
+            return
+        flushed = threading.Event()
+        self.queue.put(flushed)
+        # Should the thread die, nothing would ever set the event.
+        while not flushed.wait(poll_interval):
+            if not self.thread.is_alive():
+                raise RuntimeError("Log writer thread stopped")
+        with self.lock:
+            error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def _run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            try:
+                # A flush request ends the batch so that its caller returns
+                # without waiting for the interval.
+                while len(batch) < self.max_batch and not isinstance(
+                    batch[-1], threading.Event
+                ):
+                    batch.append(self.queue.get(timeout=self.flush_interval))
+            except queue.Empty:
+                pass
+            try:
+                self._write(batch)
+            except OSError as e:
+                with self.lock:
+                    self.error = e
+                for item in batch:
+                    if isinstance(item, threading.Event):
+                        item.set()
+
+    def _write(self, batch: list[tuple[str, str] | threading.Event]) -> None:
+        lines: dict[str, list[str]] = {}
+        for item in batch:
+            if isinstance(item, threading.Event):
+                self._write_lines(lines)
+                lines = {}
+                item.set()
+            else:
+                lines.setdefault(item[0], []).append(item[1])
+        self._write_lines(lines)
+
+    @staticmethod
+    def _write_lines(lines: dict[str, list[str]]) -> None:
+        for path, entries in lines.items():
+            with open(path, "a") as f:
+                f.write("".join(entries))
+
+
+log_writer = LogWriter()
+atexit.register(log_writer.flush)
+
+
+def flush_logs() -> None:
+    """Writes out queued log entries; pool workers skip atexit, so call this
+    at the end of a task."""
+    log_writer.flush()
+    if trace_store.trace_sink is not None:
+        trace_store.trace_sink.flush()
+
+
+def _write(path: str, entry: dict[str, Any]) -> None:
+    log_writer.put(path, json.dumps(entry) + "\n")
+
+
+# Hashes of the state fields last logged to each state file, from which the
+# next entry's delta is computed. The lock keeps the deltas in file order when
+# drafts log from several threads.
+_logged_states: dict[str, dict[str, str]] = {}
+_logged_states_lock = threading.Lock()
+
+
+def _state_delta(path: str, state: dict[str, Any]) -> dict[str, Any]:
+    previous = _logged_states.setdefault(path, {})
+    delta = {}
+    for field, value in state.items():
+        digest = content_hash(json.dumps(value, sort_keys=True, default=str))
+        if previous.get(field) != digest:
+            previous[field] = digest
+            delta[field] = value
+    return delta
+
+
+def log_message(
+    message: str | dict[str, Any],
+    level: int = logging.INFO,
+    prompt_tokens: int | None = None,
+    completion_tokens: int | None = None,
+) -> None:
+    timestamp = datetime.now()
+    _write(
+        messages_file_name.get(),
+        {
+            "log_type": "message",
+            "timestamp": timestamp.isoformat(),
+            "level": logging.getLevelName(level),
+            "message": message,
+        },
+    )
+    if trace_store.trace_sink is not None:
+        trace_store.trace_sink.record(
+            "message",
+            logging.getLevelName(level),
+            message,
+            timestamp=timestamp,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
         )
-        f.write("\n")
 
 
 def log_state(
@@ -55,28 +200,55 @@ def log_state(
     message: str | list[Vulnerability] | SyntaxValidation,
     level: int = logging.INFO,
 ) -> None:
-    with open(state_file_name, "a") as f:
-        json.dump(
+    """Logs the fields of the state that changed since the previous entry of
+    the same file; the workflow is identified by its hash and its text is only
+    written when it changes. read_states rebuilds the full states."""
+    path = state_file_name.get()
+    fields = state.to_dict()
+    workflow_hash = content_hash(fields["workflow"] or "")
+    timestamp = datetime.now()
+    with _logged_states_lock:
+        delta = _state_delta(path, fields)
+        _write(
+            path,
             {
                 "log_type": "storyline",
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": timestamp.isoformat(),
                 "level": logging.getLevelName(level),
                 "step": step,
-                "state": state.to_dict(),
+                "state_delta": delta,
+                "workflow_hash": workflow_hash,
                 "message": message,
             },
-            f,
         )
-        f.write("\n")
+    if trace_store.trace_sink is not None:
+        trace_store.trace_sink.record(
+            "storyline",
+            logging.getLevelName(level),
+            message,
+            step=step,
+            timestamp=timestamp,
+            workflow_hash=workflow_hash,
+            state_delta=delta,
+        )
+
+
+def read_states(path: str) -> Iterator[dict[str, Any]]:
+    """Yields the entries of a state log, with the full state of storyline
+    entries rebuilt from their deltas."""
+    state: dict[str, Any] = {}
+    with open(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            if "state_delta" in entry:
+                state.update(entry.pop("state_delta"))
+                entry["state"] = dict(state)
+            yield entry
 
 
 def log_score(score):
-    with open(state_file_name, "a") as f:
-        json.dump({"log_type": "score", **score.to_dict()}, f)
-        f.write("\n")
+    _write(state_file_name.get(), {"log_type": "score", **score.to_dict()})
 
 
 def log_graph(graph):
-    with open(state_file_name, "a") as f:
-        json.dump({"log_type": "graph", **graph}, f)
-        f.write("\n")
+    _write(state_file_name.get(), {"log_type": "graph", **graph})
@@ -0,0 +1,104 @@
+import re
+from dataclasses import dataclass
+
+import yaml
+
+from utils.app_types import SyntaxValidationOutput, Vulnerability, WorkflowYAML
+
+patch_pattern = re.compile(r"```patch\n([\s\S]*?)```")
+hunk_header_pattern = re.compile(r"^@@ (?:(\d+)(?:-(\d+))?|after (\d+)) @@\s*$")
+
+
+class PatchError(ValueError):
+    pass
+
+
+@dataclass
+class Hunk:
+    # Lines start..end (1-based, inclusive) are replaced; an insertion after
+    # line n is the empty range start=n + 1, end=n.
+    start: int
+    end: int
+    lines: list[str]
+
+
+def number_lines(workflow: WorkflowYAML) -> str:
+    lines = workflow.split("\n")
+    width = len(str(len(lines)))
+    return "\n".join(f"{i:>{width}} | {line}" for i, line in enumerate(lines, 1))
+
+
+def format_syntax_diagnostics(errors: list[SyntaxValidationOutput]) -> str:
+    return "\n".join(
+        f"line {error.get('line', 0)}, column {error.get('column', 0)}: {error['message']}"
+        for error in errors
+    )
+
+
+def format_vulnerability_diagnostics(vulnerabilities: list[Vulnerability]) -> str:
+    diagnostics = []
+    for vulnerability in vulnerabilities:
+        for location in vulnerability["locations"]:
+            span = location["concrete"]["location"]
+            start = span["start_point"]["row"] + 1
+            end = span["end_point"]["row"] + 1
+            lines = f"line {start}" if start == end else f"lines {start}-{end}"
+            annotation = location["symbolic"]["annotation"]
+            diagnostics.append(
+                f"{lines}: {vulnerability['ident']}: {vulnerability['desc']} ({annotation})"
+            )
+    return "\n".join(diagnostics)
+
+
+def parse_patch(text: str) -> list[Hunk]:
+    match = re.search(patch_pattern, text)
+    if not match:
+        raise PatchError("No ```patch block in response")
+
+    hunks: list[Hunk] = []
+    for line in match.group(1).split("\n"):
+        header = hunk_header_pattern.match(line)
+        if header:
+            if header.group(3) is not None:
+                after = int(header.group(3))
+                hunks.append(Hunk(after + 1, after, []))
+            else:
+                start = int(header.group(1))
+                end = int(header.group(2) or start)
+                hunks.append(Hunk(start, end, []))
+        elif hunks:
+            hunks[-1].lines.append(line)
+        elif line.strip():
+            raise PatchError(f"Patch content before the first hunk header: {line!r}")
+
+    if not hunks:
+        raise PatchError("Patch has no hunks")
+    # The closing fence follows a newline, which leaves one empty line behind.
+    if hunks[-1].lines and hunks[-1].lines[-1] == "":
+        hunks[-1].lines.pop()
+    return hunks
+
+
+def apply_patch(workflow: WorkflowYAML | None, hunks: list[Hunk]) -> WorkflowYAML:
+    if workflow is None:
+        # The generator gave no workflow; there are no lines to refer to.
+        raise PatchError("No workflow to patch")
+    lines = workflow.split("\n")
+    previous_end = 0
+    for hunk in sorted(hunks, key=lambda h: (h.start, h.end)):
+        if hunk.start < 1 or hunk.end > len(lines) or hunk.end < hunk.start - 1:
+            raise PatchError(f"Hunk {hunk.start}-{hunk.end} is out of range")
+        if hunk.start <= previous_end:
+            raise PatchError(f"Hunk {hunk.start}-{hunk.end} overlaps another hunk")
+        previous_end = hunk.end
+
+    # Apply bottom-up so earlier line numbers stay valid.
+    for hunk in sorted(hunks, key=lambda h: (h.start, h.end), reverse=True):
+        lines[hunk.start - 1 : hunk.end] = hunk.lines
+
+    patched = WorkflowYAML("\n".join(lines))
+    try:
+        yaml.safe_load(patched)
+    except yaml.YAMLError as e:
+        raise PatchError(f"Patched workflow is not valid YAML: {e}") from e
+    return patched
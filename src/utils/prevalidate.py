@@ -0,0 +1,166 @@
+import yaml
+from yaml.nodes import MappingNode, Node, ScalarNode, SequenceNode
+
+from utils.app_types import SyntaxValidationOutput
+
+node_kinds = {
+    MappingNode: "mapping",
+    SequenceNode: "sequence",
+    ScalarNode: "scalar",
+}
+
+
+def _diagnostic(
+    message: str, node: Node | None, lines: list[str]
+) -> SyntaxValidationOutput:
+    diagnostic: SyntaxValidationOutput = {"message": message, "kind": "syntax-check"}
+    if node is not None:
+        line = node.start_mark.line
+        diagnostic["line"] = line + 1
+        diagnostic["column"] = node.start_mark.column + 1
+        if line < len(lines):
+            diagnostic["snippet"] = lines[line]
+    return diagnostic
+
+
+def _kind(node: Node) -> str:
+    return node_kinds.get(type(node), "unknown")
+
+
+def _mapping(node: MappingNode) -> dict[str, tuple[ScalarNode, Node]]:
+    return {
+        key.value: (key, value)
+        for key, value in node.value
+        if isinstance(key, ScalarNode)
+    }
+
+
+def _check_steps(
+    job_id: str, steps: Node, lines: list[str]
+) -> list[SyntaxValidationOutput]:
+    if not isinstance(steps, SequenceNode):
+        return [
+            _diagnostic(
+                f'"steps" section in job "{job_id}" must be sequence node but got {_kind(steps)} node',
+                steps,
+                lines,
+            )
+        ]
+
+    errors = []
+    for step in steps.value:
+        if not isinstance(step, MappingNode):
+            errors.append(
+                _diagnostic(
+                    f'step in job "{job_id}" must be mapping node but got {_kind(step)} node',
+                    step,
+                    lines,
+                )
+            )
+        elif not {"run", "uses"} & _mapping(step).keys():
+            errors.append(
+                _diagnostic(
+                    'step must run script with "run" section or run action with "uses" section',
+                    step,
+                    lines,
+                )
+            )
+    return errors
+
+
+def _check_job(
+    job_id: str, key: Node, job: Node, lines: list[str]
+) -> list[SyntaxValidationOutput]:
+    if not isinstance(job, MappingNode):
+        return [
+            _diagnostic(
+                f'job "{job_id}" must be mapping node but got {_kind(job)} node',
+                job,
+                lines,
+            )
+        ]
+
+    sections = _mapping(job)
+    # Reusable workflow calls get their runner and steps from the callee.
+    if "uses" in sections:
+        return []
+
+    errors = []
+    if "runs-on" not in sections:
+        errors.append(
+            _diagnostic(f'"runs-on" section is missing in job "{job_id}"', key, lines)
+        )
+    if "steps" not in sections:
+        errors.append(
+            _diagnostic(f'"steps" section is missing in job "{job_id}"', key, lines)
+        )
+    else:
+        errors.extend(_check_steps(job_id, sections["steps"][1], lines))
+    return errors
+
+
+def prevalidate_workflow(workflow: str) -> list[SyntaxValidationOutput]:
+    """Finds structural errors in a workflow without spawning actionlint.
+
+    Only problems that actionlint would also report are returned, so an empty
+    list means the workflow still has to go through actionlint.
+    """
+    lines = workflow.split("\n")
+    try:
+        root = yaml.compose(workflow, Loader=yaml.SafeLoader)
+    except yaml.YAMLError as e:
+        diagnostic: SyntaxValidationOutput = {
+            "message": f"could not parse as YAML: {getattr(e, 'problem', None) or e}",
+            "kind": "syntax-check",
+        }
+        mark = getattr(e, "problem_mark", None)
+        if mark is not None:
+            diagnostic["line"] = mark.line + 1
+            diagnostic["column"] = mark.column + 1
+            if mark.line < len(lines):
+                diagnostic["snippet"] = lines[mark.line]
+        return [diagnostic]
+
+    if root is None:
+        return [_diagnostic("workflow is empty", None, lines)]
+    if not isinstance(root, MappingNode):
+        return [
+            _diagnostic(
+                f"workflow must be mapping node but got {_kind(root)} node",
+                root,
+                lines,
+            )
+        ]
+
+    errors = []
+    sections = _mapping(root)
+    # PyYAML dumps the "on" key as "true", which GitHub does not accept.
+    for name in ("true", "True", "TRUE"):
+        if name in sections:
+            errors.append(
+                _diagnostic(
+                    f'unexpected key "{name}" for "workflow" section. did you mean "on"?',
+                    sections[name][0],
+                    lines,
+                )
+            )
+    if "on" not in sections:
+        errors.append(_diagnostic('"on" section is missing in workflow', root, lines))
+    if "jobs" not in sections:
+        errors.append(_diagnostic('"jobs" section is missing in workflow', root, lines))
+        return errors
+
+    jobs = sections["jobs"][1]
+    if not isinstance(jobs, MappingNode):
+        errors.append(
+            _diagnostic(
+                f'"jobs" section must be mapping node but got {_kind(jobs)} node',
+                jobs,
+                lines,
+            )
+        )
+        return errors
+
+    for key, job in jobs.value:
+        errors.extend(_check_job(str(key.value), key, job, lines))
+    return errors
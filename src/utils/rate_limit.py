@@ -0,0 +1,104 @@
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+
+@dataclass
+class RateLimit:
+    requests_per_minute: float = 600
+    tokens_per_minute: float = 2_000_000
+
+
+class TokenBucket:
+    # No lock is needed: the check and the debit in acquire happen without an
+    # await in between, so tasks on one event loop cannot interleave there.
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def debit(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= amount
+
+
+class ModelRateLimiter:
+    def __init__(self, limit: RateLimit):
+        self.requests = TokenBucket(limit.requests_per_minute)
+        self.tokens = TokenBucket(limit.tokens_per_minute)
+        self.paused_until = 0.0
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        while True:
+            delay = max(
+                self.paused_until - time.monotonic(),
+                self.requests.wait_time(1),
+                self.tokens.wait_time(estimated_tokens),
+            )
+            if delay <= 0:
+                self.requests.debit(1)
+                self.tokens.debit(estimated_tokens)
+                return
+            await asyncio.sleep(delay)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Corrects the token bucket once the real usage is known."""
+        self.tokens.debit(actual_tokens - estimated_tokens)
+
+    def pause(self, seconds: float) -> None:
+        """Holds back every request to this model, e.g. after a 429."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def estimate_tokens(messages) -> int:
+    # Roughly four characters per token; corrected by settle() after the call.
+    return sum(len(str(message.get("content") or "")) for message in messages) // 4 + 1
+
+
+def retry_after(response: httpx.Response | None) -> float | None:
+    if response is None:
+        return None
+    headers = response.headers
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if "retry-after" not in headers:
+        return None
+    value = headers["retry-after"]
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(
+    attempt: int, retry_after_seconds: float | None, base: float = 1, cap: float = 60
+) -> float:
+    if retry_after_seconds is not None:
+        return retry_after_seconds + random.uniform(0, base)
+    # Full jitter keeps workers that were throttled together from retrying in
+    # lockstep.
+    return random.uniform(0, min(cap, base * 2**attempt))
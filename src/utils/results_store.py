@@ -0,0 +1,320 @@
+import glob
+import itertools
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Callable
+
+import polars as pl
+
+from models.score import Score
+
+score_schema = pl.Schema(
+    {
+        "workflow_id": pl.Int64,
+        "graph_name": pl.String,
+        "prompt_level": pl.Int64,
+        "difficulty_tier": pl.String,
+        "difficulty_score": pl.Int64,
+        "judge_score": pl.Float64,
+        "bleu_score": pl.Float64,
+        "meteor_score": pl.Float64,
+        "lint_valid": pl.Boolean,
+        "lint_errors": pl.Int64,
+        "vulnerabilities": pl.Int64,
+        "functional_test_fully_ran": pl.Boolean,
+        "functional_test_return_code": pl.Int64,
+    }
+)
+
+# Large fields live in their own table so that summaries never read them. The
+# list fields are stored as JSON.
+details_schema = pl.Schema(
+    {
+        "workflow_id": pl.Int64,
+        "prompt": pl.String,
+        "original_workflow": pl.String,
+        "generated_workflow": pl.String,
+        "judgement": pl.String,
+        "lint_output": pl.String,
+        "vulnerabilities": pl.String,
+        "functional_test_dryrun_output": pl.String,
+        "functional_test_dryrun_errors": pl.String,
+        "functional_test_output": pl.String,
+        "functional_test_errors": pl.String,
+    }
+)
+json_columns = [
+    "lint_output",
+    "vulnerabilities",
+    "functional_test_dryrun_output",
+    "functional_test_dryrun_errors",
+    "functional_test_output",
+    "functional_test_errors",
+]
+
+tables = {"scores": score_schema, "details": details_schema}
+
+
+def score_row(score: Score) -> dict[str, Any]:
+    return {
+        "workflow_id": score.workflow_id,
+        "graph_name": score.graph_name,
+        "prompt_level": score.prompt_level,
+        "difficulty_tier": score.difficulty_tier,
+        "difficulty_score": score.difficulty_score,
+        "judge_score": score.judge_score,
+        "bleu_score": score.bleu_score,
+        "meteor_score": score.meteor_score,
+        "lint_valid": score.lint_valid,
+        "lint_errors": len(score.lint_output),
+        "vulnerabilities": len(score.vulnerabilities),
+        "functional_test_fully_ran": score.functional_test.fully_ran,
+        "functional_test_return_code": score.functional_test.return_code,
+    }
+
+
+def details_row(score: Score) -> dict[str, Any]:
+    functional_test = score.functional_test
+    return {
+        "workflow_id": score.workflow_id,
+        "prompt": score.prompt,
+        "original_workflow": score.original_workflow,
+        "generated_workflow": score.generated_workflow,
+        "judgement": score.judgement,
+        "lint_output": json.dumps(score.lint_output),
+        "vulnerabilities": json.dumps(score.vulnerabilities),
+        "functional_test_dryrun_output": json.dumps(functional_test.dryrun_output),
+        "functional_test_dryrun_errors": json.dumps(functional_test.dryrun_errors),
+        "functional_test_output": json.dumps(functional_test.output),
+        "functional_test_errors": json.dumps(functional_test.errors),
+    }
+
+
+class ResultsStore:
+    """Benchmark results as Parquet parts under {directory}/scores and
+    {directory}/details, keyed by workflow id.
+
+    Scores are buffered and written once rows_per_part scores or
+    flush_interval seconds have gathered, and on flush. on_write is called
+    with the workflow ids and the name of every part written.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        rows_per_part: int = 64,
+        flush_interval: float = 60.0,
+        on_write: Callable[[list[int], str], None] | None = None,
+    ):
+        self.directory = directory
+        self.rows_per_part = rows_per_part
+        self.flush_interval = flush_interval
+        self.on_write = on_write
+        self.rows: dict[str, list[dict[str, Any]]] = {name: [] for name in tables}
+        # Resumed runs add parts next to those of earlier runs.
+        self.part_prefix = f"part-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.parts = itertools.count()
+        self.written = time.monotonic()
+        self.lock = threading.Lock()
+        for name in tables:
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+    def reset(self, config: str | None = None) -> None:
+        """Removes every result. The configuration they will be produced with,
+        such as a hash of it, is recorded for config()."""
+        with self.lock:
+            self.rows = {name: [] for name in tables}
+        for name in tables:
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+            os.makedirs(os.path.join(self.directory, name))
+        path = os.path.join(self.directory, "config")
+        if config is None:
+            if os.path.exists(path):
+                os.remove(path)
+        else:
+            with open(path, "w") as f:
+                f.write(config)
+
+    def config(self) -> str | None:
+        path = os.path.join(self.directory, "config")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return f.read()
+
+    def append(self, score: Score) -> None:
+        with self.lock:
+            self.rows["scores"].append(score_row(score))
+            self.rows["details"].append(details_row(score))
+            if (
+                len(self.rows["scores"]) < self.rows_per_part
+                and time.monotonic() - self.written < self.flush_interval
+            ):
+                return
+            rows, self.rows = self.rows, {name: [] for name in tables}
+        self._write_parts(rows)
+
+    def flush(self) -> None:
+        with self.lock:
+            rows, self.rows = self.rows, {name: [] for name in tables}
+        if rows["scores"]:
+            self._write_parts(rows)
+
+    def _write_parts(self, rows: dict[str, list[dict[str, Any]]]) -> None:
+        part = f"{self.part_prefix}-{next(self.parts):05d}.parquet"
+        for name, schema in tables.items():
+            path = os.path.join(self.directory, name, part)
+            pl.DataFrame(rows[name], schema=schema).write_parquet(f"{path}.tmp")
+            os.replace(f"{path}.tmp", path)
+        self.written = time.monotonic()
+        if self.on_write is not None:
+            self.on_write([row["workflow_id"] for row in rows["scores"]], part)
+
+    def compact(self) -> None:
+        """Merges the parts of each table into a single file."""
+        self.flush()
+        for name in tables:
+            parts = glob.glob(os.path.join(self.directory, name, "*.parquet"))
+            if len(parts) < 2:
+                continue
+            path = os.path.join(self.directory, name, "compacted.parquet")
+            # A workflow scored again after an interruption, between writing
+            # its part and recording it as scored, has two rows.
+            self._scan(name).unique("workflow_id", keep="any").sink_parquet(
+                f"{path}.tmp"
+            )
+            # Replace before removing the parts: an interrupted compaction
+            # leaves duplicate rows behind rather than losing any.
+            os.replace(f"{path}.tmp", path)
+            for part in parts:
+                if part != path:
+                    os.remove(part)
+
+    def _scan(self, name: str) -> pl.LazyFrame:
+        if not glob.glob(os.path.join(self.directory, name, "*.parquet")):
+            return pl.LazyFrame(schema=tables[name])
+        return pl.scan_parquet(
+            os.path.join(self.directory, name, "*.parquet"), schema=tables[name]
+        )
+
+    def scan(self) -> pl.LazyFrame:
+        return self._scan("scores")
+
+    def scores(self, workflow_ids: list[int]) -> list[dict[str, Any]]:
+        return (
+            self.scan()
+            .filter(pl.col("workflow_id").is_in(workflow_ids))
+            .unique("workflow_id", keep="any")
+            .collect()
+            .to_dicts()
+        )
+
+    def details(
+        self, workflow_ids: list[int] | None = None, columns: list[str] | None = None
+    ) -> list[dict[str, Any]]:
+        """Loads the large fields, only for the given workflows and columns.
+        The list fields are decoded from JSON."""
+        details = self._scan("details")
+        if workflow_ids is not None:
+            details = details.filter(pl.col("workflow_id").is_in(workflow_ids))
+        if columns is not None:
+            details = details.select("workflow_id", *columns)
+        rows = details.collect().to_dicts()
+        for row in rows:
+            for name in json_columns:
+                if name in row:
+                    row[name] = json.loads(row[name])
+        return rows
+
+    def summarize(self, by: list[str] | None = None) -> pl.DataFrame:
+        metrics = [
+            pl.len().alias("count"),
+            pl.col("bleu_score").mean().alias("avg_bleu"),
+            pl.col("meteor_score").mean().alias("avg_meteor"),
+            pl.col("judge_score").mean().alias("avg_judge_score"),
+            pl.col("lint_valid").mean().alias("lint_success_rate"),
+            pl.col("functional_test_fully_ran")
+            .mean()
+            .alias("functional_test_success_rate"),
+        ]
+        scores = self.scan()
+        if not by:
+            return scores.select(metrics).collect()
+        return scores.group_by(by).agg(metrics).sort(by).collect()
+
+
+@dataclass
+class RunningMetrics:
+    count: int = 0
+    bleu: float = 0.0
+    meteor: float = 0.0
+    judge_score: float = 0.0
+    lint_valid: int = 0
+    functional_test_fully_ran: int = 0
+
+    def add(self, row: dict[str, Any]) -> None:
+        self.count += 1
+        self.bleu += row["bleu_score"]
+        self.meteor += row["meteor_score"]
+        self.judge_score += row["judge_score"]
+        self.lint_valid += row["lint_valid"]
+        self.functional_test_fully_ran += row["functional_test_fully_ran"]
+
+    def summary(self) -> dict[str, float | int]:
+        count = self.count or 1
+        return {
+            "count": self.count,
+            "avg_bleu": self.bleu / count,
+            "avg_meteor": self.meteor / count,
+            "avg_judge_score": self.judge_score / count,
+            "lint_success_rate": self.lint_valid / count,
+            "functional_test_success_rate": self.functional_test_fully_ran / count,
+        }
+
+
+class ScoreAggregator:
+    """Hands each score to the store as it arrives and keeps running metrics,
+    overall and per tier, so that nothing but the sums and the store's buffer
+    stays in memory.
+
+    The metrics so far are rewritten to {directory}/progress.json after every
+    score, for reading while the run is in progress.
+    """
+
+    def __init__(self, store: ResultsStore):
+        self.store = store
+        self.overall = RunningMetrics()
+        self.tiers: dict[str, RunningMetrics] = {}
+
+    def add(self, score: Score) -> None:
+        self.store.append(score)
+        self.add_row(score_row(score))
+
+    def add_row(self, row: dict[str, Any]) -> None:
+        """Counts a score that is already in the store, such as one scored
+        before resuming."""
+        self.overall.add(row)
+        self.tiers.setdefault(row["difficulty_tier"], RunningMetrics()).add(row)
+        self._write_progress()
+
+    def close(self) -> None:
+        self.store.flush()
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "overall": self.overall.summary(),
+            "tiers": {
+                tier: metrics.summary() for tier, metrics in sorted(self.tiers.items())
+            },
+        }
+
+    def _write_progress(self) -> None:
+        path = os.path.join(self.store.directory, "progress.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(self.summary(), f, indent=4)
+        os.replace(f"{path}.tmp", path)
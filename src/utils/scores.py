@@ -63,6 +63,17 @@ def calculate_meteor_score(reference: str | None, candidate: str | None) -> floa
         return 0.0
 
 
+def calculate_similarity_scores(
+    reference: str | None, candidate: str | None
+) -> tuple[float, float]:
+    """BLEU and METEOR scores in one call, for running both in a worker
+    process."""
+    return (
+        calculate_bleu_score(reference, candidate),
+        calculate_meteor_score(reference, candidate),
+    )
+
+
 def extract_judge_score(text: str | None):
     if text is None:
         return None
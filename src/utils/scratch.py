@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from functools import cache
+from typing import Iterator
+
+# Prefer tmpfs so scratch files never hit the disk.
+scratch_base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+scratch_root = os.path.join(scratch_base, "ra-gha-gen")
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def sweep_stale_scratch() -> None:
+    """Removes scratch directories left behind by processes that died."""
+    if not os.path.isdir(scratch_root):
+        return
+    for name in os.listdir(scratch_root):
+        owner = name.split("-", 1)[0]
+        if owner.isdigit() and not _pid_alive(int(owner)):
+            shutil.rmtree(os.path.join(scratch_root, name), ignore_errors=True)
+
+
+@cache
+def _prepare_scratch_root(pid: int) -> str:
+    os.makedirs(scratch_root, exist_ok=True)
+    sweep_stale_scratch()
+    return scratch_root
+
+
+@contextmanager
+def scratch_dir() -> Iterator[str]:
+    """Yields a private directory that is removed on exit.
+
+    Directories are prefixed with the owning PID so that whatever a crashed
+    worker leaves behind is swept by the next process to use the scratch area.
+    """
+    path = tempfile.mkdtemp(
+        prefix=f"{os.getpid()}-", dir=_prepare_scratch_root(os.getpid())
+    )
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
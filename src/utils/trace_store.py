@@ -0,0 +1,133 @@
+import itertools
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Any, Literal
+
+import polars as pl
+
+from utils.tracing import current_workflow_id
+
+ParquetCompression = Literal["zstd", "lz4", "snappy", "gzip", "uncompressed"]
+
+# run_id is not stored in the files: it is the Hive partition of the directory
+# the parts are written to and comes back as a column when scanning.
+trace_schema = pl.Schema(
+    {
+        "workflow_id": pl.Int64,
+        "pid": pl.Int32,
+        "log_type": pl.String,
+        "step": pl.String,
+        "timestamp": pl.Datetime("us"),
+        "level": pl.String,
+        "prompt_tokens": pl.Int64,
+        "completion_tokens": pl.Int64,
+        "workflow_hash": pl.String,
+        "state_delta": pl.String,
+        "message": pl.String,
+    }
+)
+
+
+class TraceSink:
+    """Buffers log entries and writes them as Parquet parts under
+    {root}/run_id={run_id}/, one part per flush or every rows_per_part rows.
+
+    Parts are never appended to, so every process, including fork-based pool
+    workers, writes its own files.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        run_id: str,
+        compression: ParquetCompression = "zstd",
+        rows_per_part: int = 50_000,
+    ):
+        self.directory = os.path.join(root, f"run_id={run_id}")
+        self.compression = compression
+        self.rows_per_part = rows_per_part
+        self.rows: list[dict[str, Any]] = []
+        self.parts = itertools.count()
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def record(
+        self,
+        log_type: str,
+        level: str,
+        message: Any,
+        step: str | None = None,
+        timestamp: datetime | None = None,
+        prompt_tokens: int | None = None,
+        completion_tokens: int | None = None,
+        workflow_hash: str | None = None,
+        state_delta: dict[str, Any] | None = None,
+    ) -> None:
+        row = {
+            "workflow_id": current_workflow_id.get(),
+            "pid": os.getpid(),
+            "log_type": log_type,
+            "step": step,
+            "timestamp": timestamp or datetime.now(),
+            "level": level,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "workflow_hash": workflow_hash,
+            "state_delta": None if state_delta is None else _encode(state_delta),
+            "message": message if isinstance(message, str) else _encode(message),
+        }
+        with self.lock:
+            self.rows.append(row)
+            if len(self.rows) < self.rows_per_part:
+                return
+            rows, self.rows = self.rows, []
+        self._write_part(rows)
+
+    def flush(self) -> None:
+        with self.lock:
+            rows, self.rows = self.rows, []
+        if rows:
+            self._write_part(rows)
+
+    def _write_part(self, rows: list[dict[str, Any]]) -> None:
+        path = os.path.join(
+            self.directory, f"part-{os.getpid()}-{next(self.parts):05d}.parquet"
+        )
+        # Written under a temporary name so that a scan never sees half a part.
+        pl.DataFrame(rows, schema=trace_schema).write_parquet(
+            f"{path}.tmp", compression=self.compression
+        )
+        os.replace(f"{path}.tmp", path)
+
+
+def _encode(value: Any) -> str:
+    return json.dumps(value, default=str)
+
+
+trace_sink: TraceSink | None = None
+
+
+def configure_trace_store(
+    root: str,
+    run_id: str,
+    compression: ParquetCompression = "zstd",
+    rows_per_part: int = 50_000,
+) -> None:
+    """Mirrors state and message logs into a Parquet trace store; call before
+    forking pool workers."""
+    global trace_sink
+    trace_sink = TraceSink(root, run_id, compression, rows_per_part)
+
+
+def scan_traces(root: str) -> pl.LazyFrame:
+    """Scans every run of a trace store. Filters on run_id only read the
+    matching partitions, and filters on other columns are pushed down to the
+    Parquet row groups."""
+    return pl.scan_parquet(
+        os.path.join(root, "**", "*.parquet"),
+        hive_partitioning=True,
+        hive_schema={"run_id": pl.String},
+        schema=trace_schema,
+    )
@@ -0,0 +1,166 @@
+import functools
+import glob
+import inspect
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Iterator, Sequence
+
+import polars as pl
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import AIMessage, BaseMessage
+
+
+@dataclass
+class Span:
+    workflow_id: int | None
+    node: str
+    start: float
+    duration: float = 0.0
+    ttfb: float | None = None
+    tool_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+current_workflow_id: ContextVar[int | None] = ContextVar(
+    "current_workflow_id", default=None
+)
+spans_dir: str | None = None
+_spans: list[Span] = []
+
+
+def configure_spans(directory: str) -> None:
+    """Sets where spans are written; call before forking pool workers."""
+    global spans_dir
+    os.makedirs(directory, exist_ok=True)
+    spans_dir = directory
+
+
+def set_workflow_id(workflow_id: int | None) -> None:
+    current_workflow_id.set(workflow_id)
+
+
+@contextmanager
+def span(node: str, workflow_id: int | None = None) -> Iterator[Span]:
+    if workflow_id is None:
+        workflow_id = current_workflow_id.get()
+    record = Span(workflow_id=workflow_id, node=node, start=time.time())
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.duration = time.perf_counter() - started
+        _spans.append(record)
+
+
+def traced(node: str) -> Callable:
+    """Records a span around every call of the decorated function."""
+
+    def decorator(function: Callable) -> Callable:
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with span(node):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(node):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class FirstResponseHandler(BaseCallbackHandler):
+    """Captures the time to the first token, or to the first model answer when
+    the model is not streamed, relative to the span start."""
+
+    def __init__(self, record: Span):
+        self.record = record
+        self.started = time.time()
+
+    def _first_response(self) -> None:
+        if self.record.ttfb is None:
+            self.record.ttfb = time.time() - self.started
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self._first_response()
+
+    def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+        self._first_response()
+
+
+def record_llm_usage(record: Span, messages: Sequence[BaseMessage]) -> None:
+    for message in messages:
+        if not isinstance(message, AIMessage):
+            continue
+        record.tool_calls += len(message.tool_calls)
+        if message.usage_metadata:
+            record.prompt_tokens += message.usage_metadata.get("input_tokens", 0)
+            record.completion_tokens += message.usage_metadata.get("output_tokens", 0)
+
+
+def write_spans() -> None:
+    """Appends the spans recorded so far by this process to its span file."""
+    if spans_dir is None or not _spans:
+        return
+    with open(os.path.join(spans_dir, f"{os.getpid()}.jsonl"), "a") as f:
+        for record in _spans:
+            f.write(json.dumps(asdict(record)) + "\n")
+    _spans.clear()
+
+
+def load_spans(directory: str) -> pl.DataFrame:
+    frames = [
+        pl.read_ndjson(path)
+        for path in glob.glob(os.path.join(directory, "*.jsonl"))
+        if os.path.getsize(path) > 0
+    ]
+    return pl.concat(frames, how="diagonal_relaxed") if frames else pl.DataFrame()
+
+
+def span_percentiles(spans: pl.DataFrame, by: list[str]) -> pl.DataFrame:
+    return (
+        spans.group_by(by)
+        .agg(
+            pl.len().alias("count"),
+            pl.col("duration").quantile(0.5).alias("p50"),
+            pl.col("duration").quantile(0.95).alias("p95"),
+            pl.col("duration").quantile(0.99).alias("p99"),
+            pl.col("ttfb").quantile(0.5).alias("ttfb_p50"),
+            pl.col("tool_calls").sum(),
+            pl.col("prompt_tokens").sum(),
+            pl.col("completion_tokens").sum(),
+        )
+        .sort(by)
+    )
+
+
+def print_span_report(directory: str, tiers: dict[int, str]) -> None:
+    spans = load_spans(directory)
+    if spans.is_empty():
+        return
+    spans = spans.with_columns(
+        pl.col("workflow_id")
+        .replace_strict(tiers, default=None, return_dtype=pl.String)
+        .alias("difficulty_tier")
+    )
+
+    with pl.Config(tbl_rows=-1, tbl_cols=-1, tbl_width_chars=200):
+        print("\n" + "=" * 60)
+        print("TIMINGS PER NODE (seconds)")
+        print("=" * 60)
+        print(span_percentiles(spans, ["node"]))
+        print("\n" + "=" * 60)
+        print("TIMINGS PER TIER AND NODE (seconds)")
+        print("=" * 60)
+        print(span_percentiles(spans, ["difficulty_tier", "node"]))
@@ -0,0 +1,238 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Iterator, Literal
+
+from utils.logger import log_progress
+
+WorkspaceMethod = Literal["overlay", "reflink", "hardlink", "copy"]
+workspace_methods: tuple[WorkspaceMethod, ...] = (
+    "overlay",
+    "reflink",
+    "hardlink",
+    "copy",
+)
+
+
+@dataclass
+class Workspace:
+    path: Path
+    method: WorkspaceMethod | None
+    bytes_copied: int
+    # The temporary directory holding the workspace and, for overlays, its
+    # layers.
+    directory: Path = field(default=Path(), repr=False)
+    repository: Path | None = field(default=None, repr=False)
+    unmount: Callable[[], None] | None = field(default=None, repr=False)
+    written: list[Path] = field(default_factory=list, repr=False)
+
+    def write_file(self, relative_path: str | Path, content: str) -> Path:
+        """Writes a file into the workspace. An existing file is replaced
+        rather than written through, as it may be a hard link to the
+        repository's copy."""
+        path = self.path / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.unlink(missing_ok=True)
+        path.write_text(content)
+        self.written.append(Path(relative_path))
+        return path
+
+
+@dataclass
+class WorkspaceStats:
+    workspaces: int = 0
+    bytes_copied: int = 0
+
+
+class WorkspaceProvider:
+    """Creates throwaway copies of a repository for functional tests.
+
+    Tries, in order: an overlayfs mount over the repository, which costs the
+    same whatever the repository size; a reflink copy sharing the file extents;
+    a farm of hard links; and a plain copy. A method that fails once, for lack
+    of privileges or filesystem support, is not tried again.
+    """
+
+    def __init__(
+        self,
+        methods: tuple[WorkspaceMethod, ...] = workspace_methods,
+        root: str | None = None,
+    ):
+        self.methods = list(methods)
+        self.root = root
+        self.stats: dict[WorkspaceMethod, WorkspaceStats] = {}
+        self.lock = threading.Lock()
+        if root is not None:
+            os.makedirs(root, exist_ok=True)
+
+    @contextmanager
+    def create(self, repository_path: str | None) -> Iterator[Workspace]:
+        workspace = self.open(repository_path)
+        try:
+            yield workspace
+        finally:
+            self.close(workspace)
+
+    def open(self, repository_path: str | None) -> Workspace:
+        """Creates a workspace that lives until close()."""
+        directory = Path(tempfile.mkdtemp(prefix="workspace_", dir=self.root))
+        if not repository_path:
+            return Workspace(directory, None, 0, directory)
+        try:
+            return self._populate(Path(repository_path), directory)
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+
+    def close(self, workspace: Workspace) -> None:
+        if workspace.unmount is not None:
+            workspace.unmount()
+        shutil.rmtree(workspace.directory, ignore_errors=True)
+
+    def reset(self, workspace: Workspace) -> None:
+        """Undoes the files written through write_file, for reusing the
+        workspace with the same repository."""
+        if workspace.method == "overlay":
+            # Files under an overlay must not be removed while it is mounted,
+            # as that leaves whiteouts behind; remount over empty layers.
+            assert workspace.unmount is not None and workspace.repository
+            workspace.unmount()
+            for layer in ("upper", "work"):
+                shutil.rmtree(workspace.directory / layer)
+            _, workspace.unmount = self._overlay(
+                workspace.repository, workspace.directory, fresh=False
+            )
+        else:
+            for relative_path in workspace.written:
+                path = workspace.path / relative_path
+                path.unlink(missing_ok=True)
+                if workspace.repository is None:
+                    continue
+                source = workspace.repository / relative_path
+                if source.is_file():
+                    self._restore(workspace.method, source, path)
+        workspace.written.clear()
+
+    @staticmethod
+    def _restore(method: WorkspaceMethod | None, source: Path, path: Path) -> None:
+        if method == "hardlink":
+            os.link(source, path)
+        elif method == "reflink":
+            subprocess.run(
+                ["cp", "-a", "--reflink=always", str(source), str(path)], check=True
+            )
+        else:
+            shutil.copy2(source, path)
+
+    def _populate(self, repository: Path, directory: Path) -> Workspace:
+        for method in list(self.methods):
+            try:
+                if method == "overlay":
+                    path, unmount = self._overlay(repository, directory)
+                    workspace = Workspace(
+                        path, method, 0, directory, repository, unmount
+                    )
+                    return self._record(workspace)
+                target = directory / "repository"
+                if method == "reflink":
+                    self._reflink(repository, target)
+                    bytes_copied = 0
+                elif method == "hardlink":
+                    bytes_copied = self._hardlink(repository, target)
+                else:
+                    bytes_copied = self._copy(repository, target)
+                return self._record(
+                    Workspace(target, method, bytes_copied, directory, repository)
+                )
+            except (OSError, subprocess.CalledProcessError) as e:
+                if method == "copy":
+                    raise
+                log_progress(f"Workspace method {method} unavailable: {e}")
+                with self.lock:
+                    if method in self.methods:
+                        self.methods.remove(method)
+                for leftover in directory.iterdir():
+                    shutil.rmtree(leftover, ignore_errors=True)
+        raise RuntimeError("No workspace method left")
+
+    def _record(self, workspace: Workspace) -> Workspace:
+        assert workspace.method is not None
+        with self.lock:
+            stats = self.stats.setdefault(workspace.method, WorkspaceStats())
+            stats.workspaces += 1
+            stats.bytes_copied += workspace.bytes_copied
+        return workspace
+
+    @staticmethod
+    def _overlay(repository: Path, directory: Path, fresh: bool = True):
+        upper, work, merged = (directory / name for name in ("upper", "work", "merged"))
+        for path in (upper, work, merged) if fresh else (upper, work):
+            path.mkdir()
+        subprocess.run(
+            [
+                "mount",
+                "-t",
+                "overlay",
+                "overlay",
+                "-o",
+                f"lowerdir={repository},upperdir={upper},workdir={work}",
+                str(merged),
+            ],
+            check=True,
+            capture_output=True,
+        )
+
+        def unmount():
+            subprocess.run(["umount", "-l", str(merged)], capture_output=True)
+
+        return merged, unmount
+
+    @staticmethod
+    def _reflink(repository: Path, target: Path) -> None:
+        subprocess.run(
+            ["cp", "-a", "--reflink=always", str(repository), str(target)],
+            check=True,
+            capture_output=True,
+        )
+
+    @staticmethod
+    def _hardlink(repository: Path, target: Path) -> int:
+        """Links every regular file; only the directory tree is created.
+        Returns 0, as no file content is copied."""
+        for current, directories, files in os.walk(repository):
+            relative = Path(current).relative_to(repository)
+            (target / relative).mkdir(parents=True, exist_ok=True)
+            for name in directories + files:
+                source = Path(current) / name
+                destination = target / relative / name
+                if source.is_symlink():
+                    destination.symlink_to(os.readlink(source))
+                elif name in files:
+                    os.link(source, destination)
+        return 0
+
+    @staticmethod
+    def _copy(repository: Path, target: Path) -> int:
+        copied = 0
+
+        def copy(source: str, destination: str) -> None:
+            nonlocal copied
+            shutil.copy2(source, destination)
+            copied += os.path.getsize(destination)
+
+        shutil.copytree(repository, target, symlinks=True, copy_function=copy)
+        return copied
+
+    def format_report(self) -> str:
+        with self.lock:
+            lines = [
+                f"  {method}: {stats.workspaces} workspaces, "
+                f"{stats.bytes_copied / 1024 / 1024:.1f} MiB copied"
+                for method, stats in self.stats.items()
+            ]
+        return "\n".join(["Functional test workspaces:", *lines])
@@ -0,0 +1,35 @@
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+# src/env.py is local configuration and is not checked in. The tests import
+# a stand-in whose paths, the caches included, are all under a temporary
+# directory, so that they never read or write a real run's files. It is a
+# module on sys.path rather than an entry in sys.modules so that the metrics
+# pool's workers, which start from a fork server, import it too.
+root = Path(tempfile.mkdtemp(prefix="ra_gha_gen_tests_"))
+(root / "env").mkdir()
+(root / "env" / "env.py").write_text(
+    f"""root = {str(root)!r}
+dataset_path = root + "/dataset"
+graph_path = root + "/graph"
+log_path = root + "/logs"
+previous_results_path = root + "/previous_results"
+repositories_path = root + "/repositories"
+results_path = root + "/results"
+# Nothing listens on the discard port: a request that is not stubbed fails.
+endpoints = {{"openrouter": {{"api_key": "test", "base_url": "http://127.0.0.1:9"}}}}
+"""
+)
+for name in ("logs", "results", "repositories"):
+    (root / name).mkdir()
+sys.path.insert(0, str(root / "env"))
+
+
+def pytest_sessionfinish(session, exitstatus):
+    # Queued log lines are written under the directory about to be removed.
+    logger = sys.modules.get("utils.logger")
+    if logger is not None:
+        logger.flush_logs()
+    shutil.rmtree(root, ignore_errors=True)
@@ -0,0 +1,211 @@
+import pytest
+import yaml
+
+from utils import autofix
+from utils.app_types import WorkflowYAML
+from utils.autofix import autofix_syntax, autofix_vulnerabilities
+
+
+def finding(ident: str, *route: str | int) -> dict:
+    components = [
+        {"Index": part} if isinstance(part, int) else {"Key": part} for part in route
+    ]
+    return {
+        "ident": ident,
+        "desc": "",
+        "url": "",
+        "determinations": {},
+        "ignored": False,
+        "locations": [
+            {
+                "symbolic": {
+                    "key": {"Local": {"prefix": None, "given_path": "test.yml"}},
+                    "annotation": "",
+                    "route": {"components": components},
+                    "feature_kind": "Normal",
+                    "kind": "Primary",
+                },
+                "concrete": {},
+            }
+        ],
+    }
+
+
+def fix(workflow: str, *findings: dict) -> tuple[str, list[str]]:
+    return autofix_vulnerabilities(WorkflowYAML(workflow), list(findings))
+
+
+def test_excessive_permissions():
+    workflow = (
+        "on: push\n"
+        "jobs:\n"
+        "  build:\n"
+        "    runs-on: ubuntu-latest\n"
+        "    permissions: write-all\n"
+        "    steps:\n"
+        "      - run: make\n"
+    )
+    fixed, applied = fix(workflow, finding("excessive-permissions"))
+    assert applied == ["excessive-permissions"]
+    assert fixed == (
+        "on: push\n"
+        "permissions: {}\n"
+        "jobs:\n"
+        "  build:\n"
+        "    runs-on: ubuntu-latest\n"
+        "    permissions: {contents: read}\n"
+        "    steps:\n"
+        "      - run: make\n"
+    )
+
+
+def test_artipacked():
+    workflow = (
+        "on: push\n"
+        "jobs:\n"
+        "  build:\n"
+        "    runs-on: ubuntu-latest\n"
+        "    steps:\n"
+        "      - uses: actions/checkout@v4\n"
+        "      - uses: actions/checkout@v4\n"
+        "        with:\n"
+        "          fetch-depth: 0\n"
+        "      - uses: actions/checkout@v4\n"
+        "        with: {persist-credentials: true}\n"
+    )
+    fixed, applied = fix(workflow, finding("artipacked"))
+    assert applied == ["artipacked"]
+    steps = yaml.safe_load(fixed)["jobs"]["build"]["steps"]
+    assert [step["with"] for step in steps] == [
+        {"persist-credentials": False},
+        {"fetch-depth": 0, "persist-credentials": False},
+        # An explicit choice is kept.
+        {"persist-credentials": True},
+    ]
+
+
+injectable = (
+    "on: issues\n"
+    "jobs:\n"
+    "  build:\n"
+    "    runs-on: ubuntu-latest\n"
+    "    steps:\n"
+    "      - run: echo '${{ github.event.issue.title }}'\n"
+    "      - run: echo ${{ github.event.issue.title }} ${{ github.sha }}\n"
+    "      - run: echo ${{ inputs.name }}\n"
+    "        shell: python\n"
+)
+
+
+def test_template_injection():
+    flagged = finding("template-injection", "jobs", "build", "steps", 1, "run")
+    # Several findings in one step are fixed once.
+    fixed, applied = fix(injectable, flagged, flagged)
+    assert applied == ["template-injection"]
+    steps = yaml.safe_load(fixed)["jobs"]["build"]["steps"]
+    assert steps[0] == {"run": "echo '${{ github.event.issue.title }}'"}
+    assert steps[1] == {
+        "run": "echo ${GITHUB_EVENT_ISSUE_TITLE} ${GITHUB_SHA}",
+        "env": {
+            "GITHUB_EVENT_ISSUE_TITLE": "${{ github.event.issue.title }}",
+            "GITHUB_SHA": "${{ github.sha }}",
+        },
+    }
+
+
+def test_template_injection_in_single_quotes():
+    flagged = finding("template-injection", "jobs", "build", "steps", 0, "run")
+    fixed, _ = fix(injectable, flagged)
+    step = yaml.safe_load(fixed)["jobs"]["build"]["steps"][0]
+    # Closed around the variable, so that the shell still expands it.
+    assert step["run"] == "echo ''\"${GITHUB_EVENT_ISSUE_TITLE}\"''"
+
+
+@pytest.mark.parametrize(
+    "route",
+    [
+        # Not a step.
+        ("on",),
+        # A step the fixer cannot rewrite: python is not a shell.
+        ("jobs", "build", "steps", 2, "run"),
+        ("jobs", "build", "steps", 9, "run"),
+    ],
+)
+def test_template_injection_without_fixable_step(route):
+    assert fix(injectable, finding("template-injection", *route)) == (injectable, [])
+
+
+def test_unpinned_uses(monkeypatch):
+    commits = {("actions/checkout", "v4"): "a" * 40}
+    lookups = []
+
+    def resolve(repository, ref):
+        lookups.append((repository, ref))
+        return commits.get((repository, ref))
+
+    monkeypatch.setattr(autofix, "_resolve_commit", resolve)
+    workflow = (
+        "on: push\n"
+        "jobs:\n"
+        "  build:\n"
+        "    runs-on: ubuntu-latest\n"
+        "    steps:\n"
+        "      - uses: actions/checkout@v4 # checkout\n"
+        "      - uses: actions/checkout@v4\n"
+        "      - uses: example/missing@v1\n"
+        "      - uses: ./local\n"
+    )
+    fixed, applied = fix(workflow, finding("unpinned-uses"))
+    assert applied == ["unpinned-uses"]
+    assert fixed == workflow.replace(
+        "actions/checkout@v4", f"actions/checkout@{'a' * 40}"
+    )
+    # Each ref is looked up once.
+    assert sorted(lookups) == [("actions/checkout", "v4"), ("example/missing", "v1")]
+
+
+def test_syntax_fixes():
+    workflow = (
+        "true: push\n"
+        "jobs:\n"
+        "  build:\n"
+        "    runs-on: ubuntu-latest\n"
+        "    steps:\n"
+        "      - uses: actions/setup-python@v2\n"
+        "        with:\n"
+        '          python-version: "3.10"\n'
+        "      - run: |\n"
+        '          echo "::set-output name=version::1.0"\n'
+        "          echo ::add-path::/opt/bin\n"
+    )
+    errors = [
+        {"message": 'unexpected key "true" for "workflow" section', "kind": "syntax"},
+        {
+            "message": 'the runner of "actions/setup-python@v2" action is too old',
+            "kind": "action",
+        },
+        {
+            "message": "workflow command set-output is deprecated",
+            "kind": "deprecated-commands",
+        },
+    ]
+    fixed, applied = autofix_syntax(WorkflowYAML(workflow), errors)
+    assert applied == ["true-key", "action", "deprecated-commands"]
+    assert fixed == (
+        "on: push\n"
+        "jobs:\n"
+        "  build:\n"
+        "    runs-on: ubuntu-latest\n"
+        "    steps:\n"
+        "      - uses: actions/setup-python@v5\n"
+        "        with:\n"
+        '          python-version: "3.10"\n'
+        "      - run: |\n"
+        '          echo "version=1.0" >> "$GITHUB_OUTPUT"\n'
+        '          echo /opt/bin >> "$GITHUB_PATH"\n'
+    )
+
+
+def test_unparsable_workflow_untouched():
+    workflow = "on: [push\n"
+    assert fix(workflow, finding("excessive-permissions")) == (workflow, [])
@@ -0,0 +1,35 @@
+import pytest
+
+from utils.checkpoint import Checkpoints
+
+config = {"dataset": "hard", "drafts": 1}
+
+
+def test_resume(tmp_path):
+    checkpoints = Checkpoints(str(tmp_path), config)
+    assert not checkpoints.done("generated", 1)
+    checkpoints.save("generated", 1, "name: CI\n")
+    # A stage that produced None still counts as done.
+    checkpoints.save("scored", 1, None)
+
+    resumed = Checkpoints(str(tmp_path), config, resume=True)
+    assert resumed.done("generated", 1)
+    assert resumed.load("generated", 1) == "name: CI\n"
+    assert resumed.done("scored", 1)
+    assert not resumed.done("functional_test", 1)
+    with pytest.raises(KeyError):
+        resumed.load("functional_test", 1)
+
+
+def test_fresh_run_clears_checkpoints(tmp_path):
+    Checkpoints(str(tmp_path), config).save("generated", 1, "name: old\n")
+    Checkpoints(str(tmp_path), config)
+    # A run resumed after the fresh one does not pick up the older run's.
+    assert not Checkpoints(str(tmp_path), config, resume=True).done("generated", 1)
+
+
+def test_configurations_kept_apart(tmp_path):
+    Checkpoints(str(tmp_path), config).save("generated", 1, "name: CI\n")
+    other = Checkpoints(str(tmp_path), {**config, "drafts": 2})
+    assert not other.done("generated", 1)
+    assert Checkpoints(str(tmp_path), config, resume=True).done("generated", 1)
@@ -0,0 +1,248 @@
+import json
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from utils import functional_test
+from utils.cache import DiskCache
+from utils.functional_test import ResourceBudget, RunnerPool, WorkflowTestRunner
+from utils.workspace import WorkspaceProvider, workspace_methods
+
+workflow_path = Path(".github") / "workflows" / "test_workflow.yml"
+
+
+class StubAct:
+    """Stands in for act: records the workspace of every call, checks that
+    nothing from an earlier test is left in it and leaves an artifact behind,
+    which must be gone by the next test."""
+
+    def __init__(self):
+        self.calls: list[Path] = []
+        self.fail = False
+
+    def __call__(
+        self, cmd: list[str], cwd: Path, timeout: int
+    ) -> subprocess.CompletedProcess[str]:
+        self.calls.append(cwd)
+        artifacts = Path(cmd[cmd.index("--artifact-server-path") + 1])
+        workflow = Path(cmd[cmd.index("-W") + 1])
+        assert workflow == cwd / workflow_path
+        assert (cwd / "src" / "main.py").read_text() == "print('hello')\n"
+        assert not (cwd / "leftover.txt").exists()
+        assert not any(artifacts.iterdir())
+        event = json.loads((cwd / "event.json").read_text())
+
+        (artifacts / "artifact.zip").write_text("artifact")
+        if self.fail:
+            raise RuntimeError("act crashed")
+        return subprocess.CompletedProcess(
+            cmd, 0, json.dumps({"workflow": workflow.read_text(), **event}), ""
+        )
+
+
+def make_repository(path: Path) -> Path:
+    (path / "src").mkdir(parents=True)
+    (path / "src" / "main.py").write_text("print('hello')\n")
+    (path / workflow_path).parent.mkdir(parents=True)
+    (path / workflow_path).write_text("name: original\n")
+    return path
+
+
+def mounts(root: Path) -> list[str]:
+    with open("/proc/mounts") as f:
+        return [line for line in f if str(root) in line]
+
+
+@pytest.fixture(params=workspace_methods)
+def workspaces(request, tmp_path):
+    """A provider limited to one method, skipped where the method is not
+    available, such as overlay without privileges."""
+    provider = WorkspaceProvider((request.param,), root=str(tmp_path / "workspaces"))
+    try:
+        with provider.create(str(make_repository(tmp_path / "probe"))):
+            pass
+    except (OSError, RuntimeError, subprocess.CalledProcessError):
+        pytest.skip(f"{request.param} workspaces unavailable")
+    return provider
+
+
+@pytest.fixture
+def repository(tmp_path):
+    return make_repository(tmp_path / "repository")
+
+
+def run(runner: WorkflowTestRunner, repository: Path, name: str) -> dict:
+    result = runner.run_test(f"name: {name}\n", repository_path=str(repository))
+    assert result.return_code is None and result.dryrun_output
+    return result.dryrun_output[0]
+
+
+def test_slot_reused_and_reset(workspaces, repository, tmp_path):
+    act = StubAct()
+    pool = RunnerPool(workspaces, max_idle=1)
+    runner = WorkflowTestRunner(runner_pool=pool, command_executor=act, use_cache=False)
+
+    assert run(runner, repository, "first")["workflow"] == "name: first\n"
+    [slot] = pool.idle
+    workspace = slot.workspace
+    # The slot is back to the repository's state, files written by the test
+    # included, and its artifacts are gone.
+    assert (workspace.path / workflow_path).read_text() == "name: original\n"
+    assert not (workspace.path / "event.json").exists()
+    assert not any(slot.artifacts.iterdir())
+    assert workspace.written == []
+    if workspace.method == "overlay":
+        # Remounted over empty layers.
+        assert len(mounts(workspace.directory)) == 1
+        assert not any((workspace.directory / "upper").iterdir())
+    workspace.write_file("leftover.txt", "from the first test")
+    workspaces.reset(workspace)
+
+    assert run(runner, repository, "second")["workflow"] == "name: second\n"
+    assert act.calls == [workspace.path, workspace.path]
+    assert pool.idle == [slot]
+    assert workspaces.stats[workspace.method].workspaces == 2  # Probe included.
+    # The repository itself is never written to.
+    assert (repository / workflow_path).read_text() == "name: original\n"
+    assert not (repository / "event.json").exists()
+
+    pool.shutdown()
+    assert pool.idle == []
+    assert not workspace.directory.exists()
+    assert not slot.artifacts.exists()
+    assert mounts(tmp_path) == []
+
+
+def test_slot_per_repository(workspaces, repository, tmp_path):
+    other = make_repository(tmp_path / "other")
+    act = StubAct()
+    pool = RunnerPool(workspaces, max_idle=1)
+    runner = WorkflowTestRunner(runner_pool=pool, command_executor=act, use_cache=False)
+
+    run(runner, repository, "first")
+    [first] = pool.idle
+    run(runner, other, "other")
+    # Another repository gets its own slot, which evicts the first one.
+    [second] = pool.idle
+    assert act.calls[1] != act.calls[0]
+    assert second.repository_path == str(other)
+    assert not first.workspace.directory.exists()
+
+    pool.shutdown()
+    assert mounts(tmp_path) == []
+
+
+def test_failed_test_slot_closed(workspaces, repository, tmp_path):
+    act = StubAct()
+    pool = RunnerPool(workspaces, max_idle=1)
+    runner = WorkflowTestRunner(runner_pool=pool, command_executor=act, use_cache=False)
+
+    act.fail = True
+    with pytest.raises(RuntimeError):
+        run(runner, repository, "first")
+    # Whatever the failed test left behind goes with its slot.
+    assert pool.idle == []
+    assert not act.calls[0].exists()
+    assert mounts(tmp_path) == []
+
+    act.fail = False
+    run(runner, repository, "second")
+    assert act.calls[1] != act.calls[0]
+    pool.shutdown()
+
+
+class ScriptedAct:
+    """Stands in for act, answering every dry run with the next of the given
+    results."""
+
+    def __init__(self, *results: tuple[int, str] | Exception):
+        self.results = list(results)
+        self.calls = 0
+
+    def __call__(
+        self, cmd: list[str], cwd: Path, timeout: int
+    ) -> subprocess.CompletedProcess[str]:
+        result = self.results[self.calls]
+        self.calls += 1
+        if isinstance(result, Exception):
+            raise result
+        returncode, stderr = result
+        return subprocess.CompletedProcess(cmd, returncode, "", stderr)
+
+
+@pytest.fixture
+def act_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(functional_test, "tool_version", lambda tool: "act test")
+    cache = DiskCache(str(tmp_path / "act.sqlite"))
+    monkeypatch.setattr(functional_test, "act_cache", cache)
+    return cache
+
+
+def cached_runner(
+    act: ScriptedAct, tmp_path: Path, budget: ResourceBudget | None = None
+) -> WorkflowTestRunner:
+    workspaces = WorkspaceProvider(root=str(tmp_path))
+    return WorkflowTestRunner(
+        budget=budget, workspaces=workspaces, command_executor=act
+    )
+
+
+def test_dryrun_key(act_cache, tmp_path):
+    runner = cached_runner(ScriptedAct(), tmp_path)
+    key = runner._dryrun_key("name: CI\n", "{}", None)
+    assert key == cached_runner(ScriptedAct(), tmp_path)._dryrun_key(
+        "name: CI\n", "{}", None
+    )
+    assert key != runner._dryrun_key("name: other\n", "{}", None)
+    assert key != runner._dryrun_key("name: CI\n", '{"ref": "main"}', None)
+    limited = cached_runner(ScriptedAct(), tmp_path, ResourceBudget(memory_mb=512))
+    assert key != limited._dryrun_key("name: CI\n", "{}", None)
+    # Outside of git the repository's state is unknown, so nothing is cached.
+    assert runner._dryrun_key("name: CI\n", "{}", str(tmp_path)) is None
+
+
+@pytest.mark.parametrize(
+    "result",
+    [
+        (0, ""),
+        (1, "Error: workflow is not valid. 'test_workflow.yml': Line: 3"),
+        (1, "Error: Could not find any stages to run."),
+    ],
+)
+def test_deterministic_result_cached(act_cache, tmp_path, result):
+    act = ScriptedAct(result)
+    runner = cached_runner(act, tmp_path)
+    first = runner.run_test("name: CI\n")
+    assert runner.run_test("name: CI\n") == first
+    assert act.calls == 1
+
+
+@pytest.mark.parametrize(
+    "result",
+    [
+        (1, "Cannot connect to the Docker daemon at unix:///var/run/docker.sock"),
+        (2, "fatal error: runtime: out of memory"),
+        # Killed by prlimit's CPU time limit.
+        (-24, ""),
+        subprocess.TimeoutExpired(["act"], 900),
+    ],
+)
+def test_transient_failure_not_cached(act_cache, tmp_path, result):
+    act = ScriptedAct(result, (0, ""))
+    runner = cached_runner(act, tmp_path)
+    if isinstance(result, Exception):
+        with pytest.raises(type(result)):
+            runner.run_test("name: CI\n")
+    else:
+        assert runner.run_test("name: CI\n").return_code == result[0]
+    assert runner.run_test("name: CI\n").return_code is None
+    assert act.calls == 2
+
+
+def test_cache_keyed_by_budget(act_cache, tmp_path):
+    act = ScriptedAct((0, ""), (-9, ""))
+    cached_runner(act, tmp_path).run_test("name: CI\n")
+    limited = cached_runner(act, tmp_path, ResourceBudget(memory_mb=1))
+    assert limited.run_test("name: CI\n").return_code == -9
+    assert act.calls == 2
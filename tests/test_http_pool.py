@@ -0,0 +1,15 @@
+from utils import http_pool
+
+
+def test_http2_fallback_logged_once(monkeypatch):
+    messages = []
+    monkeypatch.setattr(http_pool, "log_progress", messages.append)
+    monkeypatch.setattr(http_pool, "_http2_fallback_logged", False)
+    monkeypatch.setattr(http_pool.importlib.util, "find_spec", lambda name: None)
+    assert not http_pool._client_options()["http2"]
+    assert not http_pool._client_options()["http2"]
+    assert messages == ["h2 is not installed, falling back to HTTP/1.1"]
+
+    monkeypatch.setattr(http_pool.http_config, "http2", False)
+    assert not http_pool._client_options()["http2"]
+    assert len(messages) == 1
@@ -0,0 +1,285 @@
+import asyncio
+import json
+import subprocess
+import sys
+
+import pytest
+
+from utils import lint
+from utils.cache import DiskCache
+from utils.lint import CheckerError
+
+
+def workflow(run: str) -> str:
+    return (
+        "name: CI\n"
+        "on: push\n"
+        "jobs:\n"
+        "  build:\n"
+        "    runs-on: ubuntu-latest\n"
+        "    steps:\n"
+        f"      - run: {run}\n"
+    )
+
+
+good = workflow("make")
+bad = workflow("make bad")
+secret = workflow("echo secret")
+# Structurally broken: rejected by the prevalidator before any tool runs.
+broken = "name: CI\non: push\njobs: [build]\n"
+
+
+def actionlint_error(filepath: str) -> dict:
+    return {
+        "message": "bad step",
+        "filepath": filepath,
+        "line": 7,
+        "column": 9,
+        "kind": "syntax-check",
+    }
+
+
+def finding(path: str) -> dict:
+    return {
+        "ident": "secret",
+        "desc": "secret in run",
+        "url": "",
+        "determinations": {},
+        "ignored": False,
+        "locations": [
+            {
+                "symbolic": {
+                    "key": {"Local": {"prefix": None, "given_path": path}},
+                    "annotation": "here",
+                    "kind": "Primary",
+                },
+                "concrete": {},
+            }
+        ],
+    }
+
+
+class FakeCheckers:
+    """Stands in for actionlint and zizmor. actionlint reports the steps
+    containing "bad"; zizmor reports those containing "secret" and fails on a
+    run with a file containing "unloadable". Either can be made to crash."""
+
+    def __init__(self):
+        self.runs: list[list[str]] = []
+        self.crash: set[str] = set()
+        self.crash_batches: set[str] = set()
+
+    def __call__(self, args, input=None, **kwargs) -> subprocess.CompletedProcess:
+        tool = args[0]
+        self.runs.append(args)
+        if input is not None:
+            files = {"test.yml": input}
+        else:
+            files = {}
+            for path in args[1:]:
+                if path.endswith(".yml"):
+                    with open(path) as f:
+                        files[path] = f.read()
+        if tool in self.crash or (tool in self.crash_batches and len(files) > 1):
+            return subprocess.CompletedProcess(args, 3, "", f"{tool} crashed")
+        if tool == "actionlint":
+            errors = [
+                actionlint_error(path)
+                for path, content in files.items()
+                if "bad" in content
+            ]
+            return subprocess.CompletedProcess(
+                args, 1 if errors else 0, json.dumps(errors), ""
+            )
+        if any("unloadable" in content for content in files.values()):
+            return subprocess.CompletedProcess(args, 1, "", "failed to load")
+        findings = [
+            finding(path) for path, content in files.items() if "secret" in content
+        ]
+        return subprocess.CompletedProcess(
+            args, 14 if findings else 0, json.dumps(findings), ""
+        )
+
+    def files(self, tool: str) -> list[int]:
+        """The number of workflows in each run of the tool."""
+        return [
+            sum(arg.endswith(".yml") for arg in args) or 1
+            for args in self.runs
+            if args[0] == tool
+        ]
+
+
+@pytest.fixture
+def checkers(monkeypatch, tmp_path):
+    fake = FakeCheckers()
+    monkeypatch.setattr(lint.subprocess, "run", fake)
+    monkeypatch.setattr(lint, "tool_version", lambda tool: f"{tool} test")
+    monkeypatch.setattr(lint, "lint_cache", DiskCache(str(tmp_path / "lint.sqlite")))
+    return fake
+
+
+def test_validate_workflow(checkers):
+    assert lint.validate_workflow(good) == {"valid": True, "output": []}
+    result = lint.validate_workflow(bad)
+    assert result == {"valid": False, "output": [actionlint_error("test.yml")]}
+    # Cached.
+    assert lint.validate_workflow(bad) == result
+    assert checkers.files("actionlint") == [1, 1]
+
+
+def test_validate_workflow_prevalidated(checkers):
+    assert lint.validate_workflow(None)["output"][0]["kind"] == "empty"
+    result = lint.validate_workflow(broken)
+    assert result["valid"] is False
+    assert "jobs" in result["output"][0]["message"]
+    assert checkers.runs == []
+
+
+def test_validate_workflow_crash_not_cached(checkers):
+    checkers.crash.add("actionlint")
+    with pytest.raises(CheckerError, match="actionlint exited with 3"):
+        lint.validate_workflow(good)
+    checkers.crash.clear()
+    assert lint.validate_workflow(good)["valid"] is True
+
+
+@pytest.mark.parametrize(
+    "returncode, stdout",
+    [(1, "[]"), (0, json.dumps([actionlint_error("test.yml")])), (0, "garbage")],
+)
+def test_inconsistent_actionlint_output(checkers, monkeypatch, returncode, stdout):
+    monkeypatch.setattr(
+        lint.subprocess,
+        "run",
+        lambda args, **kwargs: subprocess.CompletedProcess(
+            args, returncode, stdout, ""
+        ),
+    )
+    with pytest.raises(CheckerError):
+        lint.validate_workflow(good)
+
+
+def test_validate_workflows(checkers):
+    lint.validate_workflow(good)
+    results = lint.validate_workflows([None, "", broken, good, bad, bad + "# 2\n"])
+
+    assert [result["valid"] for result in results] == [
+        False,
+        False,
+        False,
+        True,
+        False,
+        False,
+    ]
+    # Only the two workflows neither rejected nor cached go to actionlint, in
+    # one run, and their diagnostics are recorded as a single-file run does.
+    assert checkers.files("actionlint") == [1, 2]
+    assert results[4]["output"] == [actionlint_error("test.yml")]
+    assert results[5]["output"] == [actionlint_error("test.yml")]
+    assert lint.validate_workflow(bad) == results[4]
+    assert checkers.files("actionlint") == [1, 2]
+
+
+def test_validate_workflows_falls_back_to_single_runs(checkers):
+    checkers.crash_batches.add("actionlint")
+    results = lint.validate_workflows([good, bad])
+    assert [result["valid"] for result in results] == [True, False]
+    assert checkers.files("actionlint") == [2, 1, 1]
+
+    checkers.crash.add("actionlint")
+    with pytest.raises(CheckerError):
+        lint.validate_workflows([good + "# 2\n", bad + "# 2\n"])
+    # Nothing from the failed runs was cached.
+    checkers.crash.clear()
+    checkers.crash_batches.clear()
+    assert lint.validate_workflows([good + "# 2\n"])[0]["valid"] is True
+
+
+def test_check_vulnerabilities(checkers):
+    [found] = lint.check_vulnerabilities(secret)
+    assert found["locations"][0]["symbolic"]["key"]["Local"]["given_path"] == (
+        "test.yml"
+    )
+    assert lint.check_vulnerabilities(good) == []
+    assert lint.check_vulnerabilities(secret) == [found]
+    assert checkers.files("zizmor") == [1, 1]
+    # zizmor cannot load these, so it is not run on them.
+    assert lint.check_vulnerabilities("") == []
+    assert lint.check_vulnerabilities(broken) == []
+    assert checkers.files("zizmor") == [1, 1]
+
+
+def test_check_vulnerabilities_failure_not_cached(checkers):
+    checkers.crash.add("zizmor")
+    assert lint.check_vulnerabilities(secret) == []
+    assert lint.check_vulnerabilities_formatted(secret) == ""
+    checkers.crash.clear()
+    assert len(lint.check_vulnerabilities(secret)) == 1
+
+
+def test_check_vulnerabilities_batch(checkers):
+    lint.check_vulnerabilities(good)
+    results = lint.check_vulnerabilities_batch(
+        [None, "", broken, good, secret, secret + "# 2\n"]
+    )
+    assert [len(found) for found in results] == [0, 0, 0, 0, 1, 1]
+    assert checkers.files("zizmor") == [1, 2]
+    assert results[4] == lint.check_vulnerabilities(secret)
+    assert checkers.files("zizmor") == [1, 2]
+
+
+def test_check_vulnerabilities_batch_falls_back_to_single_runs(checkers):
+    unloadable = workflow("echo unloadable")
+    results = lint.check_vulnerabilities_batch([secret, unloadable, good])
+    assert [len(found) for found in results] == [1, 0, 0]
+    assert checkers.files("zizmor") == [3, 1, 1, 1]
+    # The workflow zizmor failed on is not cached; the others are.
+    lint.check_vulnerabilities_batch([secret, unloadable, good])
+    assert checkers.files("zizmor") == [3, 1, 1, 1, 1]
+
+
+def test_async_checks(checkers, monkeypatch):
+    async def run_checker(args, input=None):
+        return checkers(args, input)
+
+    monkeypatch.setattr(lint, "_run_checker", run_checker)
+
+    async def check():
+        return await asyncio.gather(
+            lint.validate_workflow_async(bad),
+            lint.check_vulnerabilities_async(secret),
+            lint.check_vulnerabilities_async(broken),
+        )
+
+    validation, found, not_audited = asyncio.run(check())
+    assert validation == lint.validate_workflow(bad)
+    assert found == lint.check_vulnerabilities(secret)
+    assert not_audited == []
+    assert checkers.files("actionlint") == [1]
+    assert checkers.files("zizmor") == [1]
+
+    checkers.crash.add("actionlint")
+    with pytest.raises(CheckerError):
+        asyncio.run(lint.validate_workflow_async(good))
+
+
+def test_run_checker(monkeypatch):
+    script = (
+        "import sys, time; time.sleep(0.2); data = sys.stdin.read(); "
+        "print(data.upper()); print('warned', file=sys.stderr); sys.exit(14)"
+    )
+    monkeypatch.setattr(lint, "max_concurrent_checks", 2)
+
+    async def run():
+        start = asyncio.get_running_loop().time()
+        results = await asyncio.gather(
+            *(lint._run_checker([sys.executable, "-c", script], "ok") for _ in range(4))
+        )
+        return results, asyncio.get_running_loop().time() - start
+
+    results, elapsed = asyncio.run(run())
+    assert [result.returncode for result in results] == [14] * 4
+    assert results[0].stdout == "OK\n"
+    assert results[0].stderr == "warned\n"
+    # Two at a time: two rounds of sleeps.
+    assert elapsed >= 0.4
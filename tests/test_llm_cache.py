@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from utils import llm_cache
+from utils.cache import DiskCache
+from utils.llm_cache import (
+    LLMCacheMiss,
+    acached_call,
+    cached_call,
+    llm_cache_key,
+    llm_cache_scope,
+    set_llm_cache_mode,
+)
+
+key = llm_cache_key("model", [{"role": "user", "content": "hi"}], {"seed": 0})
+
+
+class Model:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self) -> dict:
+        self.calls += 1
+        return {"content": f"response {self.calls}"}
+
+
+@pytest.fixture
+def model(monkeypatch, tmp_path):
+    monkeypatch.setattr(llm_cache, "llm_cache", DiskCache(str(tmp_path / "llm.sqlite")))
+    monkeypatch.setattr(llm_cache, "mode", "off")
+    return Model()
+
+
+def test_key():
+    assert key == llm_cache_key(
+        "model", [{"role": "user", "content": "hi"}], {"seed": 0}
+    )
+    assert key != llm_cache_key("model", [{"role": "user", "content": "hi"}], {})
+    assert key != llm_cache_key(
+        "other", [{"role": "user", "content": "hi"}], {"seed": 0}
+    )
+
+
+def test_invalid_mode():
+    with pytest.raises(ValueError):
+        set_llm_cache_mode("write")  # type: ignore[arg-type]
+
+
+def test_off(model):
+    assert cached_call(key, model) == {"content": "response 1"}
+    assert cached_call(key, model) == {"content": "response 2"}
+    set_llm_cache_mode("replay")
+    with pytest.raises(LLMCacheMiss):
+        cached_call(key, model)
+
+
+def test_record_then_replay(model):
+    set_llm_cache_mode("record")
+    # Recording always calls the model.
+    assert cached_call(key, model) == {"content": "response 1"}
+    assert cached_call(key, model) == {"content": "response 2"}
+    set_llm_cache_mode("replay")
+    assert cached_call(key, model) == {"content": "response 2"}
+    assert model.calls == 2
+    with pytest.raises(LLMCacheMiss):
+        cached_call(llm_cache_key("model", [], {}), model)
+
+
+def test_read_through(model):
+    set_llm_cache_mode("read-through")
+    assert cached_call(key, model) == {"content": "response 1"}
+    assert cached_call(key, model) == {"content": "response 1"}
+    assert model.calls == 1
+    # A miss calls the model rather than failing.
+    cached_call(llm_cache_key("model", [], {}), model)
+    assert model.calls == 2
+
+
+def test_repeated_requests_in_scope(model):
+    set_llm_cache_mode("record")
+    with llm_cache_scope():
+        first = [cached_call(key, model) for _ in range(3)]
+    assert first == [{"content": f"response {i}"} for i in (1, 2, 3)]
+
+    # A replayed run makes the same requests in the same order.
+    set_llm_cache_mode("replay")
+    with llm_cache_scope():
+        assert [cached_call(key, model) for _ in range(3)] == first
+        with pytest.raises(LLMCacheMiss):
+            cached_call(key, model)
+    # The first occurrence keeps the plain key.
+    assert cached_call(key, model) == first[0]
+
+
+def test_async(model):
+    async def call() -> dict:
+        return model()
+
+    set_llm_cache_mode("read-through")
+
+    async def run() -> list:
+        with llm_cache_scope():
+            return [await acached_call(key, call) for _ in range(2)]
+
+    assert asyncio.run(run()) == [{"content": "response 1"}, {"content": "response 2"}]
+    assert asyncio.run(run()) == [{"content": "response 1"}, {"content": "response 2"}]
+    assert model.calls == 2
@@ -0,0 +1,48 @@
+import pytest
+
+from utils.logger import LogWriter
+
+
+def test_flush_writes_queued_lines(tmp_path):
+    writer = LogWriter(flush_interval=60)
+    for i in range(3):
+        writer.put(str(tmp_path / "a.log"), f"a{i}\n")
+    writer.put(str(tmp_path / "b.log"), "b\n")
+    writer.flush()
+    assert (tmp_path / "a.log").read_text() == "a0\na1\na2\n"
+    assert (tmp_path / "b.log").read_text() == "b\n"
+
+
+def test_flush_before_any_line():
+    LogWriter().flush()
+
+
+def test_failed_batch_raised_by_flush(tmp_path):
+    writer = LogWriter(flush_interval=60)
+    writer.put(str(tmp_path / "missing" / "a.log"), "lost\n")
+    with pytest.raises(FileNotFoundError):
+        writer.flush()
+    # The writer carries on, and the error is only raised once.
+    writer.put(str(tmp_path / "a.log"), "kept\n")
+    writer.flush()
+    assert (tmp_path / "a.log").read_text() == "kept\n"
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_flush_does_not_wait_for_a_dead_thread(tmp_path, monkeypatch):
+    writer = LogWriter(flush_interval=0.01)
+
+    def crash(batch):
+        raise ValueError("writer bug")
+
+    monkeypatch.setattr(writer, "_write", crash)
+    writer.put(str(tmp_path / "a.log"), "lost\n")
+    writer.thread.join(5)
+    with pytest.raises(RuntimeError, match="stopped"):
+        writer.flush(poll_interval=0.01)
+
+    # The next line starts a new thread.
+    monkeypatch.undo()
+    writer.put(str(tmp_path / "a.log"), "kept\n")
+    writer.flush()
+    assert (tmp_path / "a.log").read_text() == "kept\n"
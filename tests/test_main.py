@@ -0,0 +1,96 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+import main
+from main import AgentsWorkflow, draft_cost
+from utils.app_types import GraphState, WorkflowYAML
+from utils.llm_cache import LLMCacheMiss
+
+valid = WorkflowYAML(
+    "on: push\n"
+    "jobs:\n"
+    "  build:\n"
+    "    runs-on: ubuntu-latest\n"
+    "    steps:\n"
+    "      - run: make\n"
+)
+# Rejected by the prevalidator: jobs must be a mapping.
+rejected = WorkflowYAML("on: push\njobs: [build]\n")
+
+
+def draft(workflow: WorkflowYAML | None, errors: int = 0) -> GraphState:
+    return GraphState(
+        workflow=workflow,
+        llm_response=None,
+        static_check={
+            "valid": errors == 0,
+            "output": [{"message": "error", "kind": "syntax-check"}] * errors,
+        },
+        vulnerabilities=[],
+        judgement=None,
+        judge_score=None,
+        prompt="prompt",
+        syntax_retries_left=1,
+        if_retries_left=1,
+        vuln_retries_left=1,
+    )
+
+
+def test_draft_cost_ranks_rejected_drafts_last():
+    costs = [draft(valid, 5), draft(rejected, 1), draft(None), draft(valid)]
+    ranked = sorted(costs, key=draft_cost)
+    assert [state.workflow for state in ranked] == [valid, valid, rejected, None]
+    assert draft_cost(draft(valid)) == (0, 0, 0)
+
+
+def api_error() -> openai.APIError:
+    request = httpx.Request("POST", "http://127.0.0.1:9")
+    return openai.APIConnectionError(request=request)
+
+
+@pytest.fixture
+def workflow(monkeypatch):
+    monkeypatch.setattr(main, "log_progress", lambda message: None)
+    return AgentsWorkflow.__new__(AgentsWorkflow)
+
+
+@pytest.mark.parametrize("mode", ["threads", "asyncio"])
+def test_best_draft_skips_failed_drafts(workflow, mode):
+    outcomes = [api_error(), LLMCacheMiss("key"), draft(rejected), draft(valid, 2)]
+
+    def generate(prompt, variant, cancelled=None):
+        outcome = outcomes[variant]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    async def agenerate(prompt, variant):
+        return generate(prompt, variant)
+
+    workflow.generate_draft = generate
+    workflow.agenerate_draft = agenerate
+    if mode == "threads":
+        best = workflow.generate_best_draft("prompt", len(outcomes))
+    else:
+        best = asyncio.run(workflow.agenerate_best_draft("prompt", len(outcomes)))
+    assert best is outcomes[3]
+
+
+@pytest.mark.parametrize("mode", ["threads", "asyncio"])
+def test_best_draft_raises_unexpected_errors(workflow, mode):
+    def generate(prompt, variant, cancelled=None):
+        raise TypeError("bug")
+
+    async def agenerate(prompt, variant):
+        generate(prompt, variant)
+
+    workflow.generate_draft = generate
+    workflow.agenerate_draft = agenerate
+    with pytest.raises(TypeError):
+        if mode == "threads":
+            workflow.generate_best_draft("prompt", 2)
+        else:
+            asyncio.run(workflow.agenerate_best_draft("prompt", 2))
@@ -0,0 +1,125 @@
+import pytest
+
+from functions import apply_patch_function
+from utils.app_types import GraphState, WorkflowYAML
+from utils.patch import Hunk, PatchError, apply_patch, number_lines, parse_patch
+
+workflow = WorkflowYAML(
+    "name: CI\n"
+    "on: push\n"
+    "jobs:\n"
+    "  build:\n"
+    "    runs-on: ubuntu-latest\n"
+    "    steps:\n"
+    "      - run: make"
+)
+
+
+def patch(*lines: str) -> str:
+    return "Here is the fix:\n```patch\n" + "\n".join(lines) + "\n```\n"
+
+
+def make_state(workflow: WorkflowYAML | None, llm_response: str) -> GraphState:
+    return GraphState(
+        workflow=workflow,
+        llm_response=llm_response,
+        static_check=None,
+        vulnerabilities=None,
+        judgement=None,
+        judge_score=None,
+        prompt="",
+        syntax_retries_left=1,
+        if_retries_left=1,
+        vuln_retries_left=1,
+    )
+
+
+def test_number_lines():
+    numbered = number_lines(WorkflowYAML("\n".join(["a"] * 10)))
+    assert numbered.split("\n")[0] == " 1 | a"
+    assert numbered.split("\n")[9] == "10 | a"
+
+
+def test_parse_patch():
+    hunks = parse_patch(
+        patch("@@ 2 @@", "on: [push]", "@@ 5-7 @@", "@@ after 1 @@", "# added", "")
+    )
+    assert hunks == [
+        Hunk(2, 2, ["on: [push]"]),
+        Hunk(5, 7, []),
+        # Only the blank line left by the closing fence is dropped.
+        Hunk(2, 1, ["# added", ""]),
+    ]
+
+
+@pytest.mark.parametrize(
+    "text, message",
+    [
+        ("no patch here", "No ```patch block"),
+        (patch("on: push"), "before the first hunk header"),
+        (patch(""), "no hunks"),
+    ],
+)
+def test_parse_patch_rejects(text, message):
+    with pytest.raises(PatchError, match=message):
+        parse_patch(text)
+
+
+def test_apply_patch():
+    hunks = parse_patch(
+        patch(
+            "@@ 2 @@",
+            "on: [push, pull_request]",
+            "@@ after 5 @@",
+            "    timeout-minutes: 10",
+            "@@ 1 @@",
+        )
+    )
+    assert apply_patch(workflow, hunks) == (
+        "on: [push, pull_request]\n"
+        "jobs:\n"
+        "  build:\n"
+        "    runs-on: ubuntu-latest\n"
+        "    timeout-minutes: 10\n"
+        "    steps:\n"
+        "      - run: make"
+    )
+
+
+@pytest.mark.parametrize(
+    "hunks, message",
+    [
+        ([Hunk(8, 8, [])], "out of range"),
+        ([Hunk(0, 1, [])], "out of range"),
+        ([Hunk(2, 3, []), Hunk(3, 4, [])], "overlaps"),
+        ([Hunk(2, 2, ["on: [push"])], "not valid YAML"),
+    ],
+)
+def test_apply_patch_rejects(hunks, message):
+    with pytest.raises(PatchError, match=message):
+        apply_patch(workflow, hunks)
+
+
+def test_apply_patch_without_workflow():
+    with pytest.raises(PatchError, match="No workflow"):
+        apply_patch(None, parse_patch(patch("@@ after 0 @@", "on: push")))
+
+
+def test_apply_patch_function():
+    state = apply_patch_function(make_state(workflow, patch("@@ 1 @@", "name: Build")))
+    assert state.workflow == workflow.replace("name: CI", "name: Build")
+
+
+def test_apply_patch_function_without_workflow():
+    # A patch with nothing to apply it to is rejected, not raised.
+    state = apply_patch_function(make_state(None, patch("@@ after 0 @@", "on: push")))
+    assert state.workflow is None
+
+
+def test_apply_patch_function_falls_back_to_workflow():
+    # Models sometimes answer with the whole workflow instead of a patch.
+    response = "```yaml\nname: CI\non: push\n```"
+    state = apply_patch_function(make_state(None, response))
+    assert state.workflow == "name: CI\non: push"
+    state = apply_patch_function(make_state(workflow, response))
+    assert state.workflow == "name: CI\non: push"
@@ -0,0 +1,92 @@
+import pytest
+
+from utils.prevalidate import prevalidate_workflow
+
+valid = (
+    "on: push\n"
+    "jobs:\n"
+    "  build:\n"
+    "    runs-on: ubuntu-latest\n"
+    "    steps:\n"
+    "      - uses: actions/checkout@v4\n"
+    "      - run: make\n"
+    "  release:\n"
+    "    uses: ./.github/workflows/release.yml\n"
+)
+
+
+def messages(workflow: str) -> list[str]:
+    return [diagnostic["message"] for diagnostic in prevalidate_workflow(workflow)]
+
+
+def test_valid_workflow():
+    assert prevalidate_workflow(valid) == []
+
+
+@pytest.mark.parametrize(
+    "workflow, expected",
+    [
+        ("", ["workflow is empty"]),
+        ("- on: push\n", ["workflow must be mapping node but got sequence node"]),
+        ("jobs: {}\n", ['"on" section is missing in workflow']),
+        ("on: push\n", ['"jobs" section is missing in workflow']),
+        (
+            "on: push\njobs: [build]\n",
+            ['"jobs" section must be mapping node but got sequence node'],
+        ),
+        (
+            "on: push\njobs:\n  build: make\n",
+            ['job "build" must be mapping node but got scalar node'],
+        ),
+        (
+            "on: push\njobs:\n  build:\n    steps: []\n",
+            ['"runs-on" section is missing in job "build"'],
+        ),
+        (
+            "on: push\njobs:\n  build:\n    runs-on: ubuntu-latest\n",
+            ['"steps" section is missing in job "build"'],
+        ),
+        (
+            "on: push\njobs:\n  build:\n    runs-on: ubuntu-latest\n    steps: make\n",
+            [
+                '"steps" section in job "build" must be sequence node but got scalar node'
+            ],
+        ),
+        (
+            (
+                "on: push\njobs:\n  build:\n    runs-on: ubuntu-latest\n"
+                "    steps:\n      - name: nothing\n      - make\n"
+            ),
+            [
+                'step must run script with "run" section or run action with "uses" section',
+                'step in job "build" must be mapping node but got scalar node',
+            ],
+        ),
+    ],
+)
+def test_structural_errors(workflow, expected):
+    assert messages(workflow) == expected
+
+
+def test_true_key():
+    # The "on" key of a workflow dumped by PyYAML.
+    errors = prevalidate_workflow(valid.replace("on: push", "true: push"))
+    assert [error["message"] for error in errors] == [
+        'unexpected key "true" for "workflow" section. did you mean "on"?',
+        '"on" section is missing in workflow',
+    ]
+    assert errors[0]["line"] == 1
+    assert errors[0]["column"] == 1
+    assert errors[0]["snippet"] == "true: push"
+
+
+def test_yaml_error():
+    [error] = prevalidate_workflow("on: push\njobs:\n  build: [\n")
+    assert error["message"].startswith("could not parse as YAML")
+    assert error["kind"] == "syntax-check"
+    assert error["line"] == 4
+
+
+def test_diagnostic_position():
+    [error] = prevalidate_workflow("on: push\njobs:\n  build:\n    runs-on: x\n")
+    assert (error["line"], error["column"], error["snippet"]) == (3, 3, "  build:")
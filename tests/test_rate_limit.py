@@ -0,0 +1,199 @@
+import asyncio
+from datetime import UTC, datetime
+from email.utils import format_datetime
+
+import httpx
+import openai
+import pytest
+
+from utils import client as client_module
+from utils import rate_limit
+from utils.client import Client
+from utils.rate_limit import (
+    ModelRateLimiter,
+    RateLimit,
+    TokenBucket,
+    backoff_delay,
+    retry_after,
+)
+
+
+class Clock:
+    """Stands in for time and asyncio.sleep: sleeping moves the clock on."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps: list[float] = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    monkeypatch.setattr(rate_limit, "asyncio", clock)
+    return clock
+
+
+def test_token_bucket(clock):
+    bucket = TokenBucket(per_minute=60)
+    assert bucket.wait_time(60) == 0
+    bucket.debit(60)
+    assert bucket.wait_time(1) == pytest.approx(1)
+    clock.now += 30
+    assert bucket.wait_time(30) == 0
+    # More than the capacity only waits for a full bucket.
+    assert bucket.wait_time(1000) == pytest.approx(30)
+    clock.now += 1000
+    assert bucket.tokens == 30
+    assert bucket.wait_time(0) == 0 and bucket.tokens == 60
+
+
+def test_limiter_waits_for_both_buckets(clock):
+    limiter = ModelRateLimiter(RateLimit(requests_per_minute=2, tokens_per_minute=600))
+
+    async def requests():
+        await limiter.acquire(100)
+        await limiter.acquire(100)
+        # Out of requests: one comes back every 30 seconds.
+        await limiter.acquire(100)
+        # Out of tokens: 100 are left once the third request turns out to
+        # have used 500, and 10 come back every second.
+        limiter.settle(100, 500)
+        await limiter.acquire(600)
+
+    asyncio.run(requests())
+    assert clock.sleeps == [pytest.approx(30), pytest.approx(50)]
+
+
+def test_limiter_pause(clock):
+    limiter = ModelRateLimiter(RateLimit())
+    limiter.pause(10)
+    # A shorter pause does not cut a longer one short.
+    limiter.pause(5)
+    asyncio.run(limiter.acquire(1))
+    assert clock.sleeps == [10]
+
+
+def response(status: int, **headers: str) -> httpx.Response:
+    request = httpx.Request("POST", "http://127.0.0.1:9/chat/completions")
+    return httpx.Response(status, headers=headers, request=request)
+
+
+def test_retry_after(clock):
+    assert retry_after(None) is None
+    assert retry_after(response(429)) is None
+    assert retry_after(response(429, **{"retry-after": "3"})) == 3
+    assert retry_after(response(429, **{"retry-after-ms": "1500"})) == 1.5
+    # The more precise header wins, unless it is unreadable.
+    both = {"retry-after-ms": "250", "retry-after": "1"}
+    assert retry_after(response(429, **both)) == 0.25
+    both["retry-after-ms"] = "soon"
+    assert retry_after(response(429, **both)) == 1
+    date = format_datetime(datetime.fromtimestamp(clock.now + 20, UTC))
+    assert retry_after(response(429, **{"retry-after": date})) == pytest.approx(20)
+    past = format_datetime(datetime.fromtimestamp(clock.now - 20, UTC))
+    assert retry_after(response(429, **{"retry-after": past})) == 0
+    assert retry_after(response(429, **{"retry-after": "later"})) is None
+
+
+def test_backoff_delay():
+    for attempt in range(10):
+        assert 0 <= backoff_delay(attempt, None) <= min(60, 2**attempt)
+    assert 5 <= backoff_delay(3, 5) <= 6
+
+
+class Completions:
+    """Stands in for the chat completions API, failing with the given errors
+    before it answers."""
+
+    def __init__(self, *errors: Exception):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def create(self, model, messages):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        usage = openai.types.CompletionUsage(
+            prompt_tokens=10, completion_tokens=5, total_tokens=15
+        )
+        return openai.types.chat.ChatCompletion(
+            id="1",
+            created=0,
+            model=model,
+            object="chat.completion",
+            choices=[
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": "answer"},
+                }
+            ],
+            usage=usage,
+        )
+
+
+def status_error(status: int, **headers: str) -> openai.APIStatusError:
+    return openai.APIStatusError(
+        "error", response=response(status, **headers), body=None
+    )
+
+
+def complete(
+    clock: Clock, monkeypatch, completions: Completions
+) -> tuple[Client, dict]:
+    monkeypatch.setattr(client_module, "asyncio", clock)
+    monkeypatch.setattr(client_module, "log_progress", lambda message: None)
+    client = Client(api_key="test", base_url="http://127.0.0.1:9", max_retries=2)
+    stub = type("Stub", (), {})()
+    stub.chat = type("Chat", (), {"completions": completions})()
+    client.loop_client = lambda: (stub, asyncio.Semaphore(1))  # type: ignore[method-assign]
+    result = asyncio.run(client._complete("model", [{"role": "user", "content": "hi"}]))
+    return client, result
+
+
+def test_capacity_errors_pause_the_model(clock, monkeypatch):
+    completions = Completions(status_error(429, **{"retry-after": "7"}))
+    client, result = complete(clock, monkeypatch, completions)
+    assert result["content"] == "answer"
+    assert completions.calls == 2
+    # The wait went through the model's limiter, which held the retry back.
+    assert client.limiters["model"].paused_until >= 1007
+    assert len(clock.sleeps) == 1 and 7 <= clock.sleeps[0] <= 8
+
+
+def test_transient_errors_retried(clock, monkeypatch):
+    request = httpx.Request("POST", "http://127.0.0.1:9")
+    completions = Completions(
+        openai.APITimeoutError(request=request), status_error(502)
+    )
+    client, result = complete(clock, monkeypatch, completions)
+    assert result["usage"]["total_tokens"] == 15
+    assert completions.calls == 3
+    assert client.limiters["model"].paused_until == 0
+
+
+@pytest.mark.parametrize(
+    "errors",
+    [
+        # Not retryable.
+        [status_error(400)],
+        # Out of retries.
+        [status_error(500), status_error(500), status_error(500)],
+    ],
+)
+def test_errors_raised(clock, monkeypatch, errors):
+    completions = Completions(*errors)
+    with pytest.raises(openai.APIStatusError):
+        complete(clock, monkeypatch, completions)
+    assert completions.calls == len(errors)
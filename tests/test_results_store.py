@@ -0,0 +1,148 @@
+import glob
+import json
+
+import pytest
+
+from models.score import Score
+from utils.functional_test import FunctionalTestResult
+from utils.results_store import ResultsStore, ScoreAggregator, score_row
+
+
+def make_score(workflow_id: int, tier: str = "easy", judge_score: float = 1.0) -> Score:
+    return Score(
+        original_workflow="name: original\n",
+        generated_workflow=f"name: generated {workflow_id}\n",
+        judgement="fine",
+        judge_score=judge_score,
+        bleu_score=0.5,
+        meteor_score=0.25,
+        lint_valid=True,
+        lint_output=[{"message": "warning", "kind": "syntax-check"}],
+        vulnerabilities=[],
+        functional_test=FunctionalTestResult(
+            fully_ran=False,
+            dryrun_output=[{"msg": "dry run"}],
+            dryrun_errors=[],
+            output=[],
+            errors=[],
+            return_code=None,
+        ),
+        difficulty_tier=tier,
+        difficulty_score=2,
+        graph_name="main",
+        workflow_id=workflow_id,
+        prompt_level=1,
+        prompt="write a workflow",
+    )
+
+
+def parts(store: ResultsStore, table: str = "scores") -> list[str]:
+    return glob.glob(f"{store.directory}/{table}/*.parquet")
+
+
+def test_parts_written_per_batch(tmp_path):
+    written = []
+    store = ResultsStore(
+        str(tmp_path),
+        rows_per_part=2,
+        on_write=lambda ids, part: written.append((ids, part)),
+    )
+    for workflow_id in range(3):
+        store.append(make_score(workflow_id))
+    assert [ids for ids, _ in written] == [[0, 1]]
+    assert len(parts(store)) == len(parts(store, "details")) == 1
+    store.flush()
+    assert [ids for ids, _ in written] == [[0, 1], [2]]
+    # Nothing buffered, nothing written.
+    store.flush()
+    assert len(written) == 2
+
+    assert store.scores([2, 0]) == [
+        row for row in store.scan().collect().to_dicts() if row["workflow_id"] != 1
+    ]
+    [row] = store.scores([1])
+    assert row["lint_errors"] == 1 and row["functional_test_return_code"] is None
+
+
+def test_flush_interval(tmp_path):
+    store = ResultsStore(str(tmp_path), flush_interval=0)
+    store.append(make_score(1))
+    assert len(parts(store)) == 1
+
+
+def test_details(tmp_path):
+    store = ResultsStore(str(tmp_path))
+    store.append(make_score(1))
+    store.append(make_score(2))
+    store.flush()
+    [row] = store.details([2], columns=["generated_workflow", "lint_output"])
+    assert row == {
+        "workflow_id": 2,
+        "generated_workflow": "name: generated 2\n",
+        # Decoded from JSON.
+        "lint_output": [{"message": "warning", "kind": "syntax-check"}],
+    }
+    assert len(store.details()) == 2
+
+
+def test_compact_drops_duplicates(tmp_path):
+    store = ResultsStore(str(tmp_path), rows_per_part=1)
+    store.append(make_score(1))
+    store.append(make_score(2))
+    # Scored again after an interruption, in another process.
+    ResultsStore(str(tmp_path), rows_per_part=1).append(make_score(1))
+    assert store.scan().collect().height == 3
+
+    store.compact()
+    assert [part.rsplit("/", 1)[1] for part in parts(store)] == ["compacted.parquet"]
+    assert sorted(store.scan().collect()["workflow_id"]) == [1, 2]
+    assert sorted(row["workflow_id"] for row in store.details()) == [1, 2]
+
+
+def test_reset(tmp_path):
+    store = ResultsStore(str(tmp_path))
+    assert store.config() is None
+    store.append(make_score(1))
+    store.flush()
+    store.reset("abc")
+    assert store.config() == "abc"
+    assert store.scan().collect().height == 0
+    assert store.scores([1]) == []
+    store.reset()
+    assert store.config() is None
+
+
+def test_summarize(tmp_path):
+    store = ResultsStore(str(tmp_path))
+    store.append(make_score(1, "easy", 1.0))
+    store.append(make_score(2, "hard", 0.0))
+    store.append(make_score(3, "hard", 0.5))
+    store.flush()
+    [overall] = store.summarize().to_dicts()
+    assert overall["count"] == 3
+    assert overall["avg_judge_score"] == pytest.approx(0.5)
+    by_tier = store.summarize(["difficulty_tier"]).to_dicts()
+    assert [(row["difficulty_tier"], row["count"]) for row in by_tier] == [
+        ("easy", 1),
+        ("hard", 2),
+    ]
+
+
+def test_aggregator(tmp_path):
+    store = ResultsStore(str(tmp_path))
+    aggregator = ScoreAggregator(store)
+    aggregator.add(make_score(1, "easy", 1.0))
+    aggregator.add(make_score(2, "hard", 0.0))
+    # A score from before a resume is counted, not stored again.
+    aggregator.add_row(score_row(make_score(3, "easy", 1.0)))
+
+    summary = aggregator.summary()
+    assert summary["overall"]["count"] == 3
+    assert summary["overall"]["avg_judge_score"] == pytest.approx(2 / 3)
+    assert summary["tiers"]["easy"]["count"] == 2
+    assert summary["tiers"]["hard"]["lint_success_rate"] == 1
+    with open(tmp_path / "progress.json") as f:
+        assert json.load(f) == summary
+
+    aggregator.close()
+    assert sorted(store.scan().collect()["workflow_id"]) == [1, 2]
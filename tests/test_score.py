@@ -0,0 +1,242 @@
+import asyncio
+import sys
+from pathlib import Path
+from typing import cast
+
+import pytest
+
+from models import score as score_module
+from models.score import (
+    Score,
+    metrics_executor,
+    shutdown_metrics_executor,
+)
+from models.workflow import Workflow
+from utils.app_types import WorkflowYAML
+from utils.functional_test import FunctionalTestResult
+from utils.lint import CheckerError
+from utils.results_store import ResultsStore, ScoreAggregator
+
+
+def make_workflow(id: int, workflow: str) -> Workflow:
+    return Workflow(
+        id=id,
+        repository_id=id,
+        repository_name="repository",
+        repository_owner="owner",
+        file_name="ci.yml",
+        file_content=workflow,
+        mainLanguage="Python",
+        tokens_count=0,
+        augmented_workflow=workflow,
+        workflow=cast(WorkflowYAML, workflow),
+        triggers=["push"],
+        nb_triggers=1,
+        nb_actions=0,
+        nb_jobs=1,
+        actions=[],
+        actions_details=[],
+        nb_reusable_workflows=0,
+        reusable_workflows=[],
+        nb_steps=1,
+        cyclomatic_complexity=1,
+        prompt_level1=f"prompt {id}",
+        prompt_level2=f"prompt {id}",
+        prompt_level3=f"prompt {id}",
+    )
+
+
+def workflow_yaml(name: str) -> str:
+    return (
+        f"name: {name}\n"
+        "on: push\n"
+        "jobs:\n"
+        "  build:\n"
+        "    runs-on: ubuntu-latest\n"
+        "    steps:\n"
+        "      - run: make test\n"
+    )
+
+
+@pytest.fixture
+def batch_checks(monkeypatch):
+    """Replaces actionlint, zizmor and the judge, recording the batches linted.
+    The per-workflow checks fail, as new_many must not fall back to them."""
+    calls: dict[str, list[list[str]]] = {"lint": [], "vulnerabilities": []}
+
+    def validate_workflows(workflows):
+        calls["lint"].append(list(workflows))
+        return [
+            {"valid": i % 2 == 0, "output": [{"message": f"lint {i}", "kind": "k"}]}
+            for i in range(len(workflows))
+        ]
+
+    def check_vulnerabilities_batch(workflows):
+        calls["vulnerabilities"].append(list(workflows))
+        return [[{"ident": f"finding {i}"}] for i in range(len(workflows))]
+
+    async def single_check(workflow):
+        raise AssertionError("workflow checked on its own")
+
+    async def run_judgement(template, prompt, generated_workflow):
+        if "unjudgeable" in generated_workflow:
+            raise ValueError("no score in judgement")
+        return f"judged {prompt}", 4.0
+
+    monkeypatch.setattr(score_module, "validate_workflows", validate_workflows)
+    monkeypatch.setattr(
+        score_module, "check_vulnerabilities_batch", check_vulnerabilities_batch
+    )
+    monkeypatch.setattr(score_module, "validate_workflow_async", single_check)
+    monkeypatch.setattr(score_module, "check_vulnerabilities_async", single_check)
+    monkeypatch.setattr(score_module, "run_judgement", run_judgement)
+    yield calls
+    shutdown_metrics_executor()
+
+
+def test_new_many_lints_the_batch_once(batch_checks):
+    functional_result = FunctionalTestResult(
+        fully_ran=True,
+        dryrun_output=[],
+        dryrun_errors=[],
+        output=[],
+        errors=[],
+        return_code=0,
+    )
+    workflows = [make_workflow(i, workflow_yaml(f"w{i}")) for i in range(3)]
+    batch = [
+        (workflows[0], workflows[0].workflow, functional_result),
+        (workflows[1], None, None),
+        (workflows[2], cast(WorkflowYAML, workflow_yaml("other")), None),
+    ]
+
+    scores = asyncio.run(Score.new_many(batch, 1, "main", max_concurrent=2))
+
+    generated = [workflows[0].workflow, "", workflow_yaml("other")]
+    assert batch_checks == {"lint": [generated], "vulnerabilities": [generated]}
+    assert [score.workflow_id for score in scores] == [0, 1, 2]
+    assert [score.generated_workflow for score in scores] == generated
+    assert [score.lint_valid for score in scores] == [True, False, True]
+    assert [score.lint_output[0]["message"] for score in scores] == [
+        "lint 0",
+        "lint 1",
+        "lint 2",
+    ]
+    assert [score.vulnerabilities[0]["ident"] for score in scores] == [
+        "finding 0",
+        "finding 1",
+        "finding 2",
+    ]
+    assert [score.judgement for score in scores] == [
+        "judged prompt 0",
+        "judged prompt 1",
+        "judged prompt 2",
+    ]
+    # The metrics come from the process pool.
+    assert scores[0].bleu_score == pytest.approx(1.0)
+    assert scores[1].bleu_score == 0.0
+    assert 0.0 < scores[2].bleu_score < 1.0
+    assert scores[0].functional_test is functional_result
+    assert scores[1].functional_test.fully_ran is False
+
+
+def test_new_many_returns_failures(batch_checks):
+    workflows = [make_workflow(i, workflow_yaml(f"w{i}")) for i in range(3)]
+    batch = [
+        (workflows[0], workflows[0].workflow, None),
+        (workflows[1], cast(WorkflowYAML, workflow_yaml("unjudgeable")), None),
+        (workflows[2], workflows[2].workflow, None),
+    ]
+
+    scores = asyncio.run(Score.new_many(batch, 1, "main"))
+
+    assert isinstance(scores[1], ValueError)
+    assert [score.workflow_id for score in (scores[0], scores[2])] == [0, 2]
+
+
+@pytest.fixture
+def mp_benchmark(monkeypatch):
+    monkeypatch.syspath_prepend(
+        str(Path(__file__).parent.parent / "src" / "benchmarks")
+    )
+    import mp_benchmark
+
+    monkeypatch.setattr(mp_benchmark, "log_score", lambda score: None)
+    yield mp_benchmark
+    sys.modules.pop("mp_benchmark")
+
+
+def run_scoring_worker(mp_benchmark, batch, aggregator: ScoreAggregator) -> None:
+    async def run():
+        tested: asyncio.Queue = asyncio.Queue()
+        for item in batch:
+            tested.put_nowait(item)
+        tested.put_nowait(None)
+        await mp_benchmark.scoring_worker(
+            tested, aggregator, 1, "main", len(batch), batch_size=2
+        )
+
+    asyncio.run(run())
+    aggregator.close()
+
+
+def test_scoring_worker_skips_failed_workflows(batch_checks, mp_benchmark, tmp_path):
+    workflows = [make_workflow(i, workflow_yaml(f"w{i}")) for i in range(5)]
+    batch = [(workflow, workflow.workflow, None) for workflow in workflows]
+    batch[3] = (workflows[3], cast(WorkflowYAML, workflow_yaml("unjudgeable")), None)
+    written: list[int] = []
+    store = ResultsStore(str(tmp_path), on_write=lambda ids, part: written.extend(ids))
+    aggregator = ScoreAggregator(store)
+
+    run_scoring_worker(mp_benchmark, batch, aggregator)
+
+    # Every batch went through, the one with the failure included, and only
+    # the failed workflow is missing from the store.
+    assert len(batch_checks["lint"]) == 3
+    assert aggregator.overall.count == 4
+    assert sorted(written) == [0, 1, 2, 4]
+    assert sorted(row["workflow_id"] for row in store.scores(list(range(5)))) == [
+        0,
+        1,
+        2,
+        4,
+    ]
+
+
+def test_scoring_worker_skips_unlintable_batches(
+    batch_checks, mp_benchmark, monkeypatch, tmp_path
+):
+    def validate_workflows(workflows):
+        if any("w1" in workflow for workflow in workflows):
+            raise CheckerError("actionlint exited with 3")
+        return [{"valid": True, "output": []} for _ in workflows]
+
+    monkeypatch.setattr(score_module, "validate_workflows", validate_workflows)
+    workflows = [make_workflow(i, workflow_yaml(f"w{i}")) for i in range(3)]
+    aggregator = ScoreAggregator(ResultsStore(str(tmp_path)))
+
+    run_scoring_worker(
+        mp_benchmark,
+        [(workflow, workflow.workflow, None) for workflow in workflows],
+        aggregator,
+    )
+
+    # The batch of w0 and w1 is skipped; w2 is scored on its own.
+    assert aggregator.overall.count == 1
+
+
+def test_new_many_empty_batch(batch_checks):
+    assert asyncio.run(Score.new_many([], 1, "main")) == []
+
+
+def test_shutdown_metrics_executor():
+    executor = metrics_executor()
+    assert metrics_executor() is executor
+    shutdown_metrics_executor()
+    with pytest.raises(RuntimeError):
+        executor.submit(len, "")
+    # Later scoring starts a new pool.
+    replacement = metrics_executor()
+    assert replacement is not executor
+    shutdown_metrics_executor()
+    shutdown_metrics_executor()